@@ -0,0 +1,161 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from crossings import ThresholdCrossingIndex
+from store import TimeSeriesStore
+
+
+class AggregateIndex:
+    """
+    Precomputed aggregates over columns of a store which answer the statistics of any range of rows without going over
+    the rows in it:
+
+    - Prefix sums of the values and of the number of (not missing) values, the mean is the difference of two of each.
+    - A sparse table of the minimum and maximum of every block of block_size rows. The blocks completely inside a range
+      are covered by two (overlapping) entries of the table and only the rows of the partial blocks at its edges are
+      looked at, so it's constant time independent of the length of the range.
+    - Prefix sums of how long every row lasts (until the next row, at most max_row_duration in case of gaps). Together
+      with the runs below a threshold of a ThresholdCrossingIndex, that's the time spent below it.
+    """
+
+    def __init__(self, store: TimeSeriesStore, columns: Iterable[str], max_row_duration: np.timedelta64,
+                 block_size=64):
+        self.columns = list(columns)
+        self.max_row_duration = pd.Timedelta(max_row_duration).value
+        self.block_size = block_size
+        self.length = 0
+        # prefix sums have one more entry than there are rows, the one at a position sums up the rows before it
+        self.sums = {col: np.zeros(1) for col in self.columns}
+        # int32 is enough for the number of rows of any dataset that fits in memory and halves the size of the counts
+        self.counts = {col: np.zeros(1, np.int32) for col in self.columns}
+        self.durations = np.zeros(1, np.int64)
+        # the levels of the sparse tables, level k holds the extreme of 2^k blocks starting at every block
+        self.minima = {col: [store.columns[col][:0]] for col in self.columns}
+        self.maxima = {col: [store.columns[col][:0]] for col in self.columns}
+        self._values = {col: store.columns[col] for col in self.columns}
+        # (column, threshold) -> (runs they were computed for, length, prefix sums of the duration of every run)
+        self._run_durations: Dict[Tuple[str, int], Tuple[np.ndarray, int, np.ndarray]] = {}
+        self.extend(store)
+
+    def extend(self, store: TimeSeriesStore):
+        """
+        Adds the rows which were appended to the store since it was last indexed. The store must still start with all
+        the rows indexed before.
+        """
+        offset = self.length
+        if len(store) == offset:
+            return
+
+        for col in self.columns:
+            values = store.columns[col]
+            new_values = values[offset:].astype(np.float64)
+            self.sums[col] = np.append(self.sums[col], self.sums[col][-1] + np.nancumsum(new_values))
+            counts = np.cumsum(~np.isnan(new_values), dtype=np.int32)
+            self.counts[col] = np.append(self.counts[col], self.counts[col][-1] + counts)
+            self._values[col] = values
+
+            # the last block might have been partial, it's computed again with the new rows
+            first_block = offset // self.block_size
+            blocks = np.arange(first_block * self.block_size, len(values), self.block_size)
+            minima = np.append(self.minima[col][0][:first_block], np.fmin.reduceat(values, blocks))
+            maxima = np.append(self.maxima[col][0][:first_block], np.fmax.reduceat(values, blocks))
+            self.minima[col] = _sparse_table(minima, np.fmin)
+            self.maxima[col] = _sparse_table(maxima, np.fmax)
+
+        # the previously last row only lasts until the first new one now
+        changed = max(offset - 1, 0)
+        durations = np.minimum(np.diff(store.times[changed:], append=store.times[-1]), self.max_row_duration)
+        self.durations = np.append(self.durations[:changed + 1], self.durations[changed] + np.cumsum(durations))
+        self.length = len(store)
+
+    def mean(self, column: str, start: int, stop: int) -> float:
+        """Returns the mean of a column's values from start (inclusive) to stop (exclusive), NaN if there are none."""
+        start, stop = self._clip(start, stop)
+        count = self.counts[column][stop] - self.counts[column][start]
+        return (self.sums[column][stop] - self.sums[column][start]) / count if count else np.nan
+
+    def minimum(self, column: str, start: int, stop: int) -> float:
+        """Same as mean but the minimum."""
+        return self._extreme(self.minima[column], np.fmin, column, start, stop)
+
+    def maximum(self, column: str, start: int, stop: int) -> float:
+        """Same as mean but the maximum."""
+        return self._extreme(self.maxima[column], np.fmax, column, start, stop)
+
+    def duration(self, start: int, stop: int) -> int:
+        """Returns how long the rows from start (inclusive) to stop (exclusive) last together in nanoseconds."""
+        start, stop = self._clip(start, stop)
+        return int(self.durations[stop] - self.durations[start])
+
+    def time_below(self, column: str, threshold: float, start: int, stop: int,
+                   crossings: Optional[ThresholdCrossingIndex] = None) -> int:
+        """
+        Returns how long the values of a column from start (inclusive) to stop (exclusive) were below a threshold in
+        nanoseconds. With a crossing index for the same store which covers the threshold, only the first and last run
+        below it in the range are looked up, otherwise the rows are scanned.
+        """
+        start, stop = self._clip(start, stop)
+        if crossings is None or not crossings.covers(column, threshold):
+            below = self._values[column][start:stop] < threshold
+            return int(np.diff(self.durations[start:stop + 1])[below].sum())
+
+        run_starts, run_ends = crossings.runs(column, threshold)
+        cumulative = self._cumulative_run_durations(column, int(threshold), run_starts, run_ends)
+        first = np.searchsorted(run_ends, start, side="right")  # first run which didn't end before start
+        last = np.searchsorted(run_starts, stop)  # first run which starts at or after stop
+        if first >= last:
+            return 0
+
+        # the runs at the edges only count within the range
+        total = cumulative[last] - cumulative[first]
+        total -= self.durations[max(run_starts[first], start)] - self.durations[run_starts[first]]
+        total -= self.durations[run_ends[last - 1]] - self.durations[min(run_ends[last - 1], stop)]
+        return int(total)
+
+    def _cumulative_run_durations(self, column: str, threshold: int, run_starts: np.ndarray,
+                                  run_ends: np.ndarray) -> np.ndarray:
+        """Returns the prefix sums of the durations of the runs, computed again once the runs or the rows changed."""
+        key = column, threshold
+        cached = self._run_durations.get(key)
+        if cached is None or cached[0] is not run_starts or cached[1] != self.length:
+            run_durations = self.durations[run_ends] - self.durations[run_starts]
+            cached = run_starts, self.length, np.append(0, np.cumsum(run_durations))
+            self._run_durations[key] = cached
+
+        return cached[2]
+
+    def _extreme(self, levels: List[np.ndarray], ufunc: np.ufunc, column: str, start: int, stop: int) -> float:
+        start, stop = self._clip(start, stop)
+        if start >= stop:
+            return np.nan
+
+        values = self._values[column]
+        # the blocks completely inside the range
+        first_block = -(-start // self.block_size)
+        last_block = stop // self.block_size
+        if first_block >= last_block:
+            return float(ufunc.reduce(values[start:stop]))
+
+        level = (last_block - first_block).bit_length() - 1
+        inner = ufunc(levels[level][first_block], levels[level][last_block - (1 << level)])
+        head = values[start:first_block * self.block_size]
+        tail = values[last_block * self.block_size:stop]
+        return float(ufunc.reduce(np.concatenate([head, tail, [inner]])))
+
+    def _clip(self, start: int, stop: int) -> Tuple[int, int]:
+        # rows appended to the store after it was last indexed aren't aggregated yet
+        return min(start, self.length), min(stop, self.length)
+
+
+def _sparse_table(values: np.ndarray, ufunc: np.ufunc) -> List[np.ndarray]:
+    """Returns the levels of a sparse table, level k holds the ufunc (e.g. fmin) of 2^k values from every position."""
+    levels = [values]
+    width = 1
+    while 2 * width <= len(values):
+        previous = levels[-1]
+        levels.append(ufunc(previous[:len(previous) - width], previous[width:]))
+        width *= 2
+
+    return levels
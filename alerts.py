@@ -0,0 +1,418 @@
+"""
+Headless alerts: tells whoever listens when to fire up ("You should fire up 40 minutes from now") without anyone
+having the dashboard open. Run it from the project root with `python alerts.py` (see --help), e.g.
+`python alerts.py --sink file --sink udp` appends every alert to ALERTS_PATH and sends it to ALERT_SOCKET_ADDRESS.
+
+Every ALERT_TICK_INTERVAL, the recommendation of the dashboard (see plots.construct_action_phrase) is evaluated for
+every unit with its default view. An alert (FIRE_UP) is sent once the suggested fire-up time is less than ALERT_LEAD
+away, and another one (RESOLVED) once it isn't anymore, e.g. because the unit was fired up.
+
+The evaluator of a unit (see AlertEvaluator) keeps its state between ticks instead of computing the period and its
+prediction from scratch: as the prediction window moves forward, the first rows below the thresholds are only searched
+in the rows which entered it, and the continuation after a heating up in the window (see
+data.continuation_after_heating_up) is only matched when a heating up enters or leaves the window. Its counters (see
+EvaluatorStats) show what every tick cost.
+"""
+import argparse
+import json
+import logging
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import humanize
+import numpy as np
+import pandas as pd
+
+from crossings import ThresholdCrossingIndex, first_time_below
+from data import PREDICTED_COLUMNS, PREDICTED_PERIOD, HEATING_UP, HIT_POINT_DETECTION_PAST_OFFSET, load_data, \
+    load_units, load_crossing_index, load_cycle_index, preload_units, follow_shared_data, \
+    continuation_after_heating_up, quantize_temperatures
+from live import start_live_ingestion
+from plots import LABELS, advised_column
+from shared import HitTimes, ThresholdCrossings, Thresholds, PROJECT_TIMEZONE, DEFAULT_LOWER_THRESHOLD, \
+    DEFAULT_UPPER_THRESHOLD, SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS, is_in_winter_mode
+from store import TimeSeriesStore
+from units import DEFAULT_UNIT
+
+ALERT_TICK_INTERVAL = 60  # seconds
+# "fire up within the hour": alert once the suggested fire-up time (see SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS)
+# is less than this away
+ALERT_LEAD = timedelta(hours=1)
+# the default thresholds of the dashboard
+ALERT_THRESHOLDS = Thresholds(DEFAULT_UPPER_THRESHOLD, DEFAULT_LOWER_THRESHOLD)
+# the counters of every unit are printed every this many ticks (hourly by default)
+REPORT_TICKS = 60
+
+# where the sinks (see SINKS) send the alerts to by default
+ALERTS_PATH = "data/alerts.jsonl"
+ALERT_SOCKET_ADDRESS = ("127.0.0.1", 8503)  # next to the data API (see api.py)
+
+FIRE_UP = "fire up"
+RESOLVED = "resolved"
+
+# the windows of the dataset the evaluator searches: the prediction and the past the hit times fall back to (see
+# HIT_POINT_DETECTION_PAST_OFFSET)
+PREDICTED = "predicted"
+PAST = "past"
+
+logger = logging.getLogger(__name__)
+
+
+class Alert(NamedTuple):
+    """An alert about a unit, sent to the sinks."""
+    unit: str
+    time: datetime  # when it was evaluated
+    kind: str  # FIRE_UP or RESOLVED
+    column: str  # the temperature the recommendation is based on (see advised_column)
+    fire_up_time: Optional[datetime]  # when to fire up, None if RESOLVED
+    crossing_time: Optional[datetime]  # when the temperature falls below the lower threshold, None if RESOLVED
+    message: str  # like the recommendation of the dashboard
+
+    def to_json(self) -> str:
+        return json.dumps({field: value.isoformat() if isinstance(value, datetime) else value
+                           for field, value in self._asdict().items()})
+
+
+class EvaluatorStats(NamedTuple):
+    """What the ticks of an evaluator cost so far."""
+    ticks: int
+    skipped: int  # while the unit was being fired up, there's nothing to recommend
+    continuations: int  # how often a continuation after a heating up was matched (see AlertEvaluator)
+    searches: int  # searches for the first row below a threshold
+    scanned_rows: int  # rows scanned by the searches whose thresholds aren't indexed (see ThresholdCrossingIndex)
+    alerts: int
+    seconds: float  # all ticks together
+    max_seconds: float  # the slowest tick
+
+    @property
+    def mean_ms(self) -> float:
+        return self.seconds / self.ticks * 1000 if self.ticks else 0.
+
+
+class _Continuation(NamedTuple):
+    """The continuation after the first heating up in the prediction window, the first times below every threshold."""
+    heating_up: int  # the position of the heating up in the dataset
+    in_winter_mode: bool
+    start_time: Optional[pd.Timestamp]
+    first_times_below: Dict[Tuple[str, float], Optional[pd.Timestamp]]  # by column and threshold
+
+
+class _RowsBelow:
+    """
+    The rows below a threshold in a window of the dataset whose start and stop only move forward, for thresholds whose
+    crossings aren't indexed (see ThresholdCrossingIndex). Only the rows which entered the window since the last update
+    are scanned.
+    """
+
+    def __init__(self, column: str, threshold: float):
+        self.column = column
+        self.threshold = threshold
+        self.positions: Deque[int] = deque()
+        self.scanned_until = 0
+
+    def first(self, dataset: TimeSeriesStore, start: int, stop: int) -> Tuple[Optional[int], int]:
+        """Returns the first position in the window below the threshold (None if there is none) and the rows scanned."""
+        if stop < self.scanned_until:  # the window moved back, nothing is known about it
+            self.positions.clear()
+            self.scanned_until = 0
+
+        while self.positions and self.positions[0] < start:
+            self.positions.popleft()
+
+        scan_from = max(start, self.scanned_until)
+        if scan_from < stop:
+            below = np.flatnonzero(np.asarray(dataset.columns[self.column][scan_from:stop]) < self.threshold)
+            self.positions.extend((below + scan_from).tolist())
+
+        self.scanned_until = max(self.scanned_until, stop)
+        return (self.positions[0] if self.positions else None), max(stop - scan_from, 0)
+
+
+class AlertEvaluator:
+    """
+    Evaluates the recommendation for a unit at every tick (see tick) and returns the alerts to send. The state it keeps
+    between ticks refers to the dataset of the unit, which is only ever appended to. If the dataset is replaced (e.g.
+    the unit was evicted and loaded again), it starts over.
+
+    The prediction is the same as get_period's for the default view at the time of the tick, except for the
+    continuation after a heating up: it's matched once when the heating up enters the window (with the history known
+    then, until PREDICTED_PERIOD after the heating up) and then cut off at the end of the window on every tick, while
+    get_period matches it anew for every period. The hit times are those of the full resolution data (see
+    DOWNSAMPLING_METHOD).
+    """
+
+    def __init__(self, unit: str = DEFAULT_UNIT, thresholds: Thresholds = ALERT_THRESHOLDS):
+        self.unit = unit
+        self.thresholds = thresholds
+        self.alerting = False
+        self._dataset: Optional[TimeSeriesStore] = None
+        self._rows_below: Dict[Tuple[str, str, float], _RowsBelow] = {}  # by window, column and threshold
+        self._continuation: Optional[_Continuation] = None
+        self._ticks = self._skipped = self._continuations = self._searches = self._scanned_rows = self._alerts = 0
+        self._seconds = self._max_seconds = 0.
+
+    def tick(self, now: datetime) -> List[Alert]:
+        """Evaluates the recommendation at a time (not before the last tick) and returns the alerts it caused."""
+        start = time.perf_counter()
+        try:
+            alerts = self._alert(now, self.hit_times(now))
+        finally:
+            seconds = time.perf_counter() - start
+            self._ticks += 1
+            self._seconds += seconds
+            self._max_seconds = max(self._max_seconds, seconds)
+
+        self._alerts += len(alerts)
+        return alerts
+
+    def hit_times(self, now: datetime) -> Optional[HitTimes]:
+        """
+        Returns the projected (or past) hit times at a time like projected_hit_times does for the default view (see
+        the class documentation). None if the unit is being fired up or there's nothing to predict from.
+        """
+        dataset = load_data(self.unit)
+        if dataset is not self._dataset:
+            self._dataset, self._rows_below, self._continuation = dataset, {}, None
+
+        now = pd.Timestamp(now)
+        current = int(np.searchsorted(dataset.times, now.value, side="right")) - 1
+        if current >= 0 and dataset.columns[HEATING_UP][current]:
+            # the unit is being fired up, the window starts in the heating up. Nothing is recommended until it's over.
+            self._skipped += 1
+            self._rows_below, self._continuation = {}, None
+            return None
+
+        start, stop = dataset.bounds(now, now + PREDICTED_PERIOD)
+        heating_up = load_cycle_index(self.unit).first_heating_up(start, stop)
+        self._update_continuation(dataset, heating_up, now)
+        continuation = self._continuation
+
+        # the recorded rows up to the heating up, followed by the continuation until the end of the window
+        recorded_stop = stop if heating_up is None else heating_up
+        first_time = dataset.time_at(start) if start < recorded_stop else \
+            continuation.start_time if continuation else None
+        if first_time is None:
+            return None
+
+        index = load_crossing_index(self.unit)
+
+        def first_time_below_in_window(column: str, threshold: float) -> Optional[pd.Timestamp]:
+            position = self._first_below(PREDICTED, dataset, index, column, threshold, start, recorded_stop)
+            if position is not None:
+                return dataset.time_at(position)
+            if continuation is None:
+                return None
+
+            time_below = continuation.first_times_below[column, threshold]
+            return time_below if time_below is not None and time_below <= now + PREDICTED_PERIOD else None
+
+        hit_times: HitTimes = {}
+        for col in PREDICTED_COLUMNS:
+            upper, lower = (first_time_below_in_window(col, threshold) for threshold in self.thresholds)
+            if upper == first_time:
+                # same as in projected_hit_times: the hit point is probably in the past, look there
+                past_start, past_stop = dataset.bounds(first_time + HIT_POINT_DETECTION_PAST_OFFSET, now)
+                past_upper, past_lower = (self._first_below(PAST, dataset, index, col, threshold, past_start,
+                                                            past_stop) for threshold in self.thresholds)
+                upper = dataset.time_at(past_upper) if past_upper is not None else upper
+                lower = dataset.time_at(past_lower) if past_lower is not None else lower
+
+            hit_times[col] = ThresholdCrossings(upper, lower)
+
+        return hit_times
+
+    def stats(self) -> EvaluatorStats:
+        return EvaluatorStats(self._ticks, self._skipped, self._continuations, self._searches, self._scanned_rows,
+                              self._alerts, self._seconds, self._max_seconds)
+
+    def _first_below(self, window: str, dataset: TimeSeriesStore, index: ThresholdCrossingIndex, column: str,
+                     threshold: float, start: int, stop: int) -> Optional[int]:
+        # the first position from start to stop (exclusive) below the threshold in a window which only moves forward
+        # (PREDICTED or PAST), looked up if it's indexed
+        self._searches += 1
+        if index.covers(column, threshold):
+            return index.first_below(column, threshold, start, stop)
+
+        rows_below = self._rows_below.setdefault((window, column, threshold), _RowsBelow(column, threshold))
+        position, scanned_rows = rows_below.first(dataset, start, stop)
+        self._scanned_rows += scanned_rows
+        return position
+
+    def _update_continuation(self, dataset: TimeSeriesStore, heating_up: Optional[int], now: pd.Timestamp):
+        if heating_up is None:
+            self._continuation = None
+            return
+
+        in_winter_mode = is_in_winter_mode(now, load_units()[self.unit].season)
+        continuation = self._continuation
+        if continuation is not None and (continuation.heating_up, continuation.in_winter_mode) == (heating_up,
+                                                                                                  in_winter_mode):
+            return
+
+        # a heating up entered the window (or the season changed), its continuation is long enough for every tick
+        # until the window starts with it
+        self._continuations += 1
+        heating_up_row = dataset.row(heating_up, PREDICTED_COLUMNS)
+        parts = continuation_after_heating_up(self.unit, in_winter_mode, quantize_temperatures(heating_up_row),
+                                              heating_up_row.name, now, heating_up_row.name + PREDICTED_PERIOD)
+        start_time = next((part.rows.time_at(0) for part in parts if len(part.rows)), None)
+        first_times_below = {(col, threshold): first_time_below(parts, col, threshold)
+                             for col in PREDICTED_COLUMNS for threshold in self.thresholds}
+        self._continuation = _Continuation(heating_up, in_winter_mode, start_time, first_times_below)
+
+    def _alert(self, now: datetime, hit_times: Optional[HitTimes]) -> List[Alert]:
+        column = advised_column(now, load_units()[self.unit].season)
+        lower_hit = hit_times[column].lower if hit_times else None
+        fire_up_time = lower_hit - SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS if lower_hit else None
+        due = fire_up_time is not None and fire_up_time <= now + ALERT_LEAD
+        if due == self.alerting:
+            return []
+
+        self.alerting = due
+        if not due:
+            return [Alert(self.unit, now, RESOLVED, column, None, None, "No immediate action necessary.")]
+
+        # the same phrase as the dashboard's (see construct_action_phrase) without the html
+        fire_up_phrase = humanize.naturaltime(fire_up_time, when=now) if fire_up_time > now else "as soon as possible"
+        verb = "fell" if lower_hit < now else "will fall"
+        message = f"You should fire up {fire_up_phrase}. {LABELS[column]} {verb} below the lower threshold " \
+                  f"({self.thresholds.lower} °C) {humanize.naturaltime(lower_hit, when=now)}."
+        return [Alert(self.unit, now, FIRE_UP, column, fire_up_time.to_pydatetime(), lower_hit.to_pydatetime(),
+                      message)]
+
+
+class FileSink:
+    """Appends every alert to a file as a json line."""
+
+    def __init__(self, path: str = ALERTS_PATH):
+        self.path = path
+
+    def __call__(self, alert: Alert):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(alert.to_json() + "\n")
+
+
+class SocketSink:
+    """
+    Sends every alert as a json datagram (UDP) to a local address, e.g. of a home-automation hub. Nothing is sent back,
+    so alerts nobody listens for are lost.
+    """
+
+    def __init__(self, address: Tuple[str, int] = ALERT_SOCKET_ADDRESS):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, alert: Alert):
+        self.socket.sendto(alert.to_json().encode("utf-8"), self.address)
+
+
+def print_alert(alert: Alert):
+    print(f"{alert.time:%Y-%m-%d %H:%M} {alert.unit}: {alert.message}")
+
+
+Sink = Callable[[Alert], Any]
+
+# the sinks which can be chosen on the command line by name, with an optional argument after a colon (e.g.
+# file:alerts.jsonl or udp:127.0.0.1:9000)
+SINKS: Dict[str, Callable[..., Sink]] = {
+    "stdout": lambda: print_alert,
+    "file": FileSink,
+    "udp": lambda address=None: SocketSink(ALERT_SOCKET_ADDRESS if address is None else _address(address)),
+}
+
+
+def parse_sink(spec: str) -> Sink:
+    """Returns the sink described by a name from SINKS with an optional argument (e.g. file:alerts.jsonl)."""
+    name, _, argument = spec.partition(":")
+    if name not in SINKS:
+        raise ValueError(f"Unknown sink {name}, must be one of {', '.join(SINKS)}")
+
+    return SINKS[name](argument) if argument else SINKS[name]()
+
+
+def _address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or ALERT_SOCKET_ADDRESS[0], int(port)
+
+
+def send(alerts: Iterable[Alert], sinks: Iterable[Sink]):
+    """Sends alerts to every sink. A failing sink is only logged, the others still get them."""
+    for alert in alerts:
+        for sink in sinks:
+            try:
+                sink(alert)
+            except Exception:
+                logger.exception("Failed to send an alert to %s", sink)
+
+
+def report(evaluators: Iterable[AlertEvaluator]):
+    """Prints the counters of every evaluator."""
+    for evaluator in evaluators:
+        stats = evaluator.stats()
+        print(f"{evaluator.unit}: {stats.ticks} ticks ({stats.skipped} while firing up), {stats.continuations} "
+              f"continuations matched, {stats.searches} threshold searches ({stats.scanned_rows} rows scanned), "
+              f"{stats.mean_ms:.2f} ms per tick on average, {stats.max_seconds * 1000:.2f} ms at most, "
+              f"{stats.alerts} alerts")
+
+
+def run(sinks: List[Sink], thresholds: Thresholds = ALERT_THRESHOLDS, interval: float = ALERT_TICK_INTERVAL,
+        report_ticks: int = REPORT_TICKS):
+    """Evaluates the alerts of every unit every interval seconds until stopped (see the module documentation)."""
+    # like the data API, every unit is loaded and follows its live feed (or the process which ingests it)
+    preload_units(load_units())
+    for unit in load_units():
+        start_live_ingestion(unit)
+
+    evaluators = [AlertEvaluator(unit, thresholds) for unit in load_units()]
+    print(f"Evaluating the alerts of {len(evaluators)} units every {interval:g} seconds")
+    ticks = 0
+    while True:
+        started = time.monotonic()
+        now = datetime.now(PROJECT_TIMEZONE)
+        for evaluator in evaluators:
+            follow_shared_data(evaluator.unit)
+            send(evaluator.tick(now), sinks)
+
+        ticks += 1
+        if ticks % report_ticks == 0:
+            report(evaluators)
+
+        time.sleep(max(interval - (time.monotonic() - started), 0))
+
+
+def replay(period_from: datetime, period_to: datetime, step: str, sinks: List[Sink],
+           thresholds: Thresholds = ALERT_THRESHOLDS, unit: str = DEFAULT_UNIT) -> AlertEvaluator:
+    """Evaluates the alerts of a unit at every step in a period of the recorded data (e.g. to try the thresholds)."""
+    evaluator = AlertEvaluator(unit, thresholds)
+    for now in pd.date_range(period_from, period_to, freq=step):
+        send(evaluator.tick(now.to_pydatetime()), sinks)
+
+    return evaluator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sink", dest="sinks", action="append", default=[],
+                        help=f"where to send the alerts, any of {', '.join(SINKS)} with an optional argument after a "
+                             f"colon (e.g. file:alerts.jsonl or udp:127.0.0.1:9000), can be given several times "
+                             f"(default: stdout)")
+    parser.add_argument("--thresholds", type=float, nargs=2, metavar=("UPPER", "LOWER"), default=ALERT_THRESHOLDS,
+                        help="upper and lower threshold in °C (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=ALERT_TICK_INTERVAL,
+                        help="seconds between ticks (default: %(default)s)")
+    parser.add_argument("--replay", nargs=2, type=pd.Timestamp, metavar=("FROM", "TO"),
+                        help="evaluate the recorded data in a period instead (in PROJECT_TIMEZONE without a timezone)")
+    parser.add_argument("--step", default="1min", help="time between the ticks of --replay (default: %(default)s)")
+    parser.add_argument("--unit", default=DEFAULT_UNIT, help="the heating unit to --replay (see units.py)")
+    args = parser.parse_args()
+
+    alert_sinks = [parse_sink(spec) for spec in args.sinks or ["stdout"]]
+    alert_thresholds = Thresholds(*(int(t) if float(t).is_integer() else t for t in args.thresholds))
+    if args.replay:
+        replay_from, replay_to = (t if t.tzinfo else t.tz_localize(PROJECT_TIMEZONE) for t in args.replay)
+        report([replay(replay_from, replay_to, args.step, alert_sinks, alert_thresholds, args.unit)])
+    else:
+        run(alert_sinks, alert_thresholds, args.interval)
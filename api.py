@@ -0,0 +1,278 @@
+"""
+A small local HTTP API for other tools (e.g. alerting or a home-automation hub) which serves the same data the
+dashboard shows. Run it from the project root with `python api.py` (see --help). All endpoints are GET requests:
+
+- /period: the recorded data in a period (see data.get_period), all of it unless max_points is given.
+- /prediction: the prediction for PREDICTED_PERIOD after the end of a period.
+- /hit-times: when the temperatures are predicted to drop below the upper and lower threshold (see
+  data.projected_hit_times).
+
+They take the period as `from` and `to` (ISO 8601, in PROJECT_TIMEZONE if without a timezone). `to` defaults to (and
+is at most) the last recorded time and `from` to DEFAULT_DATE_OFFSET before `to` (like the dashboard). /period also
+takes `max_points`, /hit-times `upper` and `lower` (DEFAULT_UPPER_THRESHOLD and DEFAULT_LOWER_THRESHOLD). With several
+units (see units.py), `unit` selects one of them (the first by default).
+
+Every response is a table with a time column (the column for /hit-times) and is sent as gzip'd JSON records (if the
+client accepts gzip) or as an Arrow IPC stream (with `format=arrow` or an Accept header of ARROW_STREAM). Large
+periods are streamed in chunks of CHUNK_ROWS rows. Smaller responses are cached (already encoded) until new rows are
+added to the dataset and have an ETag, so clients polling the latest data every minute mostly get a 304 or a cached
+response.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import io
+import zlib
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytz
+import tornado.web
+from pandas.api.types import is_datetime64tz_dtype
+
+from data import get_period, projected_hit_times, load_data, load_units, preload_units, follow_shared_data
+from live import start_live_ingestion
+from shared import Thresholds, PROJECT_TIMEZONE, DEFAULT_DATE_OFFSET, DEFAULT_LOWER_THRESHOLD, DEFAULT_UPPER_THRESHOLD
+
+API_ADDRESS = "127.0.0.1"  # only local clients
+API_PORT = 8502  # next to Streamlit's default 8501
+
+# only the crossing parts of the period are needed for the hit times, not the (downsampled) rows of the period
+HIT_TIMES_MAX_POINTS = 100
+
+# responses with more rows are streamed in chunks of this many rows (a record batch each with Arrow) and not cached
+CHUNK_ROWS = 50_000
+# number of encoded responses to keep. Their key contains the number of rows in the dataset, new rows invalidate them.
+RESPONSE_CACHE_SIZE = 128
+# clients can reuse a response for this long before asking again (with the ETag, which is cheap if nothing changed)
+MAX_AGE = 30  # seconds
+
+# temperatures are recorded in steps of 0.1 °C (0.05 °C for averages), more decimals in JSON would only show the noise
+# of their float32 values. Arrow has the exact values.
+JSON_DECIMALS = 3
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+JSON = "application/json"
+ARROW_FORMAT = "arrow"
+
+PERIOD = "period"
+PREDICTION = "prediction"
+HIT_TIMES = "hit-times"
+
+
+class Query(NamedTuple):
+    """A request to one of the endpoints with all its parameters resolved, the key of the response cache."""
+    endpoint: str
+    period_from: pd.Timestamp
+    period_to: pd.Timestamp
+    max_points: Optional[int]
+    thresholds: Thresholds
+    arrow: bool
+    unit: str
+    dataset_rows: int  # number of rows in the dataset of the unit when it was made
+
+
+class DataHandler(tornado.web.RequestHandler):
+    """Answers the requests to an endpoint, see the module documentation."""
+
+    def initialize(self, endpoint: str):
+        self.endpoint = endpoint
+
+    async def get(self):
+        loop = asyncio.get_running_loop()
+        unit = self.get_query_argument("unit", None) or next(iter(load_units()))
+        if unit not in load_units():
+            raise tornado.web.HTTPError(404, reason=f"No unit {unit}")
+
+        # picks up the rows another process ingested if the dataset is shared (see data.SHARE_DATASET)
+        await loop.run_in_executor(None, follow_shared_data, unit)
+        # loads the unit if it isn't loaded (anymore)
+        await loop.run_in_executor(None, load_data, unit)
+        query = self._query(unit)
+        self.set_header("Content-Type", ARROW_STREAM if query.arrow else JSON)
+        self.set_header("Vary", "Accept, Accept-Encoding")
+        self.set_header("Cache-Control", f"max-age={MAX_AGE}")
+        # known before the response is computed, so a 304 doesn't need to compute it
+        self.set_header("ETag", f'"{hashlib.sha1(repr(query).encode()).hexdigest()}"')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        gzipped = not query.arrow and "gzip" in self.request.headers.get("Accept-Encoding", "")
+        if gzipped:
+            self.set_header("Content-Encoding", "gzip")
+
+        if _result_rows(query) <= CHUNK_ROWS:
+            self.finish(await loop.run_in_executor(None, _response, query, gzipped))
+            return
+
+        frame = await loop.run_in_executor(None, _frame, query)
+        chunks = _arrow_chunks(frame) if query.arrow else _json_chunks(frame, gzipped)
+        # encoding a chunk is done in between sending the previous ones, not all of it up front
+        while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+            self.write(chunk)
+            await self.flush()
+
+        self.finish()
+
+    def _query(self, unit: str) -> Query:
+        arrow = self.get_query_argument("format", None) == ARROW_FORMAT or \
+            ARROW_STREAM in self.request.headers.get("Accept", "")
+        dataset = load_data(unit)
+        period_to = self._time_argument("to", lambda: dataset.time_at(-1))
+        period_from = self._time_argument("from", lambda: period_to - DEFAULT_DATE_OFFSET)
+        if period_from >= period_to:
+            raise tornado.web.HTTPError(400, reason="from must be before to")
+
+        # nothing is recorded after the last time, the prediction starts there at the latest
+        period_to = min(period_to, dataset.time_at(-1))
+        start, stop = dataset.bounds(period_from, period_to)
+        if start == stop:
+            raise tornado.web.HTTPError(404, reason="No data in the period")
+
+        max_points = self._number_argument("max_points", None, int) if self.endpoint == PERIOD else None
+        if max_points is not None and max_points < 3:
+            raise tornado.web.HTTPError(400, reason="max_points must be at least 3")
+
+        thresholds = Thresholds(DEFAULT_UPPER_THRESHOLD, DEFAULT_LOWER_THRESHOLD)
+        if self.endpoint == HIT_TIMES:
+            thresholds = Thresholds(self._number_argument("upper", DEFAULT_UPPER_THRESHOLD, float),
+                                    self._number_argument("lower", DEFAULT_LOWER_THRESHOLD, float))
+
+        return Query(self.endpoint, period_from, period_to, max_points, thresholds, arrow, unit, len(dataset))
+
+    def _time_argument(self, name: str, default) -> pd.Timestamp:
+        value = self.get_query_argument(name, None)
+        if value is None:
+            return default()
+
+        try:
+            time = pd.Timestamp(value)
+            return time.tz_localize(PROJECT_TIMEZONE) if time.tz is None else time.tz_convert(PROJECT_TIMEZONE)
+        except pytz.InvalidTimeError:
+            # skipped or repeated when switching to or from daylight saving time
+            raise tornado.web.HTTPError(400, reason=f"{name} is ambiguous or doesn't exist in {PROJECT_TIMEZONE}, "
+                                                    f"add the UTC offset")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be an ISO 8601 time")
+
+    def _number_argument(self, name: str, default, number_type):
+        value = self.get_query_argument(name, None)
+        try:
+            return default if value is None else number_type(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be a number")
+
+
+def make_app() -> tornado.web.Application:
+    return tornado.web.Application([
+        (rf"/{endpoint}", DataHandler, {"endpoint": endpoint}) for endpoint in (PERIOD, PREDICTION, HIT_TIMES)
+    ])
+
+
+def _result_rows(query: Query) -> int:
+    """Returns how many rows the response to a query has at most without computing it."""
+    if query.endpoint != PERIOD or query.max_points is not None:
+        return 0  # a few thousand at most
+
+    start, stop = load_data(query.unit).bounds(query.period_from, query.period_to)
+    return stop - start
+
+
+@lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def _response(query: Query, gzipped: bool) -> bytes:
+    """Returns the whole body of the response to a query, gzip'd if wanted (JSON only)."""
+    frame = _frame(query)
+    if query.arrow:
+        return b"".join(_arrow_chunks(frame))
+
+    body = _json(frame)
+    return gzip.compress(body) if gzipped else body
+
+
+def _frame(query: Query) -> pd.DataFrame:
+    """Returns the table a query responds with."""
+    max_points = HIT_TIMES_MAX_POINTS if query.endpoint == HIT_TIMES else query.max_points
+    _, data, predicted = get_period(query.period_from, query.period_to, max_points=max_points, unit=query.unit)
+    if query.endpoint == PERIOD:
+        return data.rename_axis("time")
+    if query.endpoint == PREDICTION:
+        return predicted.rename_axis("time")
+
+    hit_times = projected_hit_times(data, predicted, query.thresholds)
+    return pd.DataFrame({
+        "upper": pd.to_datetime([hits.upper for hits in hit_times.values()], utc=True).tz_convert(PROJECT_TIMEZONE),
+        "lower": pd.to_datetime([hits.lower for hits in hit_times.values()], utc=True).tz_convert(PROJECT_TIMEZONE),
+    }, index=pd.Index(hit_times.keys(), name="column"))
+
+
+def _arrow_chunks(frame: pd.DataFrame) -> Iterator[bytes]:
+    """Yields an Arrow IPC stream of the frame (with its index as a column) in chunks of a record batch each."""
+    table = pa.Table.from_pandas(frame.reset_index(), preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield _take(sink)
+
+    yield _take(sink)  # the end of the stream
+
+
+def _json_chunks(frame: pd.DataFrame, gzipped: bool) -> Iterator[bytes]:
+    """Yields the frame as one JSON array of records in chunks of CHUNK_ROWS rows, gzip'd as one stream if wanted."""
+    compressor = zlib.compressobj(wbits=31) if gzipped else None  # 31: with a gzip header
+    for position in range(0, max(len(frame), 1), CHUNK_ROWS):
+        records = _json(frame.iloc[position:position + CHUNK_ROWS])
+        # parts of one array instead of one array per chunk
+        chunk = (b"[" if position == 0 else b",") + records[1:-1] + \
+            (b"]" if position + CHUNK_ROWS >= len(frame) else b"")
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if gzipped else chunk
+
+    if gzipped:
+        yield compressor.flush()
+
+
+def _json(frame: pd.DataFrame) -> bytes:
+    """Returns the frame (with its index as a column) as JSON records with times in UTC (with a Z) or null."""
+    records = frame.reset_index()
+    for col in records.columns:
+        if is_datetime64tz_dtype(records[col]):
+            # formatted up front, letting to_json format timezone-aware times is about 8 times slower
+            times = records[col].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+            formatted = pd.Series(np.datetime_as_string(times, unit="s"), dtype=object) + "Z"
+            formatted[np.isnat(times)] = None
+            records[col] = formatted
+
+    return records.to_json(orient="records", double_precision=JSON_DECIMALS).encode()
+
+
+def _take(sink: io.BytesIO) -> bytes:
+    """Returns what was written to the sink so far and empties it."""
+    written = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return written
+
+
+async def serve(address: str, port: int):
+    # load everything up front (as far as UNIT_MEMORY_LIMIT allows), so the first requests are as fast as the others
+    preload_units(load_units())
+    for unit in load_units():
+        start_live_ingestion(unit)
+
+    make_app().listen(port, address)
+    print(f"Serving the data API on http://{address}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=API_ADDRESS, help="the address to listen on")
+    parser.add_argument("--port", type=int, default=API_PORT, help="the port to listen on")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.address, args.port))
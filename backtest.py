@@ -0,0 +1,260 @@
+"""
+Backtests the recommendation of the dashboard (see construct_action_phrase) over the history. At every step (e.g.
+every 15 minutes) the prediction is spliced like get_period does it, as if the unit was fired up right then, and the
+threshold crossings projected_hit_times finds in it are compared with the crossings which actually happened.
+Run it from the project root, e.g. `python backtest.py --step 15min --workers 8 --output backtest.csv`.
+"""
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from crossings import IndexedRows
+from data import PREDICTED_COLUMNS, PREDICTED_PERIOD, TEMPERATURE_COLUMNS, HEATING_UP, HISTORY_MATCH_WINDOW, \
+    HIT_POINT_DETECTION_PAST_OFFSET, load_data, load_units, load_crossing_index, load_cycle_index, \
+    load_cool_down_library, load_prediction_templates, projected_hit_times, continuation_after_heating_up, \
+    quantize_temperatures, frame_from_parts
+from plots import advised_column
+from shared import Thresholds, PROJECT_TIMEZONE, DEFAULT_LOWER_THRESHOLD, DEFAULT_UPPER_THRESHOLD, \
+    SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS, is_in_winter_mode
+from units import DEFAULT_UNIT
+
+BACKTEST_STEP = "15min"
+# the default thresholds of the dashboard
+BACKTEST_THRESHOLDS = Thresholds(DEFAULT_UPPER_THRESHOLD, DEFAULT_LOWER_THRESHOLD)
+# steps whose latest row is older than this (gaps in the data) are skipped, there's no current temperature there
+MAX_ROW_AGE = np.timedelta64(10, "m")
+# consecutive steps are sent to the workers in chunks of this size
+CHUNK_SIZE = 256
+
+UPPER = "upper"
+LOWER = "lower"
+
+# outcomes of a step for one threshold
+HIT = "hit"  # both the prediction and the data crossed it within the PREDICTED_PERIOD
+MISSED = "missed"  # only the data crossed it
+FALSE_ALARM = "false alarm"  # only the prediction crossed it
+NO_CROSSING = "no crossing"  # neither crossed it
+CENSORED = "censored"  # the unit was actually fired up before it crossed, so it's unknown when it would have
+OUTCOMES = [HIT, MISSED, FALSE_ALARM, NO_CROSSING, CENSORED]
+
+NAT = pd.NaT.value  # as int64 nanoseconds
+
+
+def backtest(period_from: Optional[pd.Timestamp] = None, period_to: Optional[pd.Timestamp] = None,
+             step=BACKTEST_STEP, thresholds=BACKTEST_THRESHOLDS, workers: Optional[int] = None,
+             unit: str = DEFAULT_UNIT) -> pd.DataFrame:
+    """
+    Compares the predicted crossings of the temperature the recommendation is based on (see advised_column) with the
+    actual ones at every step in a period.
+
+    Unlike in the dashboard, the prediction always starts at the step (as if the unit was fired up then) instead of at
+    the next heating up, otherwise it would simply be the recorded data up to there. The actual crossings of all the
+    steps are looked up at once in the crossing index, only the predictions are made step by step. They're spread
+    across a pool of processes (see _predict).
+
+    :param period_from: The first step, defaults to the start of the dataset plus HISTORY_MATCH_WINDOW.
+    :param period_to: The last step (inclusive), defaults to the end of the dataset minus PREDICTED_PERIOD.
+    :param step: The time between steps (pandas frequency).
+    :param thresholds: The thresholds whose crossings are compared, must be integers (see INDEXED_THRESHOLDS). Only the
+                       thresholds the temperature is still above at a step are evaluated there.
+    :param workers: How many processes make the predictions, defaults to the number of CPUs. With 1, they're made in
+                    this process.
+    :param unit: The name of the unit whose history is backtested.
+    :return: One row per evaluated step and threshold with its time, the season, the column, which threshold it is
+             (UPPER or LOWER), the temperature at the step, the predicted and actual crossing (NaT if there was none
+             within the PREDICTED_PERIOD), the outcome (see OUTCOMES) and for hits the error (predicted minus actual)
+             in hours.
+    """
+    dataset = load_data(unit)
+    index = load_crossing_index(unit)
+    season = load_units()[unit].season
+    if not all(index.covers(col, threshold) for col in PREDICTED_COLUMNS for threshold in thresholds):
+        raise ValueError(f"Only the crossings of the integer thresholds in {index.thresholds} are indexed.")
+
+    period_from = dataset.time_at(0) + HISTORY_MATCH_WINDOW if period_from is None else period_from
+    period_to = dataset.time_at(-1) - PREDICTED_PERIOD if period_to is None else period_to
+    times = pd.date_range(period_from, period_to, freq=step).tz_convert(PROJECT_TIMEZONE)
+
+    # the latest row at each step has the current temperature
+    current = np.searchsorted(dataset.times, times.asi8, side="right") - 1
+    known = (current >= 0) & (times.asi8 - dataset.times[np.maximum(current, 0)] <= pd.Timedelta(MAX_ROW_AGE).value)
+    # nothing is recommended while the unit is being fired up
+    known &= ~dataset.columns[HEATING_UP][np.maximum(current, 0)]
+
+    winter = np.array([is_in_winter_mode(time, season) for time in times], dtype=bool)
+    columns = np.array([advised_column(time, season) for time in times])
+    temperatures = np.full(len(times), np.nan)
+    for col in PREDICTED_COLUMNS:
+        selected = known & (columns == col)
+        temperatures[selected] = dataset.columns[col][current[selected]]
+
+    # NaN temperatures are never above a threshold
+    above = np.column_stack([temperatures >= threshold for threshold in thresholds])
+    steps = np.flatnonzero(above.any(axis=1))
+    if not len(steps):
+        raise ValueError("There is no data to backtest in the period.")
+
+    times, current, winter, columns, temperatures, above = \
+        times[steps], current[steps], winter[steps], columns[steps], temperatures[steps], above[steps]
+    predicted = _predict(times.asi8, thresholds, workers, unit)
+    actual, outcomes = _actual_crossings(current + 1, times.asi8, columns, thresholds, predicted, unit)
+
+    results = []
+    for position, name in enumerate((UPPER, LOWER)):
+        selected = above[:, position]
+        hits = outcomes[:, position] == HIT
+        errors = (predicted[:, position] - actual[:, position]) / pd.Timedelta(hours=1).value  # only valid for hits
+        results.append(pd.DataFrame({
+            "time": times[selected],
+            "season": np.where(winter[selected], "winter", "summer"),
+            "column": columns[selected],
+            "threshold": name,
+            "temperature": temperatures[selected],
+            "predicted": _localize(predicted[selected, position]),
+            "actual": _localize(actual[selected, position]),
+            "outcome": outcomes[selected, position],
+            "error_hours": np.where(hits[selected], errors[selected], np.nan),
+        }))
+
+    return pd.concat(results).sort_values("time", kind="stable", ignore_index=True)
+
+
+def summarize(results: pd.DataFrame, fire_up_lead=SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS) -> pd.DataFrame:
+    """
+    Returns the distribution of the errors (in hours) per season and threshold together with the number of steps per
+    outcome and, for the lower threshold, the share of hits where the advice to fire up came too late: the temperature
+    actually fell below it before the suggested fire-up time, fire_up_lead before the predicted crossing.
+    """
+    groups = results.groupby(["season", "threshold"])
+    counts = pd.crosstab([results.season, results.threshold], results.outcome).reindex(columns=OUTCOMES, fill_value=0)
+    errors = groups.error_hours.describe(percentiles=[0.05, 0.25, 0.5, 0.75, 0.95])
+    errors = errors.drop(columns=["count", "min", "max"])
+    errors["mae"] = groups.error_hours.apply(lambda error: error.abs().mean())
+
+    hits = results[(results.outcome == HIT) & (results.threshold == LOWER)]
+    too_late = hits.predicted - fire_up_lead > hits.actual
+    errors["too_late"] = too_late.groupby([hits.season, hits.threshold]).mean()
+    return counts.join(errors)
+
+
+def _predict(times: np.ndarray, thresholds: Thresholds, workers: Optional[int] = None,
+             unit: str = DEFAULT_UNIT) -> np.ndarray:
+    """
+    Returns the predicted crossings at every step (see _predict_chunk). The chunks of steps are spread across a pool of
+    processes. They're forked if possible, so they share the dataset loaded here (copy-on-write, it's only read) instead
+    of loading it again.
+    """
+    chunks = np.array_split(times, -(-len(times) // CHUNK_SIZE))
+    predict = partial(_predict_chunk, thresholds=thresholds, unit=unit)
+    if workers == 1:
+        return np.concatenate([predict(chunk) for chunk in chunks])
+
+    _load(unit)
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(workers, multiprocessing.get_context(start_method), initializer=_load,
+                             initargs=(unit,)) as executor:
+        return np.concatenate(list(executor.map(predict, chunks)))
+
+
+def _load(unit: str):
+    """Loads everything the predictions need (already there in forked processes)."""
+    load_data(unit)
+    load_crossing_index(unit)
+    load_cycle_index(unit)
+    load_cool_down_library(unit)
+    load_prediction_templates(unit)
+
+
+def _predict_chunk(times: np.ndarray, thresholds: Thresholds, unit: str) -> np.ndarray:
+    """
+    Returns the first time the temperature the recommendation is based on is predicted to fall below the upper and
+    lower threshold at every step (in nanoseconds since epoch, NAT if it's not predicted to), as a (steps x 2) array.
+    """
+    dataset = load_data(unit)
+    season = load_units()[unit].season
+    predicted = np.full((len(times), 2), NAT)
+    for i, time in enumerate(pd.DatetimeIndex(times, tz="UTC").tz_convert(PROJECT_TIMEZONE)):
+        current = dataset.bounds(None, time)[1] - 1
+        # the same splicing as in get_period if the unit was fired up right now (see splice_prediction), only the
+        # continuation after it. Not cached, every step is a new one and would only evict the entries of the dashboard.
+        parts = continuation_after_heating_up(unit, is_in_winter_mode(time, season),
+                                              quantize_temperatures(dataset.row(current, PREDICTED_COLUMNS)), time,
+                                              time, time + PREDICTED_PERIOD)
+        start, stop = dataset.bounds(time + HIT_POINT_DETECTION_PAST_OFFSET, time)
+        past = [IndexedRows(dataset.take(start, stop, TEMPERATURE_COLUMNS), load_crossing_index(unit), start)]
+        hit_times = projected_hit_times(frame_from_parts(past), frame_from_parts(parts), thresholds)
+        crossings = hit_times[advised_column(time, season)]
+        predicted[i] = [NAT if crossing is None else crossing.value for crossing in crossings]
+
+    return predicted
+
+
+def _actual_crossings(following: np.ndarray, times: np.ndarray, columns: np.ndarray, thresholds: Thresholds,
+                      predicted: np.ndarray, unit: str):
+    """
+    Returns the actual crossings after every step (like _predict) and the outcomes compared to the predicted ones,
+    both as (steps x 2) arrays. Only crossings before the unit was fired up the next time count.
+
+    :param following: The position of the first row after every step.
+    """
+    dataset = load_data(unit)
+    last = len(dataset) - 1
+    next_heating_up = load_cycle_index(unit).next_heating_up(following)
+    horizon = times + pd.Timedelta(PREDICTED_PERIOD).value
+    censored = dataset.times[np.minimum(next_heating_up, last)] <= horizon
+    censored &= next_heating_up <= last
+
+    actual = np.full((len(times), 2), NAT)
+    outcomes = np.empty((len(times), 2), dtype=object)
+    for position, threshold in enumerate(thresholds):
+        below = np.full(len(times), len(dataset))
+        for col in PREDICTED_COLUMNS:
+            selected = columns == col
+            below[selected] = load_crossing_index(unit).first_below_many(col, threshold, following[selected])
+
+        crossed = (below < next_heating_up) & (below <= last)
+        crossed &= dataset.times[np.minimum(below, last)] <= horizon
+        actual[crossed, position] = dataset.times[below[crossed]]
+
+        predicted_crossed = predicted[:, position] != NAT
+        outcomes[:, position] = np.select([crossed & predicted_crossed, crossed, censored, predicted_crossed],
+                                          [HIT, MISSED, CENSORED, FALSE_ALARM], NO_CROSSING)
+
+    return actual, outcomes
+
+
+def _localize(times: np.ndarray) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(times.view("datetime64[ns]"), tz="UTC").tz_convert(PROJECT_TIMEZONE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="period_from", type=pd.Timestamp,
+                        help="first step (default: start of the dataset)")
+    parser.add_argument("--to", dest="period_to", type=pd.Timestamp, help="last step (default: end of the dataset)")
+    parser.add_argument("--step", default=BACKTEST_STEP, help=f"time between steps (default: {BACKTEST_STEP})")
+    parser.add_argument("--thresholds", type=int, nargs=2, metavar=("UPPER", "LOWER"), default=BACKTEST_THRESHOLDS,
+                        help="upper and lower threshold in °C (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="number of processes (default: number of CPUs)")
+    parser.add_argument("--unit", default=DEFAULT_UNIT, help="the heating unit to backtest (see units.py)")
+    parser.add_argument("--output", help="csv file to write the result of every step to")
+    args = parser.parse_args()
+
+    def localized(timestamp: Optional[pd.Timestamp]):
+        if timestamp is None or timestamp.tzinfo is not None:
+            return timestamp
+
+        return timestamp.tz_localize(PROJECT_TIMEZONE)
+
+    backtest_results = backtest(localized(args.period_from), localized(args.period_to), args.step,
+                                Thresholds(*args.thresholds), args.workers, args.unit)
+    if args.output:
+        backtest_results.to_csv(args.output, index=False)
+
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        print(summarize(backtest_results).round(2))
@@ -0,0 +1,439 @@
+"""
+Small benchmarks for the data pipeline. Run them from the project root, e.g. `python benchmark.py load`,
+`python benchmark.py memory` (memory of the dataset and everything precomputed from it, see data.memory_report) or
+`python benchmark.py cold_start` (time to the first charts after a restart with and without the warm-up of serve.py),
+`python benchmark.py stages` (views computed with their stages running concurrently and serially, see tasks.py).
+`python benchmark.py pipeline --years 1 20` measures every stage of a dashboard run on synthetic data (see
+synthetic.py) and writes the results to a json file, `python benchmark.py --compare <old json> <new json>` compares
+two of them (e.g. of two commits).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import data
+import synthetic
+import tasks
+from data import CSV_PATH, SUMMER_PREDICTION_CSV_PATH, WINTER_PREDICTION_CSV_PATH, COLUMNAR_EXTENSION, \
+    PREDICTED_COLUMNS, PREDICTED_PERIOD, HEATING_UP, HISTORY_MATCH_WINDOW, HISTORY_RESOLUTION, \
+    HISTORY_MATCH_TOLERANCE, DOWNSAMPLING, BUFFER_MAX, BUFFER_AVG, BUFFER_MIN, DRINKING_WATER, \
+    _load_csv_time_dataset, _load_columnar_time_dataset, load_data, load_cool_down_library, get_period, \
+    get_period_statistics, projected_hit_times
+from plots import create_temperature_line_chart, prediction_fans, base_traces
+from shared import Thresholds, PROJECT_TIMEZONE, DEFAULT_DATE_OFFSET
+
+REPEATS = 5
+
+# the pipeline benchmark runs on a synthetic dataset per number of years, which ends at a fixed time so the results of
+# different commits are comparable
+PIPELINE_YEARS = [3]
+PIPELINE_DATA_END = pd.Timestamp("2023-01-01", tz="UTC")
+PIPELINE_SEED = 0
+# number of random periods per period length
+PIPELINE_SAMPLES = 10
+PIPELINE_RESULTS_DIR = "benchmark-results"
+# one period length inside every DOWNSAMPLING bracket and one below all of them
+PIPELINE_PERIOD_LENGTHS = [pd.Timedelta(DOWNSAMPLING[-1][0]) / 2,
+                           *(pd.Timedelta(condition) * 1.5 for condition, _ in reversed(DOWNSAMPLING))]
+
+# the charts like main.py creates them. The second thresholds are used for a rerun where only they changed.
+PLOT_HEIGHT = 400
+PLOT_WIDTH = 800
+YLIM = [20, 90]
+CHART_COLUMNS = [[(BUFFER_MAX, False), (BUFFER_AVG, True), (BUFFER_MIN, True)], DRINKING_WATER]
+THRESHOLDS = Thresholds(40, 30)
+RERUN_THRESHOLDS = Thresholds(45, 35)
+
+# fresh processes per measurement of the cold start, which prints the time to the default view of the dashboard (see
+# warmup.default_view) in seconds. Streamlit is imported before as it is by the server before the first run.
+COLD_START_RUNS = 3
+COLD_START_SCRIPT = """
+import time
+import streamlit
+start = time.perf_counter()
+import warmup
+if {warmed_up}:
+    warmup.warm_up()
+    start = time.perf_counter()
+warmup.default_view()
+print(time.perf_counter() - start)
+"""
+
+# random periods of the default length, their views are computed with the stages running concurrently and serially
+STAGES_SAMPLES = 10
+STAGES_PERIOD_LENGTH = pd.Timedelta(DEFAULT_DATE_OFFSET)
+
+# hours of ticks (one per minute) replayed by the alert evaluator
+ALERTS_HOURS = 48
+
+
+def _best_time(func: Callable, repeats=REPEATS) -> float:
+    """Returns the best wall time in seconds of multiple runs of func (the best run has the least noise)."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def benchmark_loading(csv_paths=(CSV_PATH, SUMMER_PREDICTION_CSV_PATH, WINTER_PREDICTION_CSV_PATH)):
+    """Compares the load time of the csv files with the columnar files written by transform-data.py."""
+    for csv_path in csv_paths:
+        columnar_path = os.path.splitext(csv_path)[0] + COLUMNAR_EXTENSION
+        if not os.path.exists(columnar_path):
+            print(f"{csv_path}: no columnar file, run `python transform-data.py --columnar {csv_path}` first.")
+            continue
+
+        csv_time = _best_time(lambda: _load_csv_time_dataset(csv_path))
+        columnar_time = _best_time(lambda: _load_columnar_time_dataset(columnar_path))
+        print(f"{csv_path}: csv {csv_time * 1000:.1f} ms, columnar {columnar_time * 1000:.1f} ms "
+              f"({csv_time / columnar_time:.1f}x faster)")
+
+
+def benchmark_historic_prediction(samples=200):
+    """Measures the search for the best historic continuation before randomly chosen heating ups."""
+    data = load_data()
+    library = load_cool_down_library()
+    heating_up = data.columns[HEATING_UP]
+    heating_up_starts = np.flatnonzero(heating_up[1:] & ~heating_up[:-1]) + 1
+    window_steps = int(HISTORY_MATCH_WINDOW / HISTORY_RESOLUTION)
+
+    timings = []
+    for position in np.random.default_rng(0).choice(heating_up_starts, samples):
+        first_time_heating_up = data.time_at(position)
+        trajectory = data.slice(first_time_heating_up - HISTORY_MATCH_WINDOW,
+                                first_time_heating_up - np.timedelta64(1, "ns"), PREDICTED_COLUMNS)
+        start = time.perf_counter()
+        library.best_continuation(trajectory, window_steps, first_time_heating_up, PREDICTED_PERIOD,
+                                  first_time_heating_up, HISTORY_MATCH_TOLERANCE)
+        timings.append(time.perf_counter() - start)
+
+    print(f"historic prediction over {len(library.times)} bins: median {np.median(timings) * 1000:.1f} ms, "
+          f"max {np.max(timings) * 1000:.1f} ms")
+
+
+def benchmark_memory():
+    """Compares the memory the dataset and everything precomputed from it take with and without COMPACT_DATASET."""
+    reports = {}
+    compact_dataset = data.COMPACT_DATASET
+    try:
+        for compact in (False, True):
+            data.COMPACT_DATASET = compact
+            _clear_caches()
+            reports["compact" if compact else "plain"] = data.memory_report()
+    finally:
+        data.COMPACT_DATASET = compact_dataset
+        _clear_caches()
+
+    report = pd.DataFrame({name: report.set_index(["structure", "part"]).bytes / 2 ** 20
+                           for name, report in reports.items()})
+    report.loc[("total", ""), :] = report.sum()
+    print(report.round(2).to_string())
+    print(f"compact: {report.loc[('total', ''), 'compact'] / report.loc[('total', ''), 'plain']:.0%} of the memory")
+
+
+def benchmark_cold_start(runs=COLD_START_RUNS):
+    """
+    Compares the time to the default view of the first run after a restart: cold (importing everything, loading the
+    data and computing the view in the run) and after the warm-up (see warmup.py) which serve.py starts on boot.
+    """
+    for warmed_up in (False, True):
+        timings = [float(subprocess.run([sys.executable, "-c", COLD_START_SCRIPT.format(warmed_up=warmed_up)],
+                                        capture_output=True, text=True, check=True).stdout.split()[-1])
+                   for _ in range(runs)]
+        print(f"first run {'after the warm-up' if warmed_up else 'cold'}: median {np.median(timings) * 1000:.0f} ms, "
+              f"max {np.max(timings) * 1000:.0f} ms")
+
+
+def benchmark_stages(samples=STAGES_SAMPLES):
+    """
+    Compares computing the views of random periods (see prefetch.compute_view) with their stages running concurrently
+    and one after the other (see tasks.SERIAL_TASKS). The charts are built anew for every view, the periods themselves
+    come from the cache (they're the same either way).
+    """
+    from prefetch import compute_view
+
+    rng = np.random.default_rng(PIPELINE_SEED)
+    first, last = pd.Timestamp(data.earliest_time()) + STAGES_PERIOD_LENGTH, load_data().time_at(-1)
+    ends = [first + (last - first) * fraction for fraction in rng.random(samples)]
+    periods = [((end - STAGES_PERIOD_LENGTH).to_pydatetime(), end.to_pydatetime()) for end in ends]
+    views = {period: compute_view(*period, THRESHOLDS) for period in periods}  # loads the data and the periods
+
+    serial_tasks = tasks.SERIAL_TASKS
+    try:
+        for serial in (True, False):
+            tasks.SERIAL_TASKS = serial
+            timings, identical = [], True
+            for period in periods:
+                prediction_fans.clear()
+                base_traces.clear()
+                start = time.perf_counter()
+                view = compute_view(*period, THRESHOLDS)
+                timings.append(time.perf_counter() - start)
+                identical &= view.hit_times == views[period].hit_times and \
+                    [fig.to_json() for fig in view.figures] == [fig.to_json() for fig in views[period].figures]
+
+            print(f"stages {'serial' if serial else f'concurrent ({tasks.TASK_WORKERS} workers)'}: median "
+                  f"{np.median(timings) * 1000:.1f} ms, max {np.max(timings) * 1000:.1f} ms, "
+                  f"identical views: {identical}")
+    finally:
+        tasks.SERIAL_TASKS = serial_tasks
+
+
+def benchmark_alerts(hours=ALERTS_HOURS):
+    """
+    Compares the ticks of the alert evaluator (see alerts.py) with computing the period and its hit times from scratch
+    at every tick, every minute for a number of hours at the end of the dataset.
+    """
+    from alerts import AlertEvaluator, ALERT_THRESHOLDS
+
+    period_to = load_data().time_at(-1) - PREDICTED_PERIOD
+    times = pd.date_range(period_to - pd.Timedelta(hours=hours), period_to, freq="1min")
+    evaluator = AlertEvaluator(thresholds=ALERT_THRESHOLDS)
+    timings: Dict[str, List[float]] = {}
+    evaluated = same = 0
+    for now in times:
+        hit_times = _timed(timings, "incrementally", lambda: evaluator.hit_times(now))
+        _, past, predicted = _timed(timings, "from scratch", lambda: get_period(now - DEFAULT_DATE_OFFSET, now))
+        scratch_hit_times = _timed(timings, "from scratch", lambda: projected_hit_times(past, predicted,
+                                                                                         ALERT_THRESHOLDS))
+        if hit_times is not None:  # not while the unit is being fired up
+            evaluated += 1
+            same += hit_times == scratch_hit_times
+
+    # the period and its hit times are timed separately
+    timings["from scratch"] = list(np.add(timings["from scratch"][::2], timings["from scratch"][1::2]))
+    for name, stage_timings in timings.items():
+        print(f"{len(times)} ticks {name}: median {np.median(stage_timings) * 1000:.2f} ms, "
+              f"max {np.max(stage_timings) * 1000:.1f} ms")
+
+    stats = evaluator.stats()
+    print(f"{stats.continuations} continuations matched, {stats.searches} threshold searches, the same hit times in "
+          f"{same} of {evaluated} ticks (the others differ in the continuation after a heating up)")
+
+
+def benchmark_pipeline(years_list: Sequence[float] = PIPELINE_YEARS, samples=PIPELINE_SAMPLES,
+                       output: Optional[str] = None):
+    """
+    Measures the latency and peak memory of every stage of a dashboard run (see _run_pipeline) on synthetic datasets
+    of different lengths, for random periods of every length in PIPELINE_PERIOD_LENGTHS. The periods differ, so
+    every run is a cache miss except for the loaded dataset and the rerun stage.
+
+    :param years_list: The lengths of the synthetic datasets in years (generated once into SYNTHETIC_DATA_DIR).
+    :param samples: How many random periods to measure per period length.
+    :param output: The json file to write the results to, defaults to one named after the commit in
+                   PIPELINE_RESULTS_DIR.
+    """
+    results = []
+    for years in years_list:
+        _use_synthetic_dataset(years)
+        load_timings, load_memory = _measure_load()
+        results.append(_stage_result(years, "load", None, load_timings, load_memory))
+
+        rng = np.random.default_rng(PIPELINE_SEED)
+        first_time, last_time = load_data().time_at(0), load_data().time_at(-1)
+        for length in PIPELINE_PERIOD_LENGTHS:
+            def random_period():
+                period_to = first_time + length + (last_time - PREDICTED_PERIOD - first_time - length) * rng.random()
+                period_to = period_to.floor("min").tz_convert(PROJECT_TIMEZONE)
+                return period_to - length, period_to
+
+            timings: Dict[str, List[float]] = {}
+            for _ in range(samples):
+                _run_pipeline(*random_period(), partial(_timed, timings))
+
+            memory: Dict[str, float] = {}
+            tracemalloc.start()
+            try:
+                _run_pipeline(*random_period(), partial(_traced, memory))
+            finally:
+                tracemalloc.stop()
+
+            for stage, stage_timings in timings.items():
+                results.append(_stage_result(years, stage, length, stage_timings, memory[stage]))
+
+    for result in results:
+        period = f"{result['period_days']:g} days" if result["period_days"] is not None else "-"
+        print(f"{result['years']:g} years, {result['stage']} ({period}): median {result['median_ms']:.1f} ms, "
+              f"p95 {result['p95_ms']:.1f} ms, peak memory {result['peak_memory_mib']:.1f} MiB")
+
+    commit = _git_commit()
+    output = output or os.path.join(PIPELINE_RESULTS_DIR, f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({
+            "commit": commit,
+            "created": pd.Timestamp.now(tz="UTC").isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "downsampling_method": data.DOWNSAMPLING_METHOD,
+            "compact_dataset": data.COMPACT_DATASET,
+            "serial_tasks": tasks.SERIAL_TASKS,
+            "samples": samples,
+            "results": results,
+        }, file, indent=2)
+
+    print(f"results written to {output}")
+
+
+def compare_results(baseline_path: str, path: str):
+    """Prints the change of the median latency and peak memory of every stage between two pipeline results."""
+    def load(results_path):
+        with open(results_path) as file:
+            return {(r["years"], r["stage"], r["period_days"]): r for r in json.load(file)["results"]}
+
+    baseline, results = load(baseline_path), load(path)
+    for key in sorted(baseline.keys() & results.keys(), key=lambda key: (key[0], key[2] or 0, key[1])):
+        (years, stage, period_days), old, new = key, baseline[key], results[key]
+        period = f"{period_days:g} days" if period_days is not None else "-"
+        print(f"{years:g} years, {stage} ({period}): median {old['median_ms']:.1f} -> {new['median_ms']:.1f} ms "
+              f"({new['median_ms'] / old['median_ms']:.2f}x), peak memory {old['peak_memory_mib']:.1f} -> "
+              f"{new['peak_memory_mib']:.1f} MiB")
+
+
+def _run_pipeline(period_from: pd.Timestamp, period_to: pd.Timestamp, measure: Callable[[str, Callable], Any]):
+    """Runs the stages of a dashboard run like main.py, each one with measure(stage, func) which returns its result."""
+    current, past, predicted = measure("get_period", lambda: get_period(period_from, period_to, PLOT_WIDTH))
+    measure("projected_hit_times", lambda: projected_hit_times(past, predicted, THRESHOLDS))
+    measure("period_statistics", lambda: get_period_statistics(period_from, period_to, THRESHOLDS))
+    measure("prediction_fans", lambda: prediction_fans(predicted))
+
+    def line_charts(thresholds: Thresholds):
+        return [create_temperature_line_chart(past, predicted, columns, YLIM, thresholds, PLOT_HEIGHT, PLOT_WIDTH)
+                for columns in CHART_COLUMNS]
+
+    # the fans are already there (like for the second chart of main.py), the rerun only changes the thresholds
+    measure("line_charts", lambda: line_charts(THRESHOLDS))
+    figures = measure("line_charts_rerun", lambda: line_charts(RERUN_THRESHOLDS))
+    # what st.plotly_chart does with them
+    measure("chart_json", lambda: [json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder) for fig in figures])
+
+
+def _timed(timings: Dict[str, List[float]], stage: str, func: Callable):
+    start = time.perf_counter()
+    result = func()
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def _traced(memory: Dict[str, float], stage: str, func: Callable):
+    """Records the peak memory allocated (above what was allocated before) while running func. Needs tracemalloc."""
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = func()
+    memory[stage] = tracemalloc.get_traced_memory()[1] - before
+    return result
+
+
+def _measure_load():
+    """Loads the dataset and everything precomputed from it (the first run of the dashboard) once timed, once traced."""
+    def load():
+        load_data()
+        data.load_crossing_index()
+        data.load_cycle_index()
+        data.load_aggregate_index()
+        load_cool_down_library()
+        data.load_prediction_templates()
+        if data.DOWNSAMPLING_METHOD == data.MEDIAN:
+            data.load_downsampled_crossing_indexes()
+
+    timings, memory = {}, {}
+    _timed(timings, "load", load)
+    _clear_caches()
+    tracemalloc.start()
+    try:
+        _traced(memory, "load", load)
+    finally:
+        tracemalloc.stop()
+
+    return timings["load"], memory["load"]
+
+
+def _stage_result(years: float, stage: str, period_length: Optional[pd.Timedelta], timings: List[float],
+                  peak_memory: float) -> dict:
+    return {
+        "years": years,
+        "stage": stage,
+        "period_days": None if period_length is None else period_length / pd.Timedelta(days=1),
+        "samples": len(timings),
+        "median_ms": float(np.median(timings)) * 1000,
+        "p95_ms": float(np.percentile(timings, 95)) * 1000,
+        "max_ms": float(np.max(timings)) * 1000,
+        "peak_memory_mib": peak_memory / 2 ** 20,
+    }
+
+
+def _use_synthetic_dataset(years: float):
+    """Points data.py to the synthetic dataset of that many years (generated if it doesn't exist yet)."""
+    directory = os.path.join(synthetic.SYNTHETIC_DATA_DIR, f"{years:g}y-{PIPELINE_DATA_END:%Y%m%d}-{PIPELINE_SEED}")
+    if not os.path.exists(os.path.join(directory, synthetic.WINTER_PREDICTION_CSV_NAME[:-4] + COLUMNAR_EXTENSION)):
+        synthetic.write_synthetic_dataset(directory, years, PIPELINE_DATA_END, PIPELINE_SEED)
+
+    data.CSV_PATH = os.path.join(directory, synthetic.CSV_NAME)
+    data.SUMMER_PREDICTION_CSV_PATH = os.path.join(directory, synthetic.SUMMER_PREDICTION_CSV_NAME)
+    data.WINTER_PREDICTION_CSV_PATH = os.path.join(directory, synthetic.WINTER_PREDICTION_CSV_NAME)
+    _clear_caches()
+
+
+def _clear_caches():
+    """Clears everything cached from the dataset, so it's loaded (again) on the next run."""
+    for singleton in (data.load_units, data.load_shared_stores, load_data, data.load_crossing_index,
+                      data.load_cycle_index, data.load_aggregate_index, data.load_downsampled_data,
+                      data.load_downsampled_crossing_indexes, load_cool_down_library, data.load_prediction_templates,
+                      prediction_fans, base_traces):
+        singleton.clear()
+
+    for cached in (data.splice_prediction, data._best_template_match, data._largest_triangles):
+        cached.cache_clear()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    except OSError:  # git isn't installed
+        return None
+
+    return commit.stdout.strip() or None
+
+
+BENCHMARKS = {
+    "load": benchmark_loading,
+    "history": benchmark_historic_prediction,
+    "memory": benchmark_memory,
+    "cold_start": benchmark_cold_start,
+    "stages": benchmark_stages,
+    "alerts": benchmark_alerts,
+    "pipeline": benchmark_pipeline,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all of them)")
+    parser.add_argument("--years", type=float, nargs="+", default=PIPELINE_YEARS,
+                        help="lengths of the synthetic datasets for the pipeline benchmark")
+    parser.add_argument("--samples", type=int, default=PIPELINE_SAMPLES, help="random periods per period length")
+    parser.add_argument("--output", help="json file to write the pipeline results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"),
+                        help="compare two pipeline results instead of running benchmarks")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        BENCHMARKS["pipeline"] = partial(benchmark_pipeline, args.years, args.samples, args.output)
+        for name in args.benchmarks or BENCHMARKS.keys():
+            BENCHMARKS[name]()
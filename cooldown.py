@@ -0,0 +1,158 @@
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from store import TimeSeriesStore
+
+
+class CoolDownLibrary:
+    """
+    An index of every natural cool-down segment (no heating up and no missing data) in a dataset. The data is averaged
+    onto a regular grid of `resolution` so trajectories can be compared position by position.
+
+    The nearest neighbour search compares a trajectory with every window of the same length in the library that lies
+    within a single cool-down segment. It's exact but first compares the means of every `paa_steps` bins (piecewise
+    aggregate approximation) which is a lower bound of the full error. The full error only has to be computed for the
+    few windows whose lower bound is smaller than the best error found so far.
+    """
+
+    def __init__(self, store: TimeSeriesStore, columns: Iterable[str], heating_up_column: str,
+                 resolution: np.timedelta64, paa_steps=6):
+        self.columns = list(columns)
+        self.step = int(pd.Timedelta(resolution).value)
+        self.paa_steps = paa_steps
+
+        # average the data per grid bin; bins without any data simply don't exist (and break the segments)
+        bins = store.times // self.step
+        starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+        counts = np.diff(np.append(starts, len(bins)))
+        values = store.matrix(self.columns, np.float64)
+        self.values = (np.add.reduceat(values, starts) / counts[:, np.newaxis]).astype(np.float32)
+        self.times = bins[starts] * self.step
+        # mean of the paa_steps bins up to (including) each bin, one contiguous row per column
+        sums = np.cumsum(np.vstack([np.zeros((paa_steps, len(self.columns))), self.values]), axis=0)
+        self.paa_means = np.ascontiguousarray(((sums[paa_steps:] - sums[:-paa_steps]) / paa_steps).T, np.float32)
+        heating_up = np.logical_or.reduceat(store.columns[heating_up_column], starts)
+
+        n = len(self.times)
+        positions = np.arange(n)
+        self.valid = ~heating_up & ~np.isnan(self.values).any(axis=1)
+        # a new segment starts after a gap in the data and around every invalid (e.g. heating up) bin
+        breaks = np.ones(n, dtype=bool)
+        breaks[1:] = (np.diff(self.times) != self.step) | ~self.valid[:-1] | ~self.valid[1:]
+        ends = np.append(breaks[1:], True)
+        segment_start = np.maximum.accumulate(np.where(breaks, positions, 0))
+        segment_end = np.minimum.accumulate(np.where(ends, positions, n)[::-1])[::-1]
+        self.steps_since_segment_start = positions - segment_start
+        self.segment_end_times = self.times[segment_end] + self.step
+
+    def best_continuation(self, trajectory: TimeSeriesStore, window_steps: int, continue_from: pd.Timestamp,
+                          continuation: np.timedelta64, history_end: pd.Timestamp,
+                          tolerance: float) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """
+        Finds the cool-down segment in the history which continues most similarly to a trajectory.
+
+        :param trajectory: The most recent data (at least the `columns` of the library) before continue_from.
+        :param window_steps: How many grid steps at the end of the trajectory to compare.
+        :param continue_from: The time the continuation is needed from, right after the end of the trajectory.
+        :param continuation: How long the continuation should ideally be.
+        :param history_end: Only segments which ended before this time are considered (no peeking into the future).
+        :param tolerance: The root mean squared error up to which a window with a continuation that's long enough is
+               preferred over the most similar window (which might have a shorter continuation).
+        :return: The start and end time (inclusive) of the best continuation in the library or None if there is none.
+        """
+        if not len(trajectory):
+            return None
+
+        query_start, query = self._grid_trajectory(trajectory, window_steps)
+        # the continuation starts at the same offset from the matched window's last bin as continue_from from the
+        # trajectory's last bin
+        continuation_offset = pd.Timestamp(continue_from).value - query_start
+        continuation = pd.Timedelta(continuation).value
+
+        candidates = self.valid & (self.steps_since_segment_start >= window_steps - 1) & \
+            (self.segment_end_times <= pd.Timestamp(history_end).value)
+        long_enough = candidates & (self.segment_end_times - self.times - continuation_offset >= continuation)
+
+        lower_bounds = self._lower_bounds(query)
+        best, error = self._nearest(np.flatnonzero(long_enough), query, lower_bounds)
+        max_error = tolerance ** 2 * np.count_nonzero(~np.isnan(query))
+        if best is None or error > max_error:
+            best, error = self._nearest(np.flatnonzero(candidates), query, lower_bounds)
+
+        if best is None:
+            return None
+
+        start = self.times[best] + continuation_offset
+        end = min(start + continuation, self.segment_end_times[best] - 1)
+        if start > end:
+            return None
+
+        return pd.Timestamp(start, tz="UTC"), pd.Timestamp(end, tz="UTC")
+
+    def _lower_bounds(self, query: np.ndarray) -> np.ndarray:
+        """
+        Returns a lower bound of the sum of squared errors between the query and the window ending at every bin using
+        the means of every paa_steps bins. Only valid for windows lying within a segment.
+        """
+        window_steps = len(query)
+        lower_bounds = np.zeros(len(self.times))
+        for end in range(window_steps, self.paa_steps - 1, -self.paa_steps):
+            query_means = query[end - self.paa_steps:end].mean(axis=0)
+            shift = window_steps - end
+            for paa_means, query_mean in zip(self.paa_means, query_means):
+                if np.isnan(query_mean):  # the lower bound is still valid when parts are left out
+                    continue
+
+                # by Cauchy-Schwarz, n * (mean(x) - mean(q))^2 <= sum((x - q)^2)
+                lower_bounds[shift:] += self.paa_steps * np.square(paa_means[:len(paa_means) - shift] - query_mean)
+
+        return lower_bounds
+
+    def _nearest(self, candidates: np.ndarray, query: np.ndarray,
+                 lower_bounds: np.ndarray, batch_size=256) -> Tuple[Optional[int], float]:
+        """
+        Returns the candidate (position of the last bin) whose window is the most similar to the query and its sum of
+        squared errors. The full error is only computed for the candidates with the smallest lower bounds.
+        """
+        if not len(candidates):
+            return None, np.inf
+
+        window_steps = len(query)
+        lower_bounds = lower_bounds[candidates]
+        offsets = np.arange(-window_steps + 1, 1)
+        best, best_error = None, np.inf
+        while True:
+            if batch_size < len(candidates):
+                batch = np.argpartition(lower_bounds, batch_size)
+                next_lower_bound = lower_bounds[batch[batch_size]]  # every window not in this batch has at least that
+                batch = batch[:batch_size]
+            else:
+                batch, next_lower_bound = np.arange(len(candidates)), np.inf
+
+            windows = self.values[candidates[batch][:, np.newaxis] + offsets]
+            errors = np.nansum(np.square(windows - query), axis=(1, 2))  # missing trajectory points are skipped
+            if errors.min() < best_error:
+                best, best_error = candidates[batch[errors.argmin()]], errors.min()
+
+            if next_lower_bound >= best_error:
+                return best, best_error
+
+            batch_size *= 4
+
+    def _grid_trajectory(self, trajectory: TimeSeriesStore, window_steps: int) -> Tuple[int, np.ndarray]:
+        """
+        Averages the last window_steps grid bins of a trajectory like the library (missing bins are NaN).
+        Returns the start time of the last bin and the (window_steps x columns) matrix.
+        """
+        bins = trajectory.times // self.step
+        positions = bins - bins[-1] + window_steps - 1
+        in_window = positions >= 0
+        positions = positions[in_window]
+        counts = np.bincount(positions, minlength=window_steps)
+        with np.errstate(invalid="ignore"):
+            query = np.column_stack([np.bincount(positions, trajectory.columns[col][in_window], window_steps) / counts
+                                     for col in self.columns])
+
+        return bins[-1] * self.step, query
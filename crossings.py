@@ -0,0 +1,123 @@
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from store import TimeSeriesStore
+
+
+class ThresholdCrossingIndex:
+    """
+    Stores, for every column and every integer threshold in a range, the runs of consecutive rows whose value is below
+    that threshold. The first row below a threshold at or after any position is then a binary search away, so finding
+    the next time a temperature drops below a threshold doesn't need to scan the data.
+    """
+
+    def __init__(self, store: TimeSeriesStore, columns: Iterable[str], thresholds: range):
+        self.columns = list(columns)
+        self.thresholds = thresholds
+        self.length = 0
+        # (column, threshold) -> (start positions, end positions (exclusive)) of the runs below the threshold
+        self._runs = {(col, threshold): (np.empty(0, np.int64), np.empty(0, np.int64))
+                      for col in self.columns for threshold in thresholds}
+        self.extend(store)
+
+    def extend(self, store: TimeSeriesStore, offset: Optional[int] = None):
+        """
+        Indexes the rows which were appended to the store since it was last indexed. The store must still start with
+        all the rows indexed before.
+
+        :param store: The store the index was built for, with the appended rows.
+        :param offset: Re-index the rows from this position onwards (e.g. if they were replaced) instead of only the
+                       appended ones.
+        """
+        offset = self.length if offset is None else offset
+        for col in self.columns:
+            values = store.columns[col][offset:]
+            for threshold in self.thresholds:
+                edges = np.diff((values < threshold).view(np.int8), prepend=0, append=0)
+                starts = np.flatnonzero(edges == 1) + offset
+                ends = np.flatnonzero(edges == -1) + offset
+                old_starts, old_ends = self._runs[col, threshold]
+                kept = old_starts < offset
+                old_starts, old_ends = old_starts[kept], np.minimum(old_ends[kept], offset)
+                if len(starts) and starts[0] == offset and len(old_ends) and old_ends[-1] == offset:
+                    # the last run continues in the new rows
+                    starts, old_ends = starts[1:], old_ends[:-1]
+
+                self._runs[col, threshold] = np.concatenate([old_starts, starts]), np.concatenate([old_ends, ends])
+
+        self.length = len(store)
+
+    def covers(self, column: str, threshold: float) -> bool:
+        """Returns whether the crossings of that threshold are indexed for the column."""
+        return column in self.columns and float(threshold).is_integer() and int(threshold) in self.thresholds
+
+    def runs(self, column: str, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the start and end positions (exclusive) of the runs of rows below the threshold. Must be covered by
+        the index (see covers).
+        """
+        return self._runs[column, int(threshold)]
+
+    def first_below(self, column: str, threshold: float, start: int, stop: int) -> Optional[int]:
+        """
+        Returns the first position from start (inclusive) to stop (exclusive) where the value of the column is below
+        the threshold or None if there is none. Must be covered by the index (see covers).
+        """
+        run_starts, run_ends = self._runs[column, int(threshold)]
+        run = np.searchsorted(run_ends, start, side="right")  # first run which didn't end before start
+        if run == len(run_ends):
+            return None
+
+        position = max(start, run_starts[run])
+        return int(position) if position < stop else None
+
+    def first_below_many(self, column: str, threshold: float, starts: np.ndarray) -> np.ndarray:
+        """
+        Same as first_below for many start positions at once (until the end of the indexed rows). Positions without a
+        row below the threshold after them are the number of indexed rows instead of None.
+        """
+        run_starts, run_ends = self._runs[column, int(threshold)]
+        runs = np.searchsorted(run_ends, starts, side="right")
+        if not len(run_ends):
+            return np.full(len(starts), self.length, dtype=np.int64)
+
+        positions = np.maximum(starts, run_starts[np.minimum(runs, len(run_ends) - 1)])
+        return np.where(runs < len(run_ends), positions, self.length)
+
+
+class IndexedRows(NamedTuple):
+    """
+    Rows (views, possibly moved in time) which were taken from `start` onwards of the store a crossing index was built
+    for. Rows that were computed on the fly don't have an index and are scanned instead.
+    """
+    rows: TimeSeriesStore
+    index: Optional[ThresholdCrossingIndex] = None
+    start: int = 0
+
+
+def first_time_below(parts: Sequence[IndexedRows], column: str, threshold: float) -> Optional[pd.Timestamp]:
+    """Returns the first time the values of a column are below a threshold in consecutive parts or None if never."""
+    for rows, index, start in parts:
+        if index is not None and index.covers(column, threshold):
+            position = index.first_below(column, threshold, start, start + len(rows))
+            if position is not None:
+                return rows.time_at(position - start)
+        else:
+            time = rows.first_time_below(column, threshold)
+            if time is not None:
+                return time
+
+    return None
+
+
+def parts_from(parts: Sequence[IndexedRows], period_from: pd.Timestamp) -> List[IndexedRows]:
+    """Returns the rows of consecutive parts from a time onwards."""
+    remaining = []
+    for rows, index, start in parts:
+        skipped, _ = rows.bounds(period_from)
+        if skipped < len(rows):
+            remaining.append(IndexedRows(rows.take(skipped, len(rows)), index, start + skipped))
+
+    return remaining
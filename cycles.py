@@ -0,0 +1,145 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from store import TimeSeriesStore
+
+
+class HeatingCycle(NamedTuple):
+    """A heating up of the unit, i.e. consecutive rows where it was heating up."""
+    start: pd.Timestamp
+    end: pd.Timestamp  # the time of the last row heating up
+    peak: float  # the highest temperature of the peak column while heating up
+    duration: pd.Timedelta  # from the first to the last row heating up
+
+
+class _Cycles(NamedTuple):
+    """The arrays of a HeatingCycleIndex, one entry per cycle."""
+    starts: np.ndarray
+    ends: np.ndarray  # exclusive positions
+    start_times: np.ndarray
+    end_times: np.ndarray  # the times of the last rows
+    peaks: np.ndarray
+    length: int  # the number of indexed rows
+
+
+class HeatingCycleIndex:
+    """
+    A run-length index of the heating cycles in a dataset: the start and end position, the peak temperature and the
+    start and end time of every run of consecutive rows with the heating up column set. Finding the next cycle from any
+    position or time is a binary search and summarizing the cycles of a period only touches those cycles.
+
+    The arrays are replaced all at once when rows are indexed (see extend), every query reads them once at the start,
+    so queries while the live ingestion extends the index (see live.py) see either all the cycles before or after.
+    """
+
+    def __init__(self, store: TimeSeriesStore, heating_up_column: str, peak_column: str):
+        self.heating_up_column = heating_up_column
+        self.peak_column = peak_column
+        self.tz = store.tz
+        self._cycles = _Cycles(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64),
+                               np.empty(0, np.int64), np.empty(0, np.float32), 0)
+        self.extend(store)
+
+    def extend(self, store: TimeSeriesStore):
+        """
+        Indexes the rows which were appended to the store since it was last indexed. The store must still start with
+        all the rows indexed before. Not thread-safe with other writers, but queries can run at the same time.
+        """
+        indexed = self._cycles
+        offset = indexed.length
+        kept = len(indexed.starts)
+        if kept and indexed.ends[-1] == indexed.length:  # the last cycle might continue in the new rows
+            kept -= 1
+            offset = int(indexed.starts[-1])
+
+        heating_up = store.columns[self.heating_up_column][offset:]
+        edges = np.diff(heating_up.view(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        # maximum of every run: reduce from each start to its end, the sentinel makes the end of the last row valid
+        peak_values = np.append(store.columns[self.peak_column][offset:], np.nan)
+        peaks = np.fmax.reduceat(peak_values, np.column_stack([starts, ends]).ravel())[::2] if len(starts) else []
+
+        times = store.times[offset:]
+        self._cycles = _Cycles(np.concatenate([indexed.starts[:kept], starts + offset]),
+                               np.concatenate([indexed.ends[:kept], ends + offset]),
+                               np.concatenate([indexed.start_times[:kept], times[starts]]),
+                               np.concatenate([indexed.end_times[:kept], times[ends - 1]]),
+                               np.concatenate([indexed.peaks[:kept], np.asarray(peaks, np.float32)]),
+                               len(store))
+
+    def __len__(self):
+        return len(self._cycles.starts)
+
+    def first_heating_up(self, start: int, stop: int) -> Optional[int]:
+        """Returns the first position from start (inclusive) to stop (exclusive) heating up or None if there is none."""
+        cycles = self._cycles
+        cycle = np.searchsorted(cycles.ends, start, side="right")  # first cycle which didn't end before start
+        if cycle == len(cycles.ends):
+            return None
+
+        position = max(start, cycles.starts[cycle])
+        return int(position) if position < stop else None
+
+    def next_heating_up(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Same as first_heating_up for many start positions at once (until the end of the indexed rows). Positions
+        without a heating up after them are the number of indexed rows instead of None.
+        """
+        indexed = self._cycles
+        cycles = np.searchsorted(indexed.ends, positions, side="right")
+        starts = np.append(indexed.starts, indexed.length)[cycles]
+        return np.where(cycles < len(indexed.starts), np.maximum(positions, starts), indexed.length)
+
+    def count(self, start: int, stop: int) -> int:
+        """Returns the number of cycles which started from position start (inclusive) to stop (exclusive)."""
+        starts = self._cycles.starts
+        return int(np.searchsorted(starts, stop) - np.searchsorted(starts, start))
+
+    def next_cycle(self, time: datetime) -> Optional[HeatingCycle]:
+        """Returns the cycle that's heating up at a time or the next one after it, None if there is none."""
+        cycles = self._cycles
+        cycle = np.searchsorted(cycles.end_times, pd.Timestamp(time).value, side="left")
+        return self._cycle(cycles, cycle) if cycle < len(cycles.end_times) else None
+
+    def cycles(self, period_from: Optional[datetime] = None, period_to: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Returns the cycles which started in a period (both ends inclusive) with their start time as index and the end
+        time, peak temperature and duration as columns.
+        """
+        cycles = self._cycles
+        first = 0 if period_from is None else np.searchsorted(cycles.start_times, pd.Timestamp(period_from).value)
+        last = len(cycles.start_times) if period_to is None else \
+            np.searchsorted(cycles.start_times, pd.Timestamp(period_to).value, side="right")
+        starts, ends = cycles.start_times[first:last], cycles.end_times[first:last]
+        return pd.DataFrame({
+            "end": _localize(ends, self.tz),
+            "peak": cycles.peaks[first:last],
+            "duration": pd.to_timedelta(ends - starts),
+        }, index=_localize(starts, self.tz).rename("start"))
+
+    def summary(self, period_from: Optional[datetime] = None, period_to: Optional[datetime] = None,
+                freq="D") -> pd.DataFrame:
+        """
+        Summarizes the cycles which started in a period per interval (e.g. "D" for days or "W" for weeks).
+
+        :return: The number of cycles, their average duration and their average peak temperature per interval. Intervals
+                 without a cycle have no average.
+        """
+        cycles = self.cycles(period_from, period_to)
+        summary = cycles.resample(freq).agg({"duration": ["size", "mean"], "peak": "mean"})
+        summary.columns = ["cycles", "duration", "peak"]
+        return summary
+
+    def _cycle(self, cycles: _Cycles, cycle: int) -> HeatingCycle:
+        start, end = cycles.start_times[cycle], cycles.end_times[cycle]
+        return HeatingCycle(pd.Timestamp(start, tz="UTC").tz_convert(self.tz),
+                            pd.Timestamp(end, tz="UTC").tz_convert(self.tz),
+                            float(cycles.peaks[cycle]), pd.Timedelta(end - start))
+
+
+def _localize(times: np.ndarray, tz) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(times.view("datetime64[ns]"), tz="UTC").tz_convert(tz)
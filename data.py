@@ -1,15 +1,40 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Iterable, Tuple, NamedTuple, Optional, List, Sequence
 
 import numpy as np
 import pandas as pd
+import pyarrow.feather as feather
 import streamlit as st
 
-from shared import is_in_winter_mode, HitTimes, Thresholds, ThresholdCrossings, PROJECT_TIMEZONE
-
+import sharing
+from aggregates import AggregateIndex
+from cooldown import CoolDownLibrary
+from cycles import HeatingCycleIndex
+from crossings import IndexedRows, ThresholdCrossingIndex, first_time_below, parts_from
+from lttb import min_max_lttb
+from profiling import timed, computed, nbytes
+from shared import is_in_winter_mode, HitTimes, Thresholds, ThresholdCrossings, PROJECT_TIMEZONE, MIN_THRESHOLD, \
+    MAX_THRESHOLD
+from sharing import SharedStores
+from store import EncodedColumn, MeanColumn, TimeSeriesStore, concat
+from units import Unit, UnitCache, DEFAULT_UNIT, UNITS_PATH, read_units
+
+# the data files of the DEFAULT_UNIT, other units have their own (see units.py)
 CSV_PATH = "data/heating-data_cleaned.csv"
 SUMMER_PREDICTION_CSV_PATH = "data/summer_prediction.csv"
 WINTER_PREDICTION_CSV_PATH = "data/winter_prediction.csv"
+# a cleaned csv (same format as data/heating-data_cleaned.csv) which is appended to by a live feed, e.g. the
+# HeatingDataMonitor. If it exists, new rows are ingested into the dataset in the background as they're appended.
+LIVE_CSV_PATH = "data/heating-data_live.csv"
+
+# typed, pre-sorted columnar files written by transform-data.py next to the csv files. Preferred over the csv if present.
+COLUMNAR_EXTENSION = ".feather"
 
 TIME = "received_time"
 DRINKING_WATER = "drinking_water"
@@ -18,11 +43,53 @@ BUFFER_MIN = "buffer_min"
 BUFFER_AVG = "buffer_avg"
 HEATING_UP = "heating_up"
 
+# all the columns get_period returns
+TEMPERATURE_COLUMNS = [DRINKING_WATER, BUFFER_MAX, BUFFER_MIN, BUFFER_AVG]
+
 TIME_OFFSET = np.timedelta64(1, "Y")
+# resample(origin="epoch") uses the epoch in the timezone of the index
+EPOCH = pd.Timestamp("1970-01-01", tz=PROJECT_TIMEZONE)
 
 PREDICTED_PERIOD = np.timedelta64(3, "D")
 PREDICTED_COLUMNS = [BUFFER_MAX, DRINKING_WATER]
 HIT_POINT_DETECTION_PAST_OFFSET = np.timedelta64(-1, "D")
+# the thresholds whose crossings are precomputed for the PREDICTED_COLUMNS, others are found by scanning the data
+INDEXED_THRESHOLDS = range(MIN_THRESHOLD, MAX_THRESHOLD + 1)
+# key in DataFrame.attrs of the frames returned by get_period under which the parts they consist of are kept (see
+# CrossingParts)
+CROSSING_PARTS = "crossing_parts"
+
+# temperatures are recorded in steps of 0.1 °C. Rounding to that removes float32 noise from the stored temperatures
+# so they match the templates exactly like the recorded values would and they can be used as cache keys.
+TEMPLATE_MATCH_DECIMALS = 1
+# number of spliced predictions (and best template matches) to keep in the cache of every unit
+PREDICTION_CACHE_SIZE = 256
+
+# store the dataset compactly: temperatures as int16 steps of 0.1 °C (as they're recorded, columns with values that
+# can't be stored exactly stay float32), heating_up packed into bits and buffer_avg computed from buffer_max and
+# buffer_min whenever it's read instead of stored. Decoded values are exactly the same as without it.
+COMPACT_DATASET = True
+RECORDED_DECIMALS = 1
+
+# for the time spent below a threshold, every row lasts until the next one but at most this long (gaps in the data)
+STATISTICS_MAX_ROW_DURATION = np.timedelta64(10, "m")
+
+# when the prediction contains a heating up, the trajectory of the last HISTORY_MATCH_WINDOW before it is matched
+# against every natural cool-down in the history (averaged to HISTORY_RESOLUTION) to find the best continuation.
+# Set to False to only use the fixed summer and winter templates, which are otherwise only used without enough history
+# or to complete a continuation which ends early.
+PREDICT_FROM_HISTORY = True
+HISTORY_RESOLUTION = np.timedelta64(10, "m")
+HISTORY_MATCH_WINDOW = np.timedelta64(6, "h")
+# a match with a continuation for the full PREDICTED_PERIOD is preferred if its root mean squared error is below this
+HISTORY_MATCH_TOLERANCE = 1  # °C
+
+# how get_period reduces the past data. MEDIAN resamples it depending on the length of the period according to
+# DOWNSAMPLING. LTTB (opt-in) keeps the points which preserve the shape of every temperature best (including the peaks
+# while heating up) up to the number of points requested (e.g. one per pixel of the chart).
+LTTB = "lttb"
+MEDIAN = "median"
+DOWNSAMPLING_METHOD = MEDIAN
 
 # a list of downsampling conditions with their respective resampling interval. Must be ordered DESCENDING.
 # first element in the tuple is length of the period that must be overstepped to trigger the downsampling.
@@ -35,120 +102,847 @@ DOWNSAMPLING = [
 ]
 
 
-# entire dataset is cached and held in memory.
+# when several server processes run the dashboard (e.g. behind a load balancer), SHARE_DATASET lets them share one
+# copy of the dataset and the templates (per unit): the first process builds them and publishes them as memory-mapped
+# files in SHARED_DATA_DIR, the others map them without copying (see sharing.py). Only one process ingests a live feed,
+# it publishes a new version with the appended rows which the others switch to on their next run (see
+# follow_shared_data).
+SHARE_DATASET = False
+SHARED_DATA_DIR = "data/shared"
+# every version is a full copy of the dataset, so the ingesting process publishes the rows it appended at most every
+# SHARED_PUBLISH_INTERVAL seconds, or earlier once SHARED_PUBLISH_ROWS are pending. The other processes see them that
+# much later.
+SHARED_PUBLISH_INTERVAL = 5 * 60
+SHARED_PUBLISH_ROWS = 1000
+# the names of the published stores (every unit publishes its own in a subdirectory named after it)
+SHARED_DATASET = "dataset"
+SHARED_SUMMER_TEMPLATE = "summer_prediction"
+SHARED_WINTER_TEMPLATE = "winter_prediction"
+
+# everything loaded for the units (see units.py) may take this many bytes, the least recently used units are evicted
+# beyond it. Units with a live feed stay loaded (see live.py).
+UNIT_MEMORY_LIMIT = 2 * 2 ** 30
+# units loaded at the same time by preload_units
+UNIT_LOAD_WORKERS = 4
+
+# serializes appending to the dataset of a unit (by name), reading doesn't need it (see TimeSeriesStore.append)
+_APPEND_LOCKS: Dict[str, threading.Lock] = {}
+# when the dataset of a unit (by name) was last published by this process (time.monotonic) and with how many rows
+_PUBLISHED: Dict[str, Tuple[float, int]] = {}
+
+
+@st.experimental_singleton
+def load_units() -> Dict[str, Unit]:
+    """Returns the heating units by name (see units.py), the dashboard shows the first one by default."""
+    default = Unit(DEFAULT_UNIT, CSV_PATH, SUMMER_PREDICTION_CSV_PATH, WINTER_PREDICTION_CSV_PATH,
+                   live_csv_path=LIVE_CSV_PATH)
+    return read_units(UNITS_PATH, default)
+
+
+def _evicted(unit: Unit):
+    # the cached predictions and downsampling of the evicted unit refer to its data, those of the others stay valid
+    for cached in (splice_prediction, _best_template_match, _largest_triangles):
+        cached.cache_clear(unit.name)
+
+
+_UNIT_CACHE = UnitCache(UNIT_MEMORY_LIMIT, on_evict=_evicted)
+
+
+def per_unit(func):
+    """
+    Decorator for the functions which load something for a unit (their only argument, the name of the unit), which is
+    loaded once and kept until the unit is evicted (see units.UnitCache). The per unit st.experimental_singleton.
+    """
+
+    @wraps(func)
+    def wrapper(unit: str = DEFAULT_UNIT):
+        return _UNIT_CACHE.part(load_units()[unit], func.__name__, lambda: func(unit))
+
+    wrapper.clear = _UNIT_CACHE.clear  # for every unit like the clear of the singletons
+    return wrapper
+
+
+def lru_cache_per_unit(maxsize: int):
+    """
+    Decorator like lru_cache(maxsize) for the functions whose first argument is the name of a unit, with one cache per
+    unit. Its cache_clear() clears the caches of all units, cache_clear(unit) only the one of that unit (e.g. when it's
+    evicted, see units.UnitCache).
+    """
+
+    def decorator(func):
+        caches: Dict[str, Callable] = {}
+
+        @wraps(func)
+        def wrapper(unit: str, *args, **kwargs):
+            cached = caches.get(unit)
+            if cached is None:
+                cached = caches.setdefault(unit, lru_cache(maxsize=maxsize)(func))  # atomic, all threads get the same
+            return cached(unit, *args, **kwargs)
+
+        def cache_clear(unit: Optional[str] = None):
+            for name in list(caches) if unit is None else [unit]:
+                caches.pop(name, None)
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
+
+
+def pin_unit(unit: str):
+    """Keeps everything loaded for a unit until the server stops (see units.UnitCache.pin)."""
+    _UNIT_CACHE.pin(unit)
+
+
+def loaded_units() -> Dict[str, int]:
+    """Returns the bytes everything loaded for a unit takes for every loaded unit, the most recently used last."""
+    return _UNIT_CACHE.loaded()
+
+
+def preload_units(units: Iterable[str], workers=UNIT_LOAD_WORKERS):
+    """
+    Loads the datasets of the units and everything precomputed from them in parallel, e.g. when the server starts.
+    Units beyond UNIT_MEMORY_LIMIT evict the ones loaded before them again.
+    """
+    with ThreadPoolExecutor(workers, thread_name_prefix="unit-loading") as executor:
+        for _ in executor.map(_preload_unit, units):
+            pass
+
+
+def _preload_unit(unit: str):
+    load_data(unit)
+    earliest_time(unit)
+    load_crossing_index(unit)
+    load_cycle_index(unit)
+    load_aggregate_index(unit)
+    load_cool_down_library(unit)
+    load_prediction_templates(unit)
+    if DOWNSAMPLING_METHOD == MEDIAN:
+        load_downsampled_crossing_indexes(unit)
+
+
+# entire dataset of a unit is cached and held in memory (only ever appended to, see append_data).
 # if it was much bigger, periods with from/to could be cached instead.
-@st.cache
-def load_data():
+@timed(rows=lambda data, *_: len(data), cached=True)
+@per_unit
+@computed
+def load_data(unit: str = DEFAULT_UNIT) -> TimeSeriesStore:
     """
-    Loads and prepares the dataset. Times are shifted by 1 year to get data from early 2021 to late 2023
-    which allows for fake-predictions using real data and still allows exploration in the past.
+    Loads and prepares the dataset of a unit into a compact store (float32 temperatures, even more compact with
+    COMPACT_DATASET, see memory_report). Times are shifted by 1 year to get data
+    from early 2021 to late 2023 which allows for fake-predictions using real data and still allows exploration in the
+    past.
+    With SHARE_DATASET, the arrays are mapped from the version published by the first process (see load_shared_stores).
     """
-    heating_data = _load_time_dataset(CSV_PATH)
+    if SHARE_DATASET:
+        return load_shared_stores(unit).stores[SHARED_DATASET]
+
+    return _build_data(unit)
+
+
+def _build_data(unit: str) -> TimeSeriesStore:
+    heating_data = _load_time_dataset(load_units()[unit].csv_path)
     # shift everything 1 year into the future to have fake prediction values
     heating_data.index = heating_data.index + TIME_OFFSET
-    return heating_data
+    if not COMPACT_DATASET:
+        return TimeSeriesStore.from_frame(heating_data)
 
+    store = TimeSeriesStore.from_frame(heating_data.drop(columns=BUFFER_AVG), compact_decimals=RECORDED_DECIMALS)
+    buffer_avg = MeanColumn(store, BUFFER_MAX, BUFFER_MIN, RECORDED_DECIMALS)
+    # only if the buffer temperatures are all recorded in steps of RECORDED_DECIMALS, otherwise it's stored as usual
+    expected = heating_data[BUFFER_AVG].to_numpy(np.float32)
+    store.columns[BUFFER_AVG] = buffer_avg if np.array_equal(buffer_avg[:], expected, equal_nan=True) else expected
+    return store
 
-@st.cache
-def load_prediction_templates():
-    """Loads the prediction templates for summer and winter (returned in a 2-tuple in that order)."""
 
-    summer = _load_time_dataset(SUMMER_PREDICTION_CSV_PATH)
-    winter = _load_time_dataset(WINTER_PREDICTION_CSV_PATH)
+def append_data(new_data: pd.DataFrame, unit: str = DEFAULT_UNIT) -> int:
+    """
+    Appends the rows of a cleaned dataset (same format as the csv, e.g. from a live feed) which are newer than the
+    dataset of a unit to it. Everything derived from it is updated in place (buffer_avg, the downsampled levels and the
+    crossing indexes), so every session sees the new data on its next run without reloading anything.
+    The cool-down library isn't updated, it only knows the cool-downs which were there when it was loaded.
+
+    :param new_data: The new rows with the time in the TIME column.
+    :param unit: The name of the unit.
+    :return: The number of rows appended.
+    """
+    new_data = _prepare_time_dataset(new_data.copy())
+    # shifted like the rest of the dataset
+    new_data.index = new_data.index + TIME_OFFSET
+    with _append_lock(unit):
+        data = load_data(unit)
+        if len(data):
+            new_data = new_data[new_data.index > data.time_at(-1)]
+
+        if not len(new_data):
+            return 0
+
+        position = len(data)
+        data.append(TimeSeriesStore.from_frame(new_data[list(data.columns)]))
+        buffer_avg = data.columns[BUFFER_AVG]
+        if isinstance(buffer_avg, MeanColumn) and \
+                not np.array_equal(buffer_avg[position:], new_data[BUFFER_AVG].to_numpy(np.float32), equal_nan=True):
+            # the new rows aren't recorded in steps of RECORDED_DECIMALS, buffer_avg is stored from now on
+            stored = np.concatenate([buffer_avg[:position], new_data[BUFFER_AVG].to_numpy(np.float32)])
+            data.columns = {**data.columns, BUFFER_AVG: stored}
+
+        _extend_derived_data(data, new_data.index, unit)
+        if SHARE_DATASET:
+            _publish_appended_data(data, unit)
+
+    return len(new_data)
+
+
+def _append_lock(unit: str) -> threading.Lock:
+    return _APPEND_LOCKS.setdefault(unit, threading.Lock())  # atomic, all threads get the same lock
+
+
+def _extend_derived_data(data: TimeSeriesStore, new_index: pd.DatetimeIndex, unit: str):
+    """Updates everything derived from the dataset after the rows with the new index were appended to it."""
+    # before the crossing index, the aggregates need the rows of every run below a threshold it knows of
+    load_aggregate_index(unit).extend(data)
+    load_crossing_index(unit).extend(data)
+    load_cycle_index(unit).extend(data)
+    if DOWNSAMPLING_METHOD == MEDIAN:
+        _update_downsampled_data(data, new_index, unit)
+
+
+@per_unit
+def load_shared_stores(unit: str = DEFAULT_UNIT) -> SharedStores:
+    """
+    Maps the dataset and the prediction templates of a unit published in its shared directory (see sharing.py and
+    shared_directory). If they weren't published yet for the current data files, they're built and published first
+    (by the first process to get here). The dataset of the version might have more rows (ingested by another process)
+    than the files.
+    """
+    directory = shared_directory(unit)
+    source = _source_version(unit)
+    with sharing.locked(directory, exclusive=False):
+        shared = sharing.attach(directory)
+    if shared is not None and _shared_source(shared.version) == source:
+        return shared
+
+    with sharing.locked(directory):
+        shared = sharing.attach(directory)  # another process might have published it while waiting for the lock
+        if shared is None or _shared_source(shared.version) != source:
+            sharing.publish(directory, source, {
+                SHARED_DATASET: _build_data(unit),
+                SHARED_SUMMER_TEMPLATE: _load_template_store(load_units()[unit].summer_prediction_csv_path),
+                SHARED_WINTER_TEMPLATE: _load_template_store(load_units()[unit].winter_prediction_csv_path),
+            })
+            shared = sharing.attach(directory)
+
+    return shared
+
+
+def shared_directory(unit: str) -> str:
+    """Returns the directory in SHARED_DATA_DIR the stores of a unit are published in."""
+    return os.path.join(SHARED_DATA_DIR, unit)
+
+
+def follow_shared_data(unit: str = DEFAULT_UNIT) -> int:
+    """
+    With SHARE_DATASET, switches the dataset of a unit to the newest version published in its shared directory if it
+    has rows this process doesn't have yet (ingested by another process). Nothing is copied, everything derived from
+    the dataset is updated like in append_data. Only reads a tiny file if there is no new version, so it can be called
+    on every run.
+
+    :return: The number of new rows.
+    """
+    if not SHARE_DATASET:
+        return 0
+
+    directory = shared_directory(unit)
+    version = sharing.current_version(directory)
+    source = _shared_source(load_shared_stores(unit).version)
+    with _append_lock(unit):
+        data = load_data(unit)
+        # a version for other data files needs a restart, the rows before might have changed
+        if version is None or _shared_source(version) != source or _shared_rows(version) <= len(data):
+            return 0
+
+        with sharing.locked(directory, exclusive=False):
+            shared = sharing.attach(directory)
+
+        position = len(data)
+        data.adopt(shared.stores[SHARED_DATASET])
+        _extend_derived_data(data, data.take(position, len(data)).index(), unit)
+        return len(data) - position
+
+
+def publish_pending_data(unit: str = DEFAULT_UNIT) -> int:
+    """
+    With SHARE_DATASET, publishes the rows this process appended to the dataset of a unit since its last version if
+    that is due (see SHARED_PUBLISH_INTERVAL). Called regularly by the live ingestion, so the last rows are published
+    even if the feed stops.
+
+    :return: The number of rows published.
+    """
+    if not SHARE_DATASET:
+        return 0
+
+    with _append_lock(unit):
+        return _publish_appended_data(load_data(unit), unit)
+
+
+def _publish_appended_data(data: TimeSeriesStore, unit: str) -> int:
+    """
+    Publishes the dataset with the rows this process appended as a new version and maps it instead of its copy, if
+    SHARED_PUBLISH_INTERVAL passed since the last version or SHARED_PUBLISH_ROWS are pending. Returns the number of
+    rows published.
+    """
+    shared = load_shared_stores(unit)
+    published_at, published_rows = _PUBLISHED.get(unit, (-np.inf, _shared_rows(shared.version)))
+    pending = len(data) - published_rows
+    if pending <= 0 or (time.monotonic() - published_at < SHARED_PUBLISH_INTERVAL and pending < SHARED_PUBLISH_ROWS):
+        return 0
+
+    directory = shared_directory(unit)
+    with sharing.locked(directory):
+        sharing.publish(directory, f"{_shared_source(shared.version)}+{len(data)}",
+                        {**shared.stores, SHARED_DATASET: data})
+        data.adopt(sharing.attach(directory).stores[SHARED_DATASET])
+
+    _PUBLISHED[unit] = time.monotonic(), len(data)
+    return pending
+
+
+def _source_version(unit: str) -> str:
+    """Returns a name for the data files and the settings the shared stores are built with, changes with any of them."""
+    files = []
+    paths = load_units()[unit]
+    for csv_path in (paths.csv_path, paths.summer_prediction_csv_path, paths.winter_prediction_csv_path):
+        for path in (csv_path, os.path.splitext(csv_path)[0] + COLUMNAR_EXTENSION):
+            if os.path.exists(path):
+                files.append((os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns))
+
+    settings = files, COMPACT_DATASET, RECORDED_DECIMALS, str(TIME_OFFSET)
+    return hashlib.sha1(repr(settings).encode()).hexdigest()[:16]
+
+
+def _shared_source(version: str) -> str:
+    # versions with ingested rows are named <source version>+<number of rows>
+    return version.partition("+")[0]
+
+
+def _shared_rows(version: str) -> int:
+    rows = version.partition("+")[2]
+    return int(rows) if rows else 0
+
+
+@per_unit
+def load_downsampled_data(unit: str = DEFAULT_UNIT):
+    """
+    Precomputes every level in DOWNSAMPLING for the whole dataset of a unit (median per resampling interval), so that
+    get_period only has to slice the matching level instead of resampling the raw data on every run.
+
+    Resampling a period aligns the bins to midnight of its first day. Since midnights are not always a multiple of the
+    interval apart (daylight saving time), a level is computed for every phase of the midnights within the interval.
+
+    :return: A dictionary from (resampling interval, phase) to a store with the downsampled TEMPERATURE_COLUMNS.
+    """
+    data = load_data(unit).to_frame(TEMPERATURE_COLUMNS)
+    return {key: _downsample_level(data, *key) for key in _downsampling_keys(data.index)}
+
+
+def _downsampling_keys(index: pd.DatetimeIndex):
+    """Returns the (resampling interval, phase) of the levels needed for periods starting on the days in an index."""
+    midnights = pd.date_range(index[0].normalize(), index[-1], freq="D")
+    return {(interval, phase) for _, interval in DOWNSAMPLING
+            for phase in (midnights - EPOCH) % pd.to_timedelta(interval)}
+
 
-    return summer, winter
+def _downsample_level(data: pd.DataFrame, interval: str, phase: pd.Timedelta) -> TimeSeriesStore:
+    # ignore na after resample, plot does free LERP
+    return TimeSeriesStore.from_frame(data.resample(interval, origin="epoch", offset=phase).median().dropna())
+
+
+def _update_downsampled_data(data: TimeSeriesStore, new_index: pd.DatetimeIndex, unit: str):
+    """Updates the downsampled levels (and their crossing indexes) after new rows were appended to the dataset."""
+    levels = load_downsampled_data(unit)
+    indexes = load_downsampled_crossing_indexes(unit)
+    for key, level in list(levels.items()):
+        # the last bin may only have been partially filled, so it's computed again with the new rows
+        position = max(len(level) - 1, 0)
+        since = level.time_at(position) if len(level) else None
+        level.append(_downsample_level(data.slice(since).to_frame(TEMPERATURE_COLUMNS), *key), position)
+        indexes[key].extend(level, position)
+
+    # the new days might start with a phase that wasn't needed before (daylight saving time)
+    for key in _downsampling_keys(new_index) - levels.keys():
+        levels[key] = _downsample_level(data.to_frame(TEMPERATURE_COLUMNS), *key)
+        indexes[key] = ThresholdCrossingIndex(levels[key], PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+
+
+@per_unit
+def load_crossing_index(unit: str = DEFAULT_UNIT) -> ThresholdCrossingIndex:
+    """Indexes when the PREDICTED_COLUMNS drop below each of the INDEXED_THRESHOLDS in the dataset of a unit."""
+    return ThresholdCrossingIndex(load_data(unit), PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+
+
+@per_unit
+def load_downsampled_crossing_indexes(unit: str = DEFAULT_UNIT):
+    """Same as load_crossing_index but for every level of load_downsampled_data (with the same keys)."""
+    return {key: ThresholdCrossingIndex(level, PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+            for key, level in load_downsampled_data(unit).items()}
+
+
+@per_unit
+def load_cycle_index(unit: str = DEFAULT_UNIT) -> HeatingCycleIndex:
+    """Indexes every heating up (cycle) in the dataset of a unit with the peak of the BUFFER_MAX while heating up."""
+    return HeatingCycleIndex(load_data(unit), HEATING_UP, BUFFER_MAX)
+
+
+@per_unit
+def load_aggregate_index(unit: str = DEFAULT_UNIT) -> AggregateIndex:
+    """Precomputes the aggregates of the TEMPERATURE_COLUMNS in the dataset of a unit for get_period_statistics."""
+    return AggregateIndex(load_data(unit), TEMPERATURE_COLUMNS, STATISTICS_MAX_ROW_DURATION)
+
+
+@per_unit
+def load_cool_down_library(unit: str = DEFAULT_UNIT) -> CoolDownLibrary:
+    """Indexes every natural cool-down in the dataset of a unit to find continuations for the prediction in."""
+    return CoolDownLibrary(load_data(unit), PREDICTED_COLUMNS, HEATING_UP, HISTORY_RESOLUTION)
+
+
+class PredictionTemplate(NamedTuple):
+    """
+    A prediction template with its PREDICTED_COLUMNS preloaded as a contiguous matrix for matching and the index of
+    their threshold crossings.
+    """
+    store: TimeSeriesStore
+    matrix: np.ndarray
+    crossings: ThresholdCrossingIndex
+
+
+@per_unit
+def load_prediction_templates(unit: str = DEFAULT_UNIT) -> Tuple[PredictionTemplate, PredictionTemplate]:
+    """Loads the prediction templates of a unit for summer and winter (returned in a 2-tuple in that order)."""
+
+    if SHARE_DATASET:
+        stores = load_shared_stores(unit).stores
+        summer, winter = stores[SHARED_SUMMER_TEMPLATE], stores[SHARED_WINTER_TEMPLATE]
+    else:
+        summer = _load_template_store(load_units()[unit].summer_prediction_csv_path)
+        winter = _load_template_store(load_units()[unit].winter_prediction_csv_path)
+
+    return _prediction_template(summer), _prediction_template(winter)
+
+
+def memory_report(unit: str = DEFAULT_UNIT) -> pd.DataFrame:
+    """
+    Returns how many bytes the dataset (per column) of a unit, its templates and everything precomputed from them take
+    in memory, as one row per structure and part. Loads everything that isn't loaded yet. Memory shared between
+    structures (e.g. views of the dataset) is only counted for the first one.
+    """
+    data = load_data(unit)
+    # columns computed from the store (see MeanColumn) refer to it, which must not count its other columns again
+    seen = {id(data)}
+    rows = [("dataset", "times", str(data.times.dtype), nbytes(data.times, seen))]
+    for col, values in data.columns.items():
+        encoding = type(values).__name__ if isinstance(values, EncodedColumn) else str(values.dtype)
+        rows.append(("dataset", col, encoding, nbytes(values, seen)))
+
+    structures = {
+        "templates": load_prediction_templates(unit),
+        "crossing index": load_crossing_index(unit),
+        "cycle index": load_cycle_index(unit),
+        "aggregate index": load_aggregate_index(unit),
+        "cool-down library": load_cool_down_library(unit),
+    }
+    if DOWNSAMPLING_METHOD == MEDIAN:
+        structures["downsampled levels"] = load_downsampled_data(unit)
+        structures["downsampled crossing indexes"] = load_downsampled_crossing_indexes(unit)
+
+    rows.extend((name, "", "", nbytes(structure, seen)) for name, structure in structures.items())
+    return pd.DataFrame(rows, columns=["structure", "part", "encoding", "bytes"])
+
+
+def _load_template_store(csv_path: str) -> TimeSeriesStore:
+    # templates are tiny, keep them as float64 so they're matched exactly as recorded
+    return TimeSeriesStore.from_frame(_load_time_dataset(csv_path), float_dtype=np.float64)
+
+
+def _prediction_template(store: TimeSeriesStore) -> PredictionTemplate:
+    return PredictionTemplate(store, store.matrix(PREDICTED_COLUMNS),
+                              ThresholdCrossingIndex(store, PREDICTED_COLUMNS, INDEXED_THRESHOLDS))
 
 
 def _load_time_dataset(csv_path: str):
-    df = pd.read_csv(csv_path)
+    """
+    Loads a time-indexed dataset from the columnar file next to the csv (see transform-data.py) if there is one that's
+    at least as new as the csv, otherwise parses the csv itself. Both result in the same frame.
+    """
+    columnar_path = os.path.splitext(csv_path)[0] + COLUMNAR_EXTENSION
+    if os.path.exists(columnar_path) and \
+            (not os.path.exists(csv_path) or os.path.getmtime(columnar_path) >= os.path.getmtime(csv_path)):
+        return _load_columnar_time_dataset(columnar_path)
+
+    return _load_csv_time_dataset(csv_path)
+
+
+def _load_csv_time_dataset(csv_path: str):
+    return _prepare_time_dataset(pd.read_csv(csv_path))
+
+
+def _prepare_time_dataset(df: pd.DataFrame):
     df.index = pd.to_datetime(df.pop(TIME), utc=True)
     df.index = df.index.tz_convert(PROJECT_TIMEZONE)
     df[BUFFER_AVG] = (df[BUFFER_MAX] + df[BUFFER_MIN]) / 2
     return df.sort_index()
 
 
+def _load_columnar_time_dataset(columnar_path: str):
+    # the time column holds int64 nanoseconds since epoch (UTC) and buffer_avg is there. The rows are sorted, except
+    # if the file was streamed from an unsorted export (then only within chunks).
+    df = feather.read_table(columnar_path, memory_map=True).to_pandas()
+    df.index = pd.DatetimeIndex(df.pop(TIME).to_numpy().view("datetime64[ns]"), tz="UTC", name=TIME)
+    df.index = df.index.tz_convert(PROJECT_TIMEZONE)
+    return df if df.index.is_monotonic_increasing else df.sort_index(kind="stable")
+
+
 @st.cache
-def earliest_time() -> datetime:
-    """Returns the earliest recorded time in the dataset."""
-    return load_data().index.min()
+def earliest_time(unit: str = DEFAULT_UNIT) -> datetime:
+    """Returns the earliest recorded time in the dataset of a unit."""
+    return load_data(unit).time_at(0)
 
 
-def get_period(period_from: datetime, period_to: datetime) -> Tuple[pd.Series, pd.DataFrame, pd.DataFrame]:
+@timed(rows=lambda result, *_, **__: len(result[1]) + len(result[2]))
+def get_period(period_from: datetime, period_to: datetime, max_points: Optional[int] = None,
+               unit: str = DEFAULT_UNIT) -> Tuple[pd.Series, pd.DataFrame, pd.DataFrame]:
     """
     Fetches data in a certain period of time including a forecast prediction right after the end of the period.
-    Automatic downsampling is done with respect of the requested timespan to reduce the number of rows returned
-    (see DOWNSAMPLING).
+    Automatic downsampling is done to reduce the number of rows returned (see DOWNSAMPLING_METHOD).
 
     :param period_from: Timestamp for the start of the period.
     :param period_to: Timestamp for the end of the period.
+    :param max_points: With the LTTB method, how many points of each temperature to keep at most in the past data.
+                       The rows of all of them are returned. None to keep all the rows.
+    :param unit: The name of the unit.
     :return: A 3-tuple with the current value (at period end), the past data (during period) and predicted data
-             (after period plus PREDICTED_PERIOD).
+             (after period plus PREDICTED_PERIOD). The dataframes remember which indexed parts (at full resolution
+             with LTTB) they consist of to look up threshold crossings quickly (see projected_hit_times).
     """
     period_from, period_to = pd.to_datetime(period_from), pd.to_datetime(period_to)
 
-    data = load_data().drop(HEATING_UP, axis=1)[period_from:period_to]
-    current = data.iloc[-1]
+    # only views into the dataset until the (much smaller) dataframes are created at the end
+    dataset = load_data(unit)
+    start, stop = dataset.bounds(period_from, period_to)
+    past = dataset.take(start, stop, TEMPERATURE_COLUMNS)
+    current = past.row(-1)
 
     timespan = period_to - period_from
     # first matching resample interval whose condition matches (queried period length is longer then its condition)
     resample_interval = next((interval for condition, interval in DOWNSAMPLING if timespan >= condition), None)
 
-    if resample_interval:
-        data = data.resample(resample_interval).median().dropna()  # ignore na after resample, plot does free LERP
-
-    predicted = load_data()[period_to:period_to + PREDICTED_PERIOD]
-    during_heating_up = predicted.query(HEATING_UP)
-    predicted = predicted.drop(HEATING_UP, axis=1)  # not needed anymore after it got queried
-
-    # if the prediction contains a heating process, we want to replace that part of it with a pre-defined prediction.
-    # these pre-defined predictions are snippets of real data, namely in the places that go to the lowest temperature
-    # naturally in the dataset. This means every other progression ends descending (=starts heating up again) before the
-    # templates so the templates can be added onto the end with less chance of not finding a good continuation point.
-    if not during_heating_up.empty:
-        summer_pred, winter_pred = load_prediction_templates()
-        # select correct prediction template; in summer it's much longer and less steep than in winter
-        prediction_template = winter_pred if is_in_winter_mode(period_to) else summer_pred
-        heating_up_row = during_heating_up.reset_index().iloc[0]
-        first_time_heating_up: datetime = heating_up_row[TIME]
-        # determine best matching point (time) in the prediction template using the sum of squared errors
-        sse = (prediction_template[PREDICTED_COLUMNS] - heating_up_row[PREDICTED_COLUMNS]).pow(2).sum(axis=1)
-        best_match_in_template: datetime = sse.idxmin()
-
-        # template end time: from the best matching point, take data to complete the PREDICTED_PERIOD together with
-        # the real data (before heating up)
-        template_prediction_end_time = best_match_in_template + PREDICTED_PERIOD - (first_time_heating_up - period_to)
-        prediction_template = prediction_template[best_match_in_template:template_prediction_end_time]
-        # move predicted times to the cut off point
-        prediction_template.index = prediction_template.index - (prediction_template.index[0] - first_time_heating_up)
-        # cut data at the point of first heating up and add prediction template from best matching time until the end.
-        # The subtraction of 1 second is to avoid duplicates when the time matches exactly.
-        predicted = pd.concat([predicted[:first_time_heating_up - np.timedelta64(1, "s")], prediction_template])
-
-    return current, data, predicted
+    shown_data = None
+    if DOWNSAMPLING_METHOD == MEDIAN and resample_interval:
+        data = _downsample(past, period_from, period_to, resample_interval, unit)
+    else:
+        data = [IndexedRows(past, load_crossing_index(unit), start)]
+        if DOWNSAMPLING_METHOD == LTTB and max_points and len(past) > max_points:
+            shown_data = _largest_triangles(unit, start, stop, max_points)
+
+    start, stop = dataset.bounds(period_to, period_to + PREDICTED_PERIOD)
+    first_heating_up = load_cycle_index(unit).first_heating_up(start, stop)
+
+    # if the prediction contains a heating process, we want to replace that part of it with a prediction of how it
+    # would have continued without heating up (see splice_prediction).
+    if first_heating_up is not None:
+        heating_up_row = dataset.row(first_heating_up, PREDICTED_COLUMNS)
+        predicted = splice_prediction(unit, is_in_winter_mode(period_to, load_units()[unit].season),
+                                      quantize_temperatures(heating_up_row), heating_up_row.name, period_to)
+    else:
+        predicted = [IndexedRows(dataset.take(start, stop, TEMPERATURE_COLUMNS), load_crossing_index(unit), start)]
 
+    return current, frame_from_parts(data, shown_data), frame_from_parts(predicted)
 
+
+class PeriodStatistics(NamedTuple):
+    """Summary statistics of the recorded data in a period (see get_period_statistics)."""
+    temperatures: pd.DataFrame  # the min, mean and max (columns) of every one of the TEMPERATURE_COLUMNS (rows)
+    time_below: pd.DataFrame  # how long the PREDICTED_COLUMNS (rows) were below the upper and lower threshold
+    firings: int  # how often the unit was fired up
+
+
+@timed()
+def get_period_statistics(period_from: datetime, period_to: datetime, thresholds: Thresholds,
+                          unit: str = DEFAULT_UNIT) -> PeriodStatistics:
+    """
+    Computes summary statistics of the data (at full resolution) in a period. They're looked up in precomputed
+    aggregates (see AggregateIndex, load_crossing_index and load_cycle_index), so they take the same time for any
+    length of the period.
+
+    :param period_from: Timestamp for the start of the period.
+    :param period_to: Timestamp for the end of the period (inclusive).
+    :param thresholds: The thresholds to compute the time spent below for. Integer ones (see INDEXED_THRESHOLDS) are
+                       looked up, others need a pass over the period.
+    :param unit: The name of the unit.
+    :return: The statistics, the temperatures are NaN if there's no data in the period.
+    """
+    start, stop = load_data(unit).bounds(pd.to_datetime(period_from), pd.to_datetime(period_to))
+    aggregates = load_aggregate_index(unit)
+    temperatures = pd.DataFrame({
+        "min": [aggregates.minimum(col, start, stop) for col in TEMPERATURE_COLUMNS],
+        "mean": [aggregates.mean(col, start, stop) for col in TEMPERATURE_COLUMNS],
+        "max": [aggregates.maximum(col, start, stop) for col in TEMPERATURE_COLUMNS],
+    }, index=TEMPERATURE_COLUMNS)
+    time_below = pd.DataFrame({
+        name: pd.to_timedelta([aggregates.time_below(col, threshold, start, stop, load_crossing_index(unit))
+                               for col in PREDICTED_COLUMNS])
+        for name, threshold in thresholds._asdict().items()
+    }, index=PREDICTED_COLUMNS)
+    return PeriodStatistics(temperatures, time_below, load_cycle_index(unit).count(start, stop))
+
+
+class CrossingParts(NamedTuple):
+    """
+    The parts a frame returned by get_period consists of and the rows it had then. Pandas copies the attrs to every
+    slice of the frame, whose rows the parts don't describe anymore.
+    """
+    parts: List[IndexedRows]
+    rows: Tuple[int, Optional[pd.Timestamp], Optional[pd.Timestamp]]  # see _frame_rows
+
+    def describe(self, frame: pd.DataFrame) -> bool:
+        """Whether the parts still describe the rows of a frame, e.g. not if it's a slice of the frame they're from."""
+        return self.rows == _frame_rows(frame)
+
+
+def _frame_rows(frame: pd.DataFrame) -> Tuple[int, Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+    # the number of rows and the first and last time, selecting columns keeps them
+    return (len(frame), frame.index[0], frame.index[-1]) if len(frame) else (0, None, None)
+
+
+def frame_from_parts(parts: List[IndexedRows], rows: Optional[TimeSeriesStore] = None) -> pd.DataFrame:
+    """
+    Returns consecutive parts (or other rows representing them, e.g. downsampled) as one dataframe which keeps the
+    parts in its attrs (see CROSSING_PARTS), like the frames get_period returns.
+    """
+    if rows is None:
+        rows = parts[0].rows if len(parts) == 1 else concat(*(part.rows for part in parts))
+
+    frame = rows.to_frame(TEMPERATURE_COLUMNS)
+    frame.attrs[CROSSING_PARTS] = CrossingParts(parts, _frame_rows(frame))
+    return frame
+
+
+def quantize_temperatures(temperatures: pd.Series) -> Tuple[float, ...]:
+    """
+    Returns temperatures (e.g. a row of the dataset) rounded to TEMPLATE_MATCH_DECIMALS as they're matched against the
+    templates and the history, usable as a cache key (see splice_prediction).
+    """
+    return tuple(temperatures.astype(np.float64).round(TEMPLATE_MATCH_DECIMALS))
+
+
+# these caches are shared by all sessions and keyed by the unit, the season and the (quantized) heating up
+# temperatures, so reruns with the same period (e.g. when changing the thresholds) skip both the matching and the
+# splicing.
+@timed(cached=True)
+@lru_cache_per_unit(PREDICTION_CACHE_SIZE)
+@computed
+def splice_prediction(unit: str, in_winter_mode: bool, heating_up_temperatures: Tuple[float, ...],
+                      first_time_heating_up: pd.Timestamp, period_to: pd.Timestamp) -> List[IndexedRows]:
+    """
+    Returns the prediction after period_to where the data from the first heating up onwards is replaced with the
+    continuation of the most similar natural cool-down in the history (see PREDICT_FROM_HISTORY). If there is none or
+    it ends too early, the best matching continuation from the summer or winter prediction template is added.
+    The parts are the predicted frame of get_period (see frame_from_parts).
+
+    :param unit: The name of the unit.
+    :param in_winter_mode: Whether to complete it with the winter or the summer template (see is_in_winter_mode).
+    :param heating_up_temperatures: The PREDICTED_COLUMNS at the first heating up (see quantize_temperatures).
+    :param first_time_heating_up: When the unit is heated up, at or after period_to.
+    :param period_to: The end of the period, the prediction starts there.
+    """
+    # cut data at the point of first heating up and add the continuation(s) until the end.
+    # The subtraction of 1 second is to avoid duplicates when the time matches exactly.
+    start, stop = load_data(unit).bounds(period_to, first_time_heating_up - np.timedelta64(1, "s"))
+    parts = [IndexedRows(load_data(unit).take(start, stop, TEMPERATURE_COLUMNS), load_crossing_index(unit), start)]
+    return parts + continuation_after_heating_up(unit, in_winter_mode, heating_up_temperatures, first_time_heating_up,
+                                                 period_to, period_to + PREDICTED_PERIOD)
+
+
+def continuation_after_heating_up(unit: str, in_winter_mode: bool, heating_up_temperatures: Tuple[float, ...],
+                                  first_time_heating_up: pd.Timestamp, history_end: pd.Timestamp,
+                                  predicted_end: pd.Timestamp) -> List[IndexedRows]:
+    """
+    Returns how the data would have continued from the first heating up until predicted_end without heating up (see
+    splice_prediction): the continuation of the most similar natural cool-down which ended before history_end (with
+    PREDICT_FROM_HISTORY), completed with the best matching continuation from the summer or winter prediction template.
+    """
+    history = _historic_continuation(unit, first_time_heating_up, history_end, predicted_end) \
+        if PREDICT_FROM_HISTORY else None
+    if history is None:
+        return [_template_continuation(unit, in_winter_mode, heating_up_temperatures, first_time_heating_up,
+                                       predicted_end)]
+
+    parts = [history]
+    continued_until = history.rows.time_at(-1)
+    if continued_until + HISTORY_RESOLUTION < predicted_end:
+        # the template continues from the last point of the history, which is already in there
+        last_temperatures = quantize_temperatures(history.rows.row(-1, PREDICTED_COLUMNS))
+        template = _template_continuation(unit, in_winter_mode, last_temperatures, continued_until, predicted_end)
+        parts.append(IndexedRows(template.rows.take(1, len(template.rows)), template.index, template.start + 1))
+
+    return parts
+
+
+@timed(rows=lambda continuation, *_: len(continuation.rows) if continuation else 0)
+def _historic_continuation(unit: str, first_time_heating_up: pd.Timestamp, history_end: pd.Timestamp,
+                           predicted_end: pd.Timestamp) -> Optional[IndexedRows]:
+    """
+    Returns the continuation (until predicted_end) of the natural cool-down (which ended before history_end) that's
+    the most similar to the trajectory leading up to the first heating up, moved to start there. None if there is no
+    such cool-down.
+    """
+    trajectory = load_data(unit).slice(first_time_heating_up - HISTORY_MATCH_WINDOW,
+                                       first_time_heating_up - np.timedelta64(1, "ns"), PREDICTED_COLUMNS)
+    continuation_period = predicted_end - first_time_heating_up
+    match = load_cool_down_library(unit).best_continuation(trajectory, int(HISTORY_MATCH_WINDOW / HISTORY_RESOLUTION),
+                                                       first_time_heating_up, continuation_period, history_end,
+                                                       HISTORY_MATCH_TOLERANCE)
+    if match is None:
+        return None
+
+    start, stop = load_data(unit).bounds(*match)
+    continuation = load_data(unit).take(start, stop, TEMPERATURE_COLUMNS)
+    if not len(continuation):
+        return None
+
+    # move the continuation to the cut off point
+    return IndexedRows(continuation.shifted(first_time_heating_up - continuation.time_at(0)),
+                       load_crossing_index(unit), start)
+
+
+def _template_continuation(unit: str, in_winter_mode: bool, temperatures: Tuple[float, ...],
+                           continue_from: pd.Timestamp, continue_until: pd.Timestamp) -> IndexedRows:
+    """
+    Returns the continuation from the point in the summer or winter prediction template which matches the temperatures
+    best, moved to start at continue_from and going until at most continue_until.
+
+    These templates are snippets of real data, namely in the places that go to the lowest temperature naturally in the
+    dataset. This means every other progression ends descending (=starts heating up again) before the templates so
+    the templates can be added onto the end with less chance of not finding a good continuation point.
+    """
+    # select correct prediction template; in summer it's much longer and less steep than in winter
+    summer_pred, winter_pred = load_prediction_templates(unit)
+    prediction_template = winter_pred if in_winter_mode else summer_pred
+    best_match_in_template = prediction_template.store.time_at(_best_template_match(unit, in_winter_mode,
+                                                                                    temperatures))
+
+    # template end time: from the best matching point, take data to complete the PREDICTED_PERIOD together with
+    # the real data (before heating up)
+    template_prediction_end_time = best_match_in_template + (continue_until - continue_from)
+    start, stop = prediction_template.store.bounds(best_match_in_template, template_prediction_end_time)
+    continuation = prediction_template.store.take(start, stop, TEMPERATURE_COLUMNS)
+    # move predicted times to the cut off point
+    return IndexedRows(continuation.shifted(continue_from - best_match_in_template), prediction_template.crossings,
+                       start)
+
+
+@timed(cached=True)
+@lru_cache_per_unit(PREDICTION_CACHE_SIZE)
+@computed
+def _best_template_match(unit: str, in_winter_mode: bool, temperatures: Tuple[float, ...]) -> int:
+    """
+    Returns the position in the summer or winter prediction template of a unit which matches the temperatures (in the
+    order of PREDICTED_COLUMNS) best using the sum of squared errors.
+    """
+    summer_pred, winter_pred = load_prediction_templates(unit)
+    prediction_template = winter_pred if in_winter_mode else summer_pred
+    errors = prediction_template.matrix - np.array(temperatures)
+    return int(np.nansum(errors * errors, axis=1).argmin())  # nansum to skip missing values like pandas does
+
+
+def _downsample(past: TimeSeriesStore, period_from: datetime, period_to: datetime, interval: str,
+                unit: str) -> List[IndexedRows]:
+    """
+    Returns the same rows as past.to_frame().resample(interval).median().dropna() but takes the bins lying completely
+    inside the period from the precomputed levels (see load_downsampled_data). Only the partial bins at the edges are
+    aggregated here.
+    """
+    step = pd.to_timedelta(interval)
+    origin = past.time_at(0).normalize()  # what resample uses by default (origin="start_day")
+    # first and last bin boundaries inside the period
+    inner_from = period_from + (origin - period_from) % step
+    inner_to = period_to - (period_to - origin) % step
+    if inner_from >= inner_to:  # no complete bin inside the period
+        resampled = past.to_frame().resample(interval, origin=origin).median().dropna()
+        return [IndexedRows(TimeSeriesStore.from_frame(resampled, float_dtype=None))]
+
+    def edge_bin(rows: TimeSeriesStore, bin_start: pd.Timestamp):
+        # there is at most one partial bin per edge, so no need to resample
+        if not len(rows):
+            return []
+
+        medians = {col: np.array([np.nanmedian(values)], dtype=values.dtype) for col, values in rows.columns.items()}
+        if any(np.isnan(median[0]) for median in medians.values()):  # ignore na, plot does free LERP
+            return []
+
+        return [IndexedRows(TimeSeriesStore(np.array([bin_start.value]), medians, past.tz, past.index_name))]
+
+    key = interval, (origin - EPOCH) % step
+    level = load_downsampled_data(unit)[key]
+    start, stop = level.bounds(inner_from, inner_to - np.timedelta64(1, "ns"))
+    head = edge_bin(past.slice(None, inner_from - np.timedelta64(1, "ns")), inner_from - step)
+    inner = IndexedRows(level.take(start, stop), load_downsampled_crossing_indexes(unit)[key], start)
+    tail = edge_bin(past.slice(inner_to), inner_to)
+    return [*head, inner, *tail]
+
+
+# the datasets are only ever appended to, so the positions always refer to the same rows
+@timed(rows=lambda shown, unit, start, stop, max_points: stop - start, cached=True)
+@lru_cache_per_unit(PREDICTION_CACHE_SIZE)
+@computed
+def _largest_triangles(unit: str, start: int, stop: int, max_points: int) -> TimeSeriesStore:
+    """
+    Returns the rows of the dataset of a unit from start to stop which min_max_lttb keeps (at most max_points) for any
+    of the TEMPERATURE_COLUMNS. Rows with missing values are left out (plot does free LERP).
+    """
+    past = load_data(unit).take(start, stop, TEMPERATURE_COLUMNS)
+    complete = np.flatnonzero(~np.isnan(past.matrix(TEMPERATURE_COLUMNS)).any(axis=1))
+    kept = np.unique(np.concatenate([complete[min_max_lttb(past.times[complete], past.columns[col][complete],
+                                                           max_points)] for col in TEMPERATURE_COLUMNS]))
+    return TimeSeriesStore(past.times[kept], {col: values[kept] for col, values in past.columns.items()},
+                           past.tz, past.index_name)
+
+
+@timed(rows=lambda hit_times, data, predicted, thresholds: len(data) + len(predicted))
 def projected_hit_times(data: pd.DataFrame, predicted: pd.DataFrame, thresholds: Thresholds):
     """
     Returns the projected (or past) times when values first passed the thresholds.
 
     :param data: The past data in the period just before the predicted data.
     :param predicted: The predicted data in the period just after the past data.
+                      If both come from get_period (with all their rows), the crossings of INDEXED_THRESHOLDS are
+                      looked up in the precomputed indexes instead of scanning the data.
     :param thresholds: The lower and upper thresholds to cross.
     :return: A dictionary with one entry per PREDICTED_COLUMNS. Each entry contains the first time the upper and
              lower thresholds are crossed respectively. If it didn't cross the threshold in the predicted data,
              or in HIT_POINT_DETECTION_PAST_OFFSET of the past data, then the timestamp is NULL instead.
     """
 
-    def projected_hit_times_core(period: pd.DataFrame):
+    def crossing_parts(df: pd.DataFrame) -> List[IndexedRows]:
+        kept = df.attrs.get(CROSSING_PARTS)
+        if kept is not None and kept.describe(df):
+            return kept.parts
+
+        # work on the arrays of the frame directly, no copies needed
+        return [IndexedRows(TimeSeriesStore.from_frame(df[PREDICTED_COLUMNS], float_dtype=None))]
+
+    def projected_hit_times_core(period: List[IndexedRows]):
         hit_times: HitTimes = {}
         for col in PREDICTED_COLUMNS:
-            first_below_upper = period.query(f'{col} < {thresholds.upper}').first_valid_index()
-            first_below_lower = period.query(f'{col} < {thresholds.lower}').first_valid_index()
+            first_below_upper = first_time_below(period, col, thresholds.upper)
+            first_below_lower = first_time_below(period, col, thresholds.lower)
             hit_times[col] = ThresholdCrossings(first_below_upper, first_below_lower)
 
         return hit_times
 
-    hit_times = projected_hit_times_core(predicted)
+    if predicted.empty:  # e.g. a period after the end of the dataset
+        return {col: ThresholdCrossings(None, None) for col in PREDICTED_COLUMNS}
+
+    hit_times = projected_hit_times_core(crossing_parts(predicted))
 
     # if the projected hit point is the first possible point, chances are the hit point was actually in the past.
     # so query that and adjust accordingly if necessary.
@@ -156,7 +950,7 @@ def projected_hit_times(data: pd.DataFrame, predicted: pd.DataFrame, thresholds:
     # query only for upper here because upper must be crossed before lower
     first_hitters = [col for col, hits in hit_times.items() if hits.upper == first_predicted_time]
     if first_hitters:
-        past_data = data[first_predicted_time + HIT_POINT_DETECTION_PAST_OFFSET:]
+        past_data = parts_from(crossing_parts(data), first_predicted_time + HIT_POINT_DETECTION_PAST_OFFSET)
         past_hit_times = projected_hit_times_core(past_data)
         for col in first_hitters:
             # use the past one instead for the first hitters, if there are any
@@ -167,3 +961,54 @@ def projected_hit_times(data: pd.DataFrame, predicted: pd.DataFrame, thresholds:
             hit_times[col] = ThresholdCrossings(upper, lower)
 
     return hit_times
+
+
+def projected_hit_time_sweep(data: pd.DataFrame, predicted: pd.DataFrame, upper_thresholds: Sequence[float],
+                             lower_thresholds: Sequence[float]) -> np.ndarray:
+    """
+    Returns the projected (or past) hit times for every combination of upper and lower thresholds at once.
+    The first crossing of every distinct threshold is found with one running minimum and binary search per column.
+
+    :param data: The past data in the period just before the predicted data.
+    :param predicted: The predicted data in the period just after the past data.
+    :param upper_thresholds: The upper thresholds to cross.
+    :param lower_thresholds: The lower thresholds to cross.
+    :return: A (upper thresholds x lower thresholds) object array. The entry at [i, j] holds the same HitTimes
+             projected_hit_times returns for Thresholds(upper_thresholds[i], lower_thresholds[j]), including the
+             fallback to HIT_POINT_DETECTION_PAST_OFFSET of the past data.
+    """
+    thresholds = np.union1d(upper_thresholds, lower_thresholds)
+    predicted = TimeSeriesStore.from_frame(predicted[PREDICTED_COLUMNS], float_dtype=None)
+    first_predicted_time = predicted.time_at(0)
+    past_data = TimeSeriesStore.from_frame(data[PREDICTED_COLUMNS], float_dtype=None) \
+        .slice(first_predicted_time + HIT_POINT_DETECTION_PAST_OFFSET)
+
+    # threshold -> first time below it per column
+    hits = {col: dict(zip(thresholds, _first_times_below(predicted, col, thresholds))) for col in PREDICTED_COLUMNS}
+    past_hits = {col: dict(zip(thresholds, _first_times_below(past_data, col, thresholds)))
+                 for col in PREDICTED_COLUMNS}
+
+    def crossings(col: str, upper: float, lower: float):
+        upper_hit, lower_hit = hits[col][upper], hits[col][lower]
+        # same as in projected_hit_times: if the upper hit point is the first possible point, use the past ones
+        if upper_hit == first_predicted_time:
+            upper_hit = past_hits[col][upper] or upper_hit
+            lower_hit = past_hits[col][lower] or lower_hit
+
+        return ThresholdCrossings(upper_hit, lower_hit)
+
+    sweep = np.empty((len(upper_thresholds), len(lower_thresholds)), dtype=object)
+    for i, upper in enumerate(upper_thresholds):
+        for j, lower in enumerate(lower_thresholds):
+            sweep[i, j] = {col: crossings(col, upper, lower) for col in PREDICTED_COLUMNS}
+
+    return sweep
+
+
+def _first_times_below(period: TimeSeriesStore, column: str, thresholds: np.ndarray) -> List[Optional[pd.Timestamp]]:
+    """Returns the first time the values of a column are below each of the (sorted) thresholds or None if never."""
+    # the running minimum is non-increasing, so the first position below any threshold is a binary search away.
+    # Missing values are skipped (fmin) and never below anything at the very start (inf).
+    running_min = np.nan_to_num(np.fmin.accumulate(period.columns[column]), nan=np.inf)
+    positions = np.searchsorted(-running_min, -thresholds, side="right")
+    return [period.time_at(position) if position < len(period) else None for position in positions]
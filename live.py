@@ -0,0 +1,107 @@
+import io
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+import streamlit as st
+
+import data
+import sharing
+from data import append_data, load_units, pin_unit, publish_pending_data, shared_directory
+from units import DEFAULT_UNIT
+
+LIVE_POLL_INTERVAL = 10  # seconds
+# the name of the lock which the process ingesting the live feed of a unit holds (in its shared directory) if the
+# dataset is shared between processes
+INGESTION_LOCK = "ingestion"
+
+logger = logging.getLogger(__name__)
+
+
+class CsvTail:
+    """Follows a csv file which is appended to (like tail -f) and returns the rows added since the last read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.header: Optional[bytes] = None
+
+    def read_new_rows(self) -> Optional[pd.DataFrame]:
+        """Returns the rows which were completely written since the last call or None if there are none."""
+        if not os.path.exists(self.path):
+            return None
+
+        if os.path.getsize(self.path) < self.offset:  # truncated or replaced, start over
+            self.offset, self.header = 0, None
+
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            content = file.read()
+
+        # a line that's still being written is read again next time
+        complete = content[:content.rfind(b"\n") + 1]
+        if not complete:
+            return None
+
+        self.offset += len(complete)
+        if self.header is None:
+            self.header, _, complete = complete.partition(b"\n")
+            if not complete:
+                return None
+
+        return pd.read_csv(io.BytesIO(self.header + b"\n" + complete))
+
+
+class LiveIngestion(threading.Thread):
+    """Background thread which appends the new rows of a live csv to the dataset of a unit (see data.append_data)."""
+
+    def __init__(self, path: str, poll_interval: float, unit: str = DEFAULT_UNIT):
+        super().__init__(name=f"live-ingestion-{unit}", daemon=True)
+        self.unit = unit
+        self.tail = CsvTail(path)
+        self.poll_interval = poll_interval
+        self.appended_rows = 0
+
+    def run(self):
+        while True:
+            try:
+                self.ingest()
+                publish_pending_data(self.unit)  # the rows appended since the last version, once it's due
+            except Exception:  # keep following the feed, the next rows might be fine again
+                logger.exception("Failed to ingest rows from %s", self.tail.path)
+
+            time.sleep(self.poll_interval)
+
+    def ingest(self) -> int:
+        """Appends the rows added to the live csv since the last call and returns how many were new."""
+        new_rows = self.tail.read_new_rows()
+        appended = 0 if new_rows is None else append_data(new_rows, self.unit)
+        self.appended_rows += appended
+        return appended
+
+
+# one ingestion per unit and server, shared by all sessions (they all read the same dataset)
+@st.experimental_singleton
+def start_live_ingestion(unit: str = DEFAULT_UNIT) -> Optional[LiveIngestion]:
+    """
+    Starts ingesting the live csv of a unit (see units.Unit, data.LIVE_CSV_PATH for the default unit) in the
+    background if it exists. Returns the ingestion or None. The unit stays loaded from then on, its rows are only
+    appended in memory.
+    If the dataset is shared between processes (see data.SHARE_DATASET), only the first process ingests it, the
+    others follow the versions it publishes (see data.follow_shared_data).
+    """
+    path = load_units()[unit].live_csv_path
+    if path is None or not os.path.exists(path):
+        return None
+
+    if data.SHARE_DATASET and not sharing.try_lock(shared_directory(unit), INGESTION_LOCK):
+        return None
+
+    pin_unit(unit)
+    ingestion = LiveIngestion(path, LIVE_POLL_INTERVAL, unit)
+    ingestion.ingest()  # catch up right away so the first run already has the latest data
+    ingestion.start()
+    return ingestion
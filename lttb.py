@@ -0,0 +1,91 @@
+import numpy as np
+
+
+def largest_triangle_three_buckets(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Downsamples a line to n_out points using Largest-Triangle-Three-Buckets (Steinarsson, 2013). The first and last
+    point are kept and every bucket in between keeps the point forming the largest triangle with the point kept in the
+    previous bucket and the average of the next bucket. Unlike aggregating (e.g. median resampling), this keeps the
+    shape of the line including its peaks and dips.
+
+    The choice in each bucket depends on the one in the previous bucket. Instead of going through the buckets one by
+    one, all of them are chosen at once (vectorized) assuming the averages of the previous buckets were chosen. Then
+    only the buckets whose previous choice changed are chosen again until nothing changes anymore. Every round makes
+    at least the first remaining choice final, so this ends with exactly the points of the sequential algorithm,
+    usually after a few rounds.
+
+    :param x: The sorted x-values (e.g. int64 nanoseconds), shape (n,).
+    :param y: The y-values without missing values, shape (n,).
+    :param n_out: The number of points to keep.
+    :return: The positions of the points to keep (sorted). If there are no more than n_out points, all of them.
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    x = (x - x[0]).astype(np.float64)  # relative to the first point to keep the precision of large (time) values
+    y = y.astype(np.float64)
+    # bucket i covers [edges[i], edges[i + 1]), the first and last point are buckets of their own
+    edges = np.append(np.arange(n_out - 1) * (n - 2) // (n_out - 2) + 1, n)
+    sizes = np.diff(edges)
+    # averages of every bucket (the last one being the last point)
+    averages_x = np.add.reduceat(x, edges[:-1]) / sizes
+    averages_y = np.add.reduceat(y, edges[:-1]) / sizes
+
+    # the points of the n_out - 2 buckets to choose from, padded to the size of the largest one by repeating their
+    # last point (argmax chooses the first one anyway)
+    buckets = np.minimum(edges[:-2, np.newaxis] + np.arange(sizes[:-1].max()), edges[1:-1, np.newaxis] - 1)
+    bucket_x, bucket_y = x[buckets], y[buckets]
+
+    chosen = np.empty(n_out - 2, dtype=np.int64)
+    # the point (or initially the average) chosen in the previous bucket of every bucket
+    previous_x = np.concatenate([x[:1], averages_x[:-2]])
+    previous_y = np.concatenate([y[:1], averages_y[:-2]])
+
+    pending = np.arange(n_out - 2)
+    while len(pending):
+        # twice the triangle area with the previous and the next bucket's average, no need to halve it to compare
+        before_x, before_y = previous_x[pending, np.newaxis], previous_y[pending, np.newaxis]
+        areas = np.abs((before_x - averages_x[pending + 1, np.newaxis]) * (bucket_y[pending] - before_y) -
+                       (before_x - bucket_x[pending]) * (averages_y[pending + 1, np.newaxis] - before_y))
+        chosen[pending] = buckets[pending, areas.argmax(axis=1)]
+
+        # the buckets after the ones chosen in this round now know their (new) previous point
+        following = pending[pending < n_out - 3] + 1
+        new_x, new_y = x[chosen[following - 1]], y[chosen[following - 1]]
+        changed = (new_x != previous_x[following]) | (new_y != previous_y[following])
+        pending = following[changed]
+        previous_x[pending], previous_y[pending] = new_x[changed], new_y[changed]
+
+    return np.concatenate([[0], chosen, [n - 1]])
+
+
+def min_max_lttb(x: np.ndarray, y: np.ndarray, n_out: int, ratio=4) -> np.ndarray:
+    """
+    Downsamples a long line to n_out points with MinMaxLTTB (Van Der Donckt et al., 2023): the minimum and maximum of
+    n_out * ratio / 2 equally sized bins are preselected in one vectorized pass and only those are downsampled with
+    largest_triangle_three_buckets. The result is nearly the same but its cost hardly depends on the length of the
+    line.
+
+    :param x: The sorted x-values (e.g. int64 nanoseconds), shape (n,).
+    :param y: The y-values without missing values, shape (n,).
+    :param n_out: The number of points to keep.
+    :param ratio: How many points to preselect per point to keep.
+    :return: The positions of the points to keep (sorted). If there are no more than n_out points, all of them.
+    """
+    n = len(x)
+    n_bins = n_out * ratio // 2
+    if n <= 2 * n_bins + 2:
+        return largest_triangle_three_buckets(x, y, n_out)
+
+    # all points except the first and last one in bins of (almost) the same size, padded to the size of the largest
+    # by repeating their last point
+    edges = np.append(np.arange(n_bins) * (n - 2) // n_bins + 1, n - 1)
+    bins = np.minimum(edges[:-1, np.newaxis] + np.arange(np.diff(edges).max()), edges[1:, np.newaxis] - 1)
+    values = y[bins]
+    rows = np.arange(n_bins)
+    minima = bins[rows, values.argmin(axis=1)]
+    maxima = bins[rows, values.argmax(axis=1)]
+
+    preselected = np.unique(np.concatenate([[0, n - 1], minima, maxima]))
+    return preselected[largest_triangle_three_buckets(x[preselected], y[preselected], n_out)]
@@ -1,11 +1,18 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import numpy as np
 import streamlit as st
 
-from data import earliest_time, get_period, projected_hit_times, BUFFER_AVG, BUFFER_MIN
-from plots import create_temperature_line_chart, BUFFER_MAX, DRINKING_WATER, construct_action_phrase
-from shared import Thresholds, PROJECT_TIMEZONE
+import profiling
+from data import earliest_time, get_period_statistics, load_cycle_index, load_units, loaded_units, memory_report, \
+    follow_shared_data, UNIT_MEMORY_LIMIT
+from live import start_live_ingestion
+from plots import BUFFER_MAX, DRINKING_WATER, construct_action_phrase, construct_cycle_phrase, \
+    construct_statistics_phrase
+from prefetch import start_prefetching
+from shared import Thresholds, PROJECT_TIMEZONE, MIN_THRESHOLD, MAX_THRESHOLD, DEFAULT_LOWER_THRESHOLD, \
+    DEFAULT_UPPER_THRESHOLD, SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS, default_period, from_inputs
+from warmup import is_warming_up, wait_for_warm_up
 
 # This project makes heavy use of constants to increase readability and decrease complexity at the cost
 # of decreased code reusability (for other projects).
@@ -14,36 +21,50 @@ from shared import Thresholds, PROJECT_TIMEZONE
 
 PROJECT_TITLE = "Heating unit dashboard"
 
-DEFAULT_DATE_OFFSET = timedelta(days=3)
-DEFAULT_LOWER_THRESHOLD = 30
-DEFAULT_UPPER_THRESHOLD = 40
+# the defaults of the view (period, thresholds and plot dimensions) are in shared.py, the warm-up (see warmup.py)
+# computes the same default view.
 
 # st.date_input always formats as %Y/%m/%d apparently so we cope: https://github.com/streamlit/streamlit/issues/5234
 DATE_FORMAT = "%Y/%m/%d"
 
-# plot dimensions in pixels for two column layout in wide mode.
-# Designed for full-hd screens (1920x1080) as responsiveness was not a requirement and hard to get right with Plotly.
-PLOT_HEIGHT = 400
-PLOT_WIDTH = 800
+# the sidebar only holds the (opt-in) performance panel for debugging
+st.set_page_config(layout="wide", initial_sidebar_state="collapsed")
+st.title(PROJECT_TITLE)
 
-DEFAULT_YLIM = [20, 90]  # °C - same system and environment, so the limits should be universal to have a reference
+with st.sidebar:
+    show_performance = st.checkbox("Show performance", help="Shows how long each stage of this run took.")
+    log_performance = st.checkbox("Log performance",
+                                  help=f"Appends the timings of every run to {profiling.PROFILE_LOG_PATH}.")
 
-# to avoid an overwhelming number of inputs and configurations, this is fixed for the application. However, in the real
-# world this might be a value that's interesting to configure depending on the volume of the buffer, the type of wood
-# used, the output of the furnace, etc.
-SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS = timedelta(hours=1)
+# only records anything if enabled, the instrumented functions hardly cost anything otherwise
+profiling.start_run(show_performance or log_performance)
 
-st.set_page_config(layout="wide")
-st.title(PROJECT_TITLE)
+# the first run after the server started (with serve.py) waits for the data it's already loading
+if is_warming_up():
+    with st.spinner("Starting up..."):
+        wait_for_warm_up()
+
+# only asks for the unit if there are several (see units.py), all of them are on the same server
+units = load_units()
+unit = next(iter(units))
+if len(units) > 1:
+    unit = st.selectbox("Heating unit", list(units), key="unit_widget")
+
+season = units[unit].season
+
+# keeps appending the rows of the live feed of the unit (if there is one) to its dataset in the background
+start_live_ingestion(unit)
+# picks up the rows another server process ingested if the dataset is shared between them
+follow_shared_data(unit)
 
 now = datetime.now(PROJECT_TIMEZONE)
 today = now.date()
 
 # initialize session state (once per user session -> only one "now" for consecutive runs, reload to get real now again)
 # Only necessary because Streamlit runs the script again DURING date range selection, no clue why you would do that..
+# The default period is rounded (see DEFAULT_PERIOD_RESOLUTION), so the view is usually already computed.
 if 'period_from' not in st.session_state:
-    st.session_state.period_from = now - DEFAULT_DATE_OFFSET
-    st.session_state.period_to = now
+    st.session_state.period_from, st.session_state.period_to = default_period(now)
 
 # get user inputs
 period_col, from_time_col, to_time_col, lower_threshold_col, upper_threshold_col = st.columns([2, 1, 1, 1, 1])
@@ -56,7 +77,7 @@ with period_col:
 
     date_period = st.date_input("Period date range",
                                 date_period_value,
-                                min_value=earliest_time(),
+                                min_value=earliest_time(unit),
                                 max_value=today,
                                 key="date_period_widget")
 
@@ -83,12 +104,10 @@ with to_time_col:
     time_to = st.time_input(f"Period end time (on {formatted_date})",
                             value=time_to_value, key="time_to_widget")
 
-period_from = datetime.combine(date_from, time_from)
-period_from = period_from.astimezone(PROJECT_TIMEZONE)
+period_from = from_inputs(date_from, time_from)
 
 if date_to:
-    period_to = datetime.combine(date_to, time_to)
-    period_to = period_to.astimezone(PROJECT_TIMEZONE)
+    period_to = from_inputs(date_to, time_to)
 else:
     period_to = None
 
@@ -96,10 +115,12 @@ st.session_state.period_from = period_from
 st.session_state.period_to = period_to
 
 with lower_threshold_col:
-    lower_threshold = st.number_input("Lower threshold (°C)", min_value=20, max_value=50, value=DEFAULT_LOWER_THRESHOLD)
+    lower_threshold = st.number_input("Lower threshold (°C)", min_value=MIN_THRESHOLD, max_value=MAX_THRESHOLD,
+                                      value=DEFAULT_LOWER_THRESHOLD)
 
 with upper_threshold_col:
-    upper_threshold = st.number_input("Upper threshold (°C)", min_value=20, max_value=50, value=DEFAULT_UPPER_THRESHOLD)
+    upper_threshold = st.number_input("Upper threshold (°C)", min_value=MIN_THRESHOLD, max_value=MAX_THRESHOLD,
+                                      value=DEFAULT_UPPER_THRESHOLD)
 
 # only stop after all the inputs are shown
 if not period_to:
@@ -115,29 +136,68 @@ if lower_threshold >= upper_threshold:
     st.write("Lower threshold must be below upper threshold.")
     st.stop()
 
-current, data, predicted = get_period(period_from, period_to)
-
+# the period, its hit times and the charts, usually prefetched while the user was looking at the previous period
 thresholds = Thresholds(upper_threshold, lower_threshold)
-hit_times = projected_hit_times(data, predicted, thresholds)
+view_cache = start_prefetching()
+view = view_cache.view(period_from, period_to, thresholds, unit)
+hit_times = view.hit_times
 
 # recommendation phrase
 # requires unsafe html flag; it's apparently not possible to customize the font size of text content otherwise.
 st.markdown(construct_action_phrase(hit_times, period_to, thresholds, SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS,
-                                    font_size="1.2rem"), unsafe_allow_html=True)
+                                    font_size="1.2rem", season=season), unsafe_allow_html=True)
 
-# temperature charts
+# how often the unit was fired up in the period, only the (few) indexed cycles in it are looked at
+st.caption(construct_cycle_phrase(load_cycle_index(unit).cycles(period_from, period_to), period_from, period_to))
+
+# temperature charts with the statistics of the (recorded) period
+statistics = get_period_statistics(period_from, period_to, thresholds, unit)
 col_stored_energy, col_drinking_water = st.columns(2)
 
 with col_stored_energy:
     st.subheader("Buffer")
 
-    fig = create_temperature_line_chart(data, predicted, [(BUFFER_MAX, False), (BUFFER_AVG, True), (BUFFER_MIN, True)],
-                                        DEFAULT_YLIM, thresholds, PLOT_HEIGHT, PLOT_WIDTH)
-    st.plotly_chart(fig)
+    with profiling.stage("serialization"):
+        st.plotly_chart(view.figures[0])
+
+    st.caption(construct_statistics_phrase(statistics, BUFFER_MAX))
 
 with col_drinking_water:
     st.subheader("Drinking water")
 
-    fig = create_temperature_line_chart(data, predicted, DRINKING_WATER,
-                                        DEFAULT_YLIM, thresholds, PLOT_HEIGHT, PLOT_WIDTH)
-    st.plotly_chart(fig)
+    with profiling.stage("serialization"):
+        st.plotly_chart(view.figures[1])
+
+    st.caption(construct_statistics_phrase(statistics, DRINKING_WATER))
+
+# the views of the periods the user is likely to pick next are computed in the background until they do
+view_cache.prefetch(period_from, period_to, thresholds, now, unit)
+
+# performance panel (runs which stopped early above aren't shown)
+timings = profiling.finish_run()
+if timings:
+    if log_performance:
+        profiling.append_to_log(timings, unit=unit, period_from=period_from, period_to=period_to,
+                                thresholds=thresholds)
+
+    if show_performance:
+        with st.sidebar:
+            st.subheader("Performance")
+            st.caption("Total time (ms) of every stage including the ones it called, how many rows it processed and "
+                       "how often it came from a cache.")
+            st.dataframe(profiling.summarize(timings).round(1))
+            prefetch = view_cache.stats()
+            st.caption(f"{prefetch.hit_rate:.0%} of the {prefetch.requests} views came from the prefetch cache "
+                       f"({prefetch.waits} of them still being prefetched), {prefetch.unused} of the "
+                       f"{prefetch.prefetched} prefetched ones were evicted unused.")
+            st.subheader("Memory")
+            memory = memory_report(unit)
+            resident = profiling.resident_memory()
+            resident_phrase = "" if resident is None else f" of the {resident / 2 ** 20:.1f} MiB the process occupies"
+            st.caption(f"Memory (MiB) of the dataset and everything precomputed from it, "
+                       f"{memory.bytes.sum() / 2 ** 20:.1f} MiB in total{resident_phrase}.")
+            st.dataframe(memory.assign(MiB=memory.bytes / 2 ** 20).drop(columns="bytes").round(2))
+            loaded = loaded_units()
+            st.caption(f"{len(loaded)} of the {len(units)} units are loaded with {sum(loaded.values()) / 2 ** 20:.1f} "
+                       f"MiB of the {UNIT_MEMORY_LIMIT / 2 ** 20:.0f} MiB they may take, the least recently used "
+                       f"ones are evicted beyond it.")
@@ -1,15 +1,20 @@
 from datetime import datetime, timedelta
+from functools import partial
 from numbers import Number
-from typing import List, Tuple, Literal
+from typing import Dict, List, Tuple, Literal
 
 import humanize
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import streamlit as st
+from numpy.lib.stride_tricks import sliding_window_view
 from plotly.graph_objs import Figure
 
-from data import BUFFER_MIN, BUFFER_AVG, DRINKING_WATER, BUFFER_MAX, PREDICTED_PERIOD
-from shared import is_in_winter_mode, HitTimes, Thresholds, rgba, rgb
+from data import BUFFER_MIN, BUFFER_AVG, DRINKING_WATER, BUFFER_MAX, PREDICTED_PERIOD, PeriodStatistics
+from profiling import timed, computed
+from shared import is_in_winter_mode, HitTimes, Season, Thresholds, DEFAULT_SEASON, rgba, rgb
+from tasks import Task, run_tasks
 
 DRINKING_WATER_LABEL = "Drinking water"
 BUFFER_MAX_LABEL = "Buffer maximum"
@@ -30,10 +35,21 @@ PREDICTION_SHADOW_OPACITY = 1
 
 FAN_OPACITY = .25
 
+# lines with more points than this are drawn with WebGL (Scattergl) instead of SVG. The past data is already reduced by
+# get_period (see data.DOWNSAMPLING_METHOD), the prediction isn't.
+WEBGL_MIN_POINTS = 2000
+
+# number of charts (period and columns) to keep the traces of, only the thresholds are drawn anew on every rerun
+FIGURE_CACHE_SIZE = 64
+
 # contender for parameter but not necessary for this project
 FAN_DEGREE_PER_MINUTE = 1 / (4 * 60)  # 1 deg uncertainty per 4 hours
 FAN_INCREASE_PER_MINUTE = np.arange(1, PREDICTED_PERIOD / np.timedelta64(1, 's') + 10) * FAN_DEGREE_PER_MINUTE
 FAN_RESAMPLE_INTERVAL_MIN = 10
+# the bounds are widened and smoothed over 1 hour (in number of resampled rows)
+FAN_WINDOW = int(np.timedelta64(1, 'h') / np.timedelta64(FAN_RESAMPLE_INTERVAL_MIN, 'm'))
+# number of predictions to keep the fans of (they are the same for both charts and every rerun with the same period)
+FAN_CACHE_SIZE = 64
 
 LABELS = {
     DRINKING_WATER: DRINKING_WATER_LABEL,
@@ -50,6 +66,7 @@ COLORS = {
 }
 
 
+@timed(rows=lambda fig, data, predicted, *_: len(data) + len(predicted))
 def create_temperature_line_chart(data: pd.DataFrame, predicted: pd.DataFrame,
                                   columns: str | List[Tuple[str, bool]], ylim: List[int],
                                   thresholds: Thresholds,
@@ -69,71 +86,173 @@ def create_temperature_line_chart(data: pd.DataFrame, predicted: pd.DataFrame,
     :param plot_width: The width of the chart in pixels.
     :return: A Plotly Figure representing the created chart.
     """
-    all_data = pd.concat([data, predicted])
-    fig = go.Figure(layout=go.Layout(
-        hovermode="x",
-        yaxis=go.layout.YAxis(
-            range=ylim,
-            ticksuffix=" °C",
-        ),
-        margin=go.layout.Margin(
-            t=40, b=0,  # just enough for the Plotly menu bar
-            l=40, r=0,  # compensate for the removed axis title
-        ),
-        height=plot_height,
-        width=plot_width,
-        # group temperatures with their prediction fans in legend (wrong type annotation by Plotly)
-        legend_traceorder="grouped",
-    ))
-
-    def add_temperature_line(col, hidden=False):
-        fig.add_trace(_create_line_trace(all_data, col, rgb(*COLORS[col]), hidden=hidden))
-        _add_prediction_fan(fig, predicted, col, hidden=hidden)
+    fig = go.Figure(
+        data=base_traces(data, predicted, columns),
+        layout=go.Layout(
+            hovermode="x",
+            yaxis=go.layout.YAxis(
+                range=ylim,
+                ticksuffix=" °C",
+            ),
+            margin=go.layout.Margin(
+                t=40, b=0,  # just enough for the Plotly menu bar
+                l=40, r=0,  # compensate for the removed axis title
+            ),
+            height=plot_height,
+            width=plot_width,
+            # group temperatures with their prediction fans in legend (wrong type annotation by Plotly)
+            legend_traceorder="grouped",
+        ))
+
+    # the thresholds are only overlays on top of the (cached) traces, changing them doesn't rebuild anything else
+    lower_line, lower_annotation = _threshold_line(thresholds.lower, "Lower")
+    upper_line, upper_annotation = _threshold_line(thresholds.upper, "Upper")
+    fig.layout.shapes = [lower_line, upper_line, _prediction_shadow(data.index[0], predicted.index[0])]
+    fig.layout.annotations = [lower_annotation, upper_annotation]
 
+    return fig
+
+
+@timed(rows=lambda traces, *_: sum(len(trace["x"]) for trace in traces), cached=True)
+@st.experimental_memo(max_entries=FIGURE_CACHE_SIZE)
+@computed
+def base_traces(data: pd.DataFrame, predicted: pd.DataFrame, columns: str | List[Tuple[str, bool]]) -> List[dict]:
+    """
+    Creates the traces (lines and prediction fans) of a chart, see create_temperature_line_chart. They only depend on
+    the period and the columns, so they're built once and reused for every rerun (e.g. when only the thresholds
+    change). The traces are returned as plain dictionaries with the times already formatted (see _plot_times), which
+    are quick to cache and to serialize again.
+    """
+    all_data = pd.concat([data, predicted])
     if isinstance(columns, str):
-        add_temperature_line(columns)
-    else:  # must be list of tuples with column name and hidden flag
-        for col, hidden in columns:
-            add_temperature_line(col, hidden)
+        columns = [(columns, False)]  # otherwise must be list of tuples with column name and hidden flag
 
-    _add_threshold_line(fig, thresholds.lower, "Lower")
-    _add_threshold_line(fig, thresholds.upper, "Upper")
-    _add_prediction_shadow(fig, data.index[0], predicted.index[0])
+    # the line and the fan of every column are built concurrently, the fans of all columns are computed
+    # at once before
+    tasks = {"fans": Task(partial(prediction_fans, predicted))}
+    for col, hidden in columns:
+        tasks[f"{col}_line"] = Task(partial(_line_trace, all_data, col, hidden))
+        tasks[f"{col}_fan"] = Task(partial(_fan_traces, col, hidden), depends_on=("fans",))
 
-    return fig
+    results = run_tasks(tasks)
+    return [trace for col, _ in columns for trace in [results[f"{col}_line"], *results[f"{col}_fan"]]]
 
 
-def _add_prediction_fan(fig: Figure, predicted: pd.DataFrame, column: str, *, hidden=False):
-    # resample to decrease resolution (drop na, the plot just connects all points so basically free LERP)
-    values = predicted[column].resample(f'{FAN_RESAMPLE_INTERVAL_MIN}min').median().dropna()
+def _line_trace(data: pd.DataFrame, column: str, hidden: bool) -> dict:
+    return _create_line_trace(data, column, rgb(*COLORS[column]), hidden=hidden).to_plotly_json()
+
+
+def _fan_traces(column: str, hidden: bool, fans: Dict[str, pd.DataFrame]) -> List[dict]:
+    return [trace.to_plotly_json() for trace in _create_prediction_fan_traces(fans[column], column, hidden=hidden)]
 
-    fan_deltas = FAN_INCREASE_PER_MINUTE[:len(values)] * FAN_RESAMPLE_INTERVAL_MIN
-    bounds = pd.DataFrame({'upper': values + fan_deltas, 'lower': values - fan_deltas}, index=values.index)
 
-    rows_in_one_hour = int(np.timedelta64(1, 'h') / np.timedelta64(FAN_RESAMPLE_INTERVAL_MIN, 'm'))
+def _plot_times(index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Formats times like Plotly shows them (the wall time in their time zone, the offset is ignored by plotly.js).
+    Done for all of them at once, Plotly would otherwise convert and format every single timestamp each time the
+    figure is copied and serialized.
+    """
+    times = index.tz_localize(None).to_numpy()
+    # whole seconds as usual, fractions only if there are any (up to microseconds like datetime.isoformat)
+    unit = "us" if (times.astype(np.int64) % 1_000_000_000).any() else "s"
+    return np.datetime_as_string(times, unit=unit)
 
+
+@timed(rows=lambda fans, predicted: len(predicted), cached=True)
+@st.experimental_memo(max_entries=FAN_CACHE_SIZE)
+@computed
+def prediction_fans(predicted: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Computes the fan bounds ('upper' and 'lower') around the prediction of every temperature column at once.
+
+    The prediction is resampled to FAN_RESAMPLE_INTERVAL_MIN (median, dropping bins without values) and widened by
+    FAN_INCREASE_PER_MINUTE. The bounds are the max/min over the last hour, smoothed by a moving average over the last
+    hour and clipped to never be inside the values. The fan starts at the first predicted value.
+
+    :param predicted: The predicted data with a time-index.
+    :return: A dictionary from column to a dataframe with the 'upper' and 'lower' bound.
+    """
+    columns = [col for col in LABELS if col in predicted]
+    first_temps, first_index = predicted[columns].iloc[0], predicted.index[0]
+
+    # resample to decrease resolution (drop na, the plot just connects all points so basically free LERP)
+    step = np.timedelta64(FAN_RESAMPLE_INTERVAL_MIN, 'm').astype('timedelta64[ns]').astype(np.int64)
+    origin = first_index.normalize().value  # what resample uses by default (origin="start_day")
+    bins = (predicted.index.asi8 - origin) // step
+    bin_starts, medians = _bin_medians(bins, predicted[columns].to_numpy(np.float64))
+    # rounded to the dtype of each column like resample(...).median() does
+    medians = np.column_stack([medians[:, i].astype(predicted[col].dtype) for i, col in enumerate(columns)]) \
+        .astype(np.float64)
+
+    # like dropna for each column: move the bins with values to the front and pad with NaN. All the windows only look
+    # back, so the padding at the end doesn't change anything before it.
+    has_value = ~np.isnan(medians)
+    order = np.argsort(~has_value, axis=0, kind='stable')
+    values = np.take_along_axis(medians, order, axis=0)
+    times = origin + bin_starts[order] * step
+
+    fan_deltas = FAN_INCREASE_PER_MINUTE[:len(values), np.newaxis] * FAN_RESAMPLE_INTERVAL_MIN
     # take the max/min over 1 hour rolling
-    bounds['upper'] = bounds['upper'].rolling(rows_in_one_hour, min_periods=1).max()
-    bounds['lower'] = bounds['lower'].rolling(rows_in_one_hour, min_periods=1).min()
+    upper = _rolling(values + fan_deltas, FAN_WINDOW, fill=-np.inf).max(axis=-1)
+    lower = _rolling(values - fan_deltas, FAN_WINDOW, fill=np.inf).min(axis=-1)
 
     # an alternate solution which was explored is resampling again but this often results in predicted points
     # outside the prediction bounds when plotted with linear lines. Therefore, a higher resolution is used but smoothed.
-    # bounds = bounds.resample("1h").apply({'upper': lambda g: g.max(), 'lower': lambda g: g.min()})
 
-    # take a moving average over 1 hour rolling to smooth it out
-    bounds = bounds.rolling(rows_in_one_hour, min_periods=2).mean()
+    # take a moving average over 1 hour rolling to smooth it out (needs at least 2 rows)
+    counts = np.minimum(np.arange(1, len(values) + 1), FAN_WINDOW)[:, np.newaxis]
+    with np.errstate(invalid='ignore'):
+        upper = np.where(counts >= 2, np.nansum(_rolling(upper, FAN_WINDOW), axis=-1) / counts, np.nan)
+        lower = np.where(counts >= 2, np.nansum(_rolling(lower, FAN_WINDOW), axis=-1) / counts, np.nan)
 
     # ensure the bounds aren't outside the values
-    bounds['upper'] = bounds['upper'].clip(lower=values)
-    bounds['lower'] = bounds['lower'].clip(upper=values)
+    upper = np.maximum(upper, values)
+    lower = np.minimum(lower, values)
+
+    fans = {}
+    for i, col in enumerate(columns):
+        rows = slice(0, has_value[:, i].sum())
+        # ensure the fan has a smooth start from the initial prediction position after all the aggregation &
+        # smoothing. Add a second to avoid collisions/duplicates.
+        after_start = times[rows, i] >= (first_index + np.timedelta64(1, 's')).value
+        index = pd.DatetimeIndex(times[rows, i][after_start], tz='UTC').tz_convert(first_index.tz)
+        fans[col] = pd.DataFrame({'upper': np.append(first_temps[col], upper[rows, i][after_start]),
+                                  'lower': np.append(first_temps[col], lower[rows, i][after_start])},
+                                 index=index.insert(0, first_index))
+
+    return fans
+
+
+def _bin_medians(bins: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the distinct (sorted) bins and the median of the values in each of them, skipping missing values.
+    Bins without any values are NaN.
+    """
+    starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+    sizes = np.diff(np.append(starts, len(bins)))
+    group = np.repeat(np.arange(len(starts)), sizes)
+    medians = np.empty((len(starts), values.shape[1]))
+    for i in range(values.shape[1]):
+        # sort the values within each bin, missing values go to the end of it
+        column = values[np.lexsort((values[:, i], group)), i]
+        count = np.add.reduceat(~np.isnan(column), starts)
+        low = starts + np.maximum(count - 1, 0) // 2
+        high = starts + count // 2
+        with np.errstate(invalid='ignore'):
+            medians[:, i] = np.where(count > 0, (column[low] + column[np.minimum(high, len(column) - 1)]) / 2, np.nan)
+
+    return bins[starts], medians
+
 
-    # ensure the fan has a smooth start from the initial prediction position after all the aggregation & smoothing
-    first_temp, first_index = predicted[column].iloc[0], predicted.index[0]
-    bounds = pd.concat([pd.DataFrame({'upper': [first_temp], 'lower': [first_temp]}, index=[first_index]),
-                        bounds[first_index + np.timedelta64(1, "s"):]])  # add a second to avoid collisions/duplicates
+def _rolling(values: np.ndarray, window: int, fill=np.nan) -> np.ndarray:
+    """Returns the windows of the last window rows (the first ones filled up with fill) of each row as the last axis."""
+    padding = np.full((window - 1, *values.shape[1:]), fill)
+    return sliding_window_view(np.concatenate([padding, values]), window, axis=0)
 
+
+def _create_prediction_fan_traces(bounds: pd.DataFrame, column: str, *, hidden=False) -> List[go.Scatter]:
     shared_trace_props = dict(
-        x=bounds.index,
+        x=_plot_times(bounds.index),
         mode="lines",
         line_width=0,
         showlegend=False,
@@ -144,23 +263,22 @@ def _add_prediction_fan(fig: Figure, predicted: pd.DataFrame, column: str, *, hi
     if hidden:
         shared_trace_props["visible"] = "legendonly"
 
-    fig.add_trace(go.Scatter(
+    # always SVG traces, the fill of the lower bound goes to the previous trace of the same type (the upper bound)
+    return [go.Scatter(
         name="Upper prediction",
         y=bounds.upper,
         **shared_trace_props
-    ))
-
-    fig.add_trace(go.Scatter(
+    ), go.Scatter(
         name="Lower prediction",
         y=bounds.lower,
         fillcolor=rgba(*COLORS[column], a=FAN_OPACITY),
         fill='tonexty',
         **shared_trace_props
-    ))
+    )]
 
 
-def _add_prediction_shadow(fig: Figure, start, end):
-    fig.add_shape(go.layout.Shape(
+def _prediction_shadow(start, end) -> go.layout.Shape:
+    return go.layout.Shape(
         type="rect",
         xref="x",
         yref="paper",
@@ -172,29 +290,40 @@ def _add_prediction_shadow(fig: Figure, start, end):
         opacity=PREDICTION_SHADOW_OPACITY,
         layer="below",
         line_width=0,  # once again, Plotly not using the correct type annotations for kwargs
-    ))
-
-
-def _add_threshold_line(fig: Figure, threshold: float | int, threshold_name: Literal["Lower", "Upper"]):
-    fig.add_hline(threshold,
-                  line_dash=THRESHOLD_LINE_DASH,
-                  line_color=THRESHOLD_LINE_COLOR,
-                  opacity=THRESHOLD_LINE_OPACITY,
-                  annotation_position="top right",
-                  annotation=go.layout.Annotation(
-                      text=f"{threshold_name} threshold",
-                      hovertext=f"{threshold} °C",
-                      # hacky way to force annotation outside the plot area onto the legend.
-                      # values are designed only for 'Lower threshold' and 'Upper threshold', which
-                      # conveniently have the same number of letters. Couldn't find a prettier way sadly.
-                      xshift=90,
-                      yshift=-10
-                  ))
+    )
+
+
+def _threshold_line(threshold: float | int,
+                    threshold_name: Literal["Lower", "Upper"]) -> Tuple[go.layout.Shape, go.layout.Annotation]:
+    """Returns the horizontal line and its annotation for a threshold, the same as Figure.add_hline would add."""
+    line = go.layout.Shape(type="line",
+                           xref="x domain", x0=0, x1=1,
+                           yref="y", y0=threshold, y1=threshold,
+                           line_dash=THRESHOLD_LINE_DASH,
+                           line_color=THRESHOLD_LINE_COLOR,
+                           opacity=THRESHOLD_LINE_OPACITY)
+    annotation = go.layout.Annotation(text=f"{threshold_name} threshold",
+                                      hovertext=f"{threshold} °C",
+                                      showarrow=False,
+                                      # "top right" of the line
+                                      xref="x domain", x=1, xanchor="right",
+                                      yref="y", y=threshold, yanchor="bottom",
+                                      # hacky way to force annotation outside the plot area onto the legend.
+                                      # values are designed only for 'Lower threshold' and 'Upper threshold',
+                                      # which conveniently have the same number of letters. Couldn't find a
+                                      # prettier way sadly.
+                                      xshift=90,
+                                      yshift=-10)
+    return line, annotation
 
 
 def _create_line_trace(data: pd.DataFrame, column: str, color, *, hidden=False):
-    trace = go.Scatter(x=data.index,
-                       y=data[column],
+    values = data[column]
+
+    # long lines are drawn with WebGL, SVG gets slow in the browser with that many points
+    trace_type = go.Scattergl if len(values) > WEBGL_MIN_POINTS else go.Scatter
+    trace = trace_type(x=_plot_times(values.index),
+                       y=values,
                        mode="lines",
                        line_color=color,
                        name=LABELS[column],
@@ -207,8 +336,14 @@ def _create_line_trace(data: pd.DataFrame, column: str, color, *, hidden=False):
     return trace
 
 
+def advised_column(current_time: datetime, season: Season = DEFAULT_SEASON) -> str:
+    """Returns the temperature the recommendation is based on; the buffer in winter, the drinking water in summer."""
+    return BUFFER_MAX if is_in_winter_mode(current_time, season) else DRINKING_WATER
+
+
 def construct_action_phrase(hit_times: HitTimes, current_time: datetime, thresholds: Thresholds,
-                            suggested_fire_up_time_before_threshold_cross: timedelta, font_size="1rem") -> str:
+                            suggested_fire_up_time_before_threshold_cross: timedelta, font_size="1rem",
+                            season: Season = DEFAULT_SEASON) -> str:
     """
     Constructs a phrase (html str) describing the recommended action with relative times and additional information.
     It has to be HTML to incorporate the font-size; Unfortunately, there is no option in streamlit to set an arbitrary
@@ -219,9 +354,10 @@ def construct_action_phrase(hit_times: HitTimes, current_time: datetime, thresho
     :param thresholds: The thresholds to cross. Must be the same thresholds used for calculating hit_times.
     :param suggested_fire_up_time_before_threshold_cross: Time delta between suggested firing-up-time and threshold-cross-time.
     :param font_size: A valid CSS font-size the phrase should have. No validation, make sure it's right.
+    :param season: The season of the heating unit, which decides the temperature the recommendation is based on.
     :return: A safe HTML string which represents a human-readable phrase for when to fire up again.
     """
-    relevant_column = BUFFER_MAX if is_in_winter_mode(current_time) else DRINKING_WATER
+    relevant_column = advised_column(current_time, season)
     relevant_label = LABELS[relevant_column]
     relevant_hit_times = hit_times[relevant_column]
 
@@ -248,3 +384,46 @@ def construct_action_phrase(hit_times: HitTimes, current_time: datetime, thresho
         return action_phrase
 
     return f'<p style="font-size: {font_size}">{action_phrase} {cross_phrase}</p>'
+
+
+def construct_cycle_phrase(cycles: pd.DataFrame, period_from: datetime, period_to: datetime) -> str:
+    """
+    Constructs a phrase summarizing how often and how long the unit was fired up in a period.
+
+    :param cycles: The heating cycles which started in the period (see HeatingCycleIndex.cycles).
+    :param period_from: Timestamp for the start of the period.
+    :param period_to: Timestamp for the end of the period.
+    :return: A human-readable phrase (plain text).
+    """
+    if not len(cycles):
+        return "The unit wasn't fired up in this period."
+
+    per_day = len(cycles) / ((period_to - period_from) / timedelta(days=1))
+    count = "once" if len(cycles) == 1 else f"{len(cycles)} times"
+    duration = humanize.precisedelta(cycles.duration.mean(), minimum_unit="minutes", format="%0.0f")
+    return f"The unit was fired up {count} in this period ({per_day:.1f} per day), it heated up for {duration} " \
+           f"on average and the buffer peaked at {cycles.peak.max():.0f} °C."
+
+
+def construct_statistics_phrase(statistics: PeriodStatistics, column: str) -> str:
+    """
+    Constructs a phrase summarizing the range of a temperature and the time it spent below the thresholds in a period.
+
+    :param statistics: The statistics of the period (return value of get_period_statistics()).
+    :param column: The temperature to summarize, one of the PREDICTED_COLUMNS.
+    :return: A human-readable phrase (plain text).
+    """
+    minimum, mean, maximum = statistics.temperatures.loc[column, ["min", "mean", "max"]]
+    if np.isnan(mean):
+        return f"No {LABELS[column].lower()} was recorded in this period."
+
+    def fmt_time_below(threshold_label: str, time_below: timedelta):
+        if not time_below:
+            return f"never below the {threshold_label} threshold"
+
+        duration = humanize.precisedelta(time_below, minimum_unit="minutes", format="%0.0f")
+        return f"below the {threshold_label} threshold for {duration}"
+
+    upper, lower = statistics.time_below.loc[column, ["upper", "lower"]]
+    return f"{LABELS[column]} between {minimum:.0f} and {maximum:.0f} °C (mean {mean:.0f} °C), " \
+           f"{fmt_time_below('upper', upper)} and {fmt_time_below('lower', lower)}."
@@ -0,0 +1,225 @@
+"""
+Speculative prefetching of the periods a user is likely to look at next. Users mostly step the period back or forward
+by a few days or widen it, every step computing the period, its hit times and the charts from scratch. After a run
+rendered its view, the views of the likely next periods (see likely_next_periods) are computed in a thread pool and
+kept in a bounded LRU cache shared by all sessions, so the next step only looks its view up.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+import pandas as pd
+import streamlit as st
+from plotly.graph_objs import Figure
+
+import profiling
+from data import get_period, projected_hit_times, load_data, BUFFER_MAX, BUFFER_AVG, BUFFER_MIN, DRINKING_WATER, \
+    DOWNSAMPLING
+from plots import create_temperature_line_chart, prediction_fans
+from shared import HitTimes, Thresholds, DEFAULT_DATE_OFFSET, PLOT_HEIGHT, PLOT_WIDTH, DEFAULT_YLIM, from_inputs
+from tasks import Task, run_tasks
+from units import DEFAULT_UNIT
+
+# a view is a few thousand rows and two charts at most, the cache holds the next steps of a couple of sessions
+PREFETCH_CACHE_SIZE = 32
+# the prefetched views are computed one after the other per worker, the current run always goes first
+PREFETCH_WORKERS = 2
+
+# the columns of the charts of a view (buffer and drinking water, see main.py)
+CHART_COLUMNS = [[(BUFFER_MAX, False), (BUFFER_AVG, True), (BUFFER_MIN, True)], DRINKING_WATER]
+
+
+class ViewKey(NamedTuple):
+    """What a view depends on, the key of the cache."""
+    period_from: datetime
+    period_to: datetime
+    thresholds: Thresholds
+    unit: str
+    dataset_rows: int  # number of rows in the dataset when it was computed, new rows invalidate the view
+
+
+class PeriodView(NamedTuple):
+    """Everything main.py computes for a period apart from its statistics (see get_period_statistics)."""
+    current: pd.Series
+    data: pd.DataFrame
+    predicted: pd.DataFrame
+    hit_times: HitTimes
+    figures: List[Figure]  # one per CHART_COLUMNS
+
+
+class PrefetchStats(NamedTuple):
+    """How often the views requested by runs came from the cache."""
+    requests: int
+    hits: int  # already computed
+    waits: int  # still being prefetched, the run waited for it
+    misses: int  # computed by the run
+    prefetched: int
+    unused: int  # prefetched views evicted before any run needed them
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.hits + self.waits) / self.requests if self.requests else 0.
+
+
+def compute_view(period_from: datetime, period_to: datetime, thresholds: Thresholds,
+                 unit: str = DEFAULT_UNIT) -> PeriodView:
+    """Computes the view of a period of a unit like main.py shows it."""
+    current, data, predicted = get_period(period_from, period_to, max_points=PLOT_WIDTH, unit=unit)
+    # the hit times and the charts only read the period, they're computed concurrently (see tasks.py). The charts share
+    # the prediction fans, which are computed once before them instead of by both at the same time.
+    tasks = {"hit_times": Task(partial(projected_hit_times, data, predicted, thresholds)),
+             "fans": Task(partial(prediction_fans, predicted))}
+    for i, columns in enumerate(CHART_COLUMNS):
+        tasks[f"figure_{i}"] = Task(partial(_chart, data, predicted, columns, thresholds), depends_on=("fans",))
+
+    results = run_tasks(tasks)
+    figures = [results[f"figure_{i}"] for i in range(len(CHART_COLUMNS))]
+    return PeriodView(current, data, predicted, results["hit_times"], figures)
+
+
+def _chart(data: pd.DataFrame, predicted: pd.DataFrame, columns, thresholds: Thresholds, _fans) -> Figure:
+    return create_temperature_line_chart(data, predicted, columns, DEFAULT_YLIM, thresholds, PLOT_HEIGHT, PLOT_WIDTH)
+
+
+def likely_next_periods(period_from: datetime, period_to: datetime, now: datetime) -> List[Tuple[datetime, datetime]]:
+    """
+    Returns the periods a user is likely to look at after the given one, the most likely first: DEFAULT_DATE_OFFSET
+    earlier, DEFAULT_DATE_OFFSET later (unless that's past now) and widened to the next (longer) DOWNSAMPLING bracket.
+    """
+    periods = [(_shifted(period_from, -DEFAULT_DATE_OFFSET), _shifted(period_to, -DEFAULT_DATE_OFFSET))]
+    if _shifted(period_to, DEFAULT_DATE_OFFSET).date() <= now.date():  # the date inputs don't go past today
+        periods.append((_shifted(period_from, DEFAULT_DATE_OFFSET), _shifted(period_to, DEFAULT_DATE_OFFSET)))
+
+    length = pd.Timedelta(period_to - period_from)
+    # DOWNSAMPLING is ordered descending, the bracket just above the length is the last longer one
+    longer = [pd.Timedelta(condition) for condition, _ in DOWNSAMPLING if pd.Timedelta(condition) > length]
+    if longer:
+        # widening by picking an earlier start date, so it's a whole number of days
+        days = -(-longer[-1] // pd.Timedelta(days=1))
+        periods.append((_shifted(period_to, -timedelta(days=days)), period_to))
+
+    return periods
+
+
+def _shifted(time: datetime, offset: timedelta) -> datetime:
+    # the same time on another date, built like main.py builds the period from its date and time inputs (which are in
+    # the local timezone of the server)
+    local = time.astimezone()
+    return from_inputs(local.date() + offset, local.time())
+
+
+class ViewCache:
+    """
+    Bounded LRU cache of the views of periods, which computes the views of the likely next periods in the background.
+    Thread-safe, the same cache is used by every session (see start_prefetching).
+    """
+
+    def __init__(self, size: int, workers: int):
+        self.size = size
+        self._views: "OrderedDict[ViewKey, PeriodView]" = OrderedDict()
+        self._unused: Set[ViewKey] = set()  # prefetched views no run has needed yet
+        self._pending: Dict[ViewKey, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+        self._requests = self._hits = self._waits = self._misses = self._prefetched = self._evicted_unused = 0
+
+    def view(self, period_from: datetime, period_to: datetime, thresholds: Thresholds,
+             unit: str = DEFAULT_UNIT) -> PeriodView:
+        """Returns the view of a period from the cache, waiting for it if it's being prefetched or computing it."""
+        key = ViewKey(period_from, period_to, thresholds, unit, len(load_data(unit)))
+        with profiling.stage("view", cached=True):
+            with self._lock:
+                self._requests += 1
+                view = self._views.get(key)
+                if view is not None:
+                    self._hits += 1
+                    self._views.move_to_end(key)
+                    self._unused.discard(key)
+                    return view
+
+                pending = self._pending.get(key)
+                if pending is not None and pending.cancel():
+                    # wasn't started yet, computing it right away is faster than waiting behind the others
+                    del self._pending[key]
+                    pending = None
+
+                if pending is None:
+                    self._misses += 1
+                else:
+                    self._waits += 1
+
+            if pending is not None:
+                view = pending.result()
+                with self._lock:
+                    self._unused.discard(key)
+                return view
+
+            view = self._compute(key)
+            with self._lock:
+                self._store(key, view, prefetched=False)
+            return view
+
+    def prefetch(self, period_from: datetime, period_to: datetime, thresholds: Thresholds, now: datetime,
+                 unit: str = DEFAULT_UNIT):
+        """
+        Computes the views of the likely next periods in the background (see likely_next_periods). Those of earlier
+        calls which haven't started yet are dropped, the user has moved on since.
+        """
+        dataset_rows = len(load_data(unit))
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if future.cancel():
+                    del self._pending[key]
+
+            for next_from, next_to in likely_next_periods(period_from, period_to, now):
+                key = ViewKey(next_from, next_to, thresholds, unit, dataset_rows)
+                if key not in self._views and key not in self._pending:
+                    self._pending[key] = self._executor.submit(self._prefetch, key)
+
+    def stats(self) -> PrefetchStats:
+        with self._lock:
+            return PrefetchStats(self._requests, self._hits, self._waits, self._misses, self._prefetched,
+                                 self._evicted_unused)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+            self._unused.clear()
+
+    def _prefetch(self, key: ViewKey) -> PeriodView:
+        try:
+            view = self._compute(key)
+            with self._lock:
+                self._store(key, view, prefetched=True)
+            return view
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    @staticmethod
+    @profiling.computed
+    def _compute(key: ViewKey) -> PeriodView:
+        return compute_view(key.period_from, key.period_to, key.thresholds, key.unit)
+
+    def _store(self, key: ViewKey, view: PeriodView, prefetched: bool):
+        # must hold the lock
+        self._views[key] = view
+        self._views.move_to_end(key)
+        if prefetched:
+            self._prefetched += 1
+            self._unused.add(key)
+
+        while len(self._views) > self.size:
+            evicted, _ = self._views.popitem(last=False)
+            if evicted in self._unused:
+                self._unused.discard(evicted)
+                self._evicted_unused += 1
+
+
+# one cache and thread pool per server, shared by all sessions (they all look at the same dataset)
+@st.experimental_singleton
+def start_prefetching() -> ViewCache:
+    return ViewCache(PREFETCH_CACHE_SIZE, PREFETCH_WORKERS)
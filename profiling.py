@@ -0,0 +1,229 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+# where the timings of every run are appended to (one json object per line) if enabled in the dashboard
+PROFILE_LOG_PATH = "data/profile.jsonl"
+
+HIT = "hit"
+MISS = "miss"
+
+
+class StageTiming(NamedTuple):
+    """The wall time of one call of a stage, how many rows it processed and whether it came from a cache."""
+    stage: str
+    start: float  # seconds since the start of the run
+    seconds: float
+    rows: Optional[int]
+    cache: Optional[str]  # HIT, MISS or None if not cached
+
+
+class _Run:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings: List[StageTiming] = []
+        self.open_stages: List["_Stage"] = []
+
+    def branch(self) -> "_Run":
+        """Returns a run recording into the same timings with its own stages, for another thread (see in_this_run)."""
+        branch = _Run()
+        branch.start, branch.timings = self.start, self.timings
+        return branch
+
+
+# every session runs the script in its own thread, so each run (and the live ingestion) only records its own stages.
+# None if the run isn't profiled, which is all the instrumented functions check then.
+_local = threading.local()
+
+
+class _Stage:
+    def __init__(self, run: _Run, name: str, cached: bool):
+        self.run = run
+        self.name = name
+        self.rows: Optional[int] = None
+        # set by computed when the function behind the cache ran
+        self.computed = False if cached else None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.run.open_stages.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.run.open_stages.pop()
+        cache = None if self.computed is None else MISS if self.computed else HIT
+        self.run.timings.append(StageTiming(self.name, self.start - self.run.start, end - self.start, self.rows, cache))
+
+
+def start_run(enabled: bool):
+    """Starts recording the stages of a run on this thread if enabled, otherwise stops recording."""
+    _local.run = _Run() if enabled else None
+
+
+def finish_run() -> Optional[List[StageTiming]]:
+    """Stops recording and returns the timings of the run (in the order the stages finished) or None if not enabled."""
+    run, _local.run = getattr(_local, "run", None), None
+    return None if run is None else run.timings
+
+
+def in_this_run(func: Callable) -> Callable:
+    """
+    Returns a function which records its stages into the run of the calling thread (if it's profiled) when it's
+    called on another thread, e.g. as a task in a thread pool (see tasks.py).
+    """
+    run = getattr(_local, "run", None)
+    if run is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "run", None)
+        _local.run = run.branch()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.run = previous
+
+    return wrapper
+
+
+class _Unrecorded:
+    """Stands in for a stage if the run isn't profiled, setting its rows doesn't do anything."""
+    rows: Optional[int] = None
+
+
+_UNRECORDED = nullcontext(_Unrecorded())
+
+
+def stage(name: str, cached=False):
+    """
+    Returns a context manager which records the block as a stage of the run (if it's profiled), e.g.
+    `with stage("serialization"): ...`. It yields the stage whose rows can be set.
+    """
+    run = getattr(_local, "run", None)
+    return _UNRECORDED if run is None else _Stage(run, name, cached)
+
+
+def timed(name: Optional[str] = None, rows: Optional[Callable[..., int]] = None, cached=False):
+    """
+    Decorator which records every call of the function as a stage of the run. Costs one attribute lookup if the run
+    isn't profiled.
+
+    :param name: The name of the stage, defaults to the name of the function.
+    :param rows: Returns how many rows were processed given the result followed by the arguments of the call. Not
+                 called for cache hits.
+    :param cached: Whether the function is cached. The function behind the cache must be decorated with computed so
+                   the stage knows whether it was a cache hit or miss.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = getattr(_local, "run", None)
+            if run is None:
+                return func(*args, **kwargs)
+
+            with _Stage(run, stage_name, cached) as current:
+                result = func(*args, **kwargs)
+                # nothing was processed if it came from the cache
+                if rows is not None and current.computed is not False:
+                    current.rows = rows(result, *args, **kwargs)
+
+            return result
+
+        # functools.wraps only copies the attributes in __dict__, not the methods of lru_cache
+        for attribute in ("cache_clear", "cache_info"):
+            if hasattr(func, attribute):
+                setattr(wrapper, attribute, getattr(func, attribute))
+
+        return wrapper
+
+    return decorator
+
+
+def computed(func):
+    """Decorator for the function behind a cache (see timed), marks the stage as a cache miss when it's called."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        run = getattr(_local, "run", None)
+        if run is not None and run.open_stages:
+            run.open_stages[-1].computed = True
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def summarize(timings: List[StageTiming]) -> pd.DataFrame:
+    """
+    Returns one row per stage (in the order they were first started) with the number of calls, the total time in ms
+    (including the stages called within), the rows processed and the number of cache hits and misses.
+    """
+    frame = pd.DataFrame(timings, columns=StageTiming._fields)
+    frame["ms"] = frame.seconds * 1000
+    frame["hits"] = frame.cache == HIT
+    frame["misses"] = frame.cache == MISS
+    summary = frame.groupby("stage", sort=False).agg(start=("start", "min"), calls=("stage", "size"), ms=("ms", "sum"),
+                                                     rows=("rows", lambda rows: rows.sum(min_count=1)),
+                                                     hits=("hits", "sum"),
+                                                     misses=("misses", "sum"))
+    summary["rows"] = summary["rows"].astype("Int64")
+    return summary.sort_values("start").drop(columns="start")
+
+
+def append_to_log(timings: List[StageTiming], path=PROFILE_LOG_PATH, **context: Any):
+    """Appends the summary of a run to a json lines log together with some context (e.g. the period)."""
+    stages: Dict[str, dict] = json.loads(summarize(timings).to_json(orient="index"))
+    entry = {"time": pd.Timestamp.now(tz="UTC").isoformat(), **context, "stages": stages}
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(entry, default=str) + "\n")
+
+
+def nbytes(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Returns how many bytes the arrays an object holds take (also in its attributes, dicts, lists and tuples). Arrays
+    are counted by the memory they're a view of, so views of the same array are only counted once.
+
+    :param obj: The object, e.g. a store or an index.
+    :param seen: The ids of the objects and arrays already counted, pass the same set to count what several objects
+                 share only once.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(obj, np.ndarray):
+        while isinstance(obj.base, np.ndarray):
+            obj = obj.base
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(obj.memory_usage(index=False).sum()) if isinstance(obj, pd.DataFrame) else obj.memory_usage()
+    if isinstance(obj, dict):
+        return sum(nbytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value, seen) for value in obj)
+    if hasattr(obj, "__dict__"):
+        return nbytes(vars(obj), seen)
+
+    return 0
+
+
+def resident_memory() -> Optional[int]:
+    """Returns how many bytes of memory the process currently occupies (resident set size) or None if unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
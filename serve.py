@@ -0,0 +1,20 @@
+"""
+Starts the dashboard like `streamlit run main.py` (with the same arguments, e.g. `python serve.py --server.port 8080`)
+and warms it up in the background while the server starts (see warmup.py), so the first visitor doesn't wait for the
+data to be loaded and the default view to be computed.
+"""
+import logging
+import os
+import sys
+
+import streamlit.web.cli
+
+import warmup
+
+if __name__ == "__main__":
+    # the warm-up logs how long it took, the loggers of Streamlit (and Tornado) aren't affected
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger(warmup.__name__).setLevel(logging.INFO)
+    warmup.start_warm_up()
+    sys.argv = ["streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), *sys.argv[1:]]
+    sys.exit(streamlit.web.cli.main())
@@ -1,5 +1,5 @@
-from datetime import datetime
-from typing import Optional, NamedTuple
+from datetime import date, datetime, time, timedelta
+from typing import Optional, NamedTuple, Tuple
 
 import pytz
 
@@ -22,10 +22,63 @@ class Thresholds(NamedTuple):
     lower: float | int
 
 
-def is_in_winter_mode(timestamp: datetime) -> bool:
-    """Returns an estimation whether the heating unit was in winter mode at that time."""
-    # it's not symmetrical, and varies per year; usually the heating unit stays in winter mode longer
-    return timestamp.month < 5 or timestamp.month >= 10
+class Season(NamedTuple):
+    """The months (1-12) a heating unit switches to winter mode and back to summer mode in (see is_in_winter_mode)."""
+    winter_from: int
+    summer_from: int
+
+
+# it's not symmetrical, and varies per year; usually the heating unit stays in winter mode longer
+DEFAULT_SEASON = Season(10, 5)
+
+
+# the range of thresholds that can be selected in °C (both inclusive)
+MIN_THRESHOLD = 20
+MAX_THRESHOLD = 50
+
+# the default view of the dashboard (main.py), which is also computed to warm it up (see warmup.py)
+DEFAULT_DATE_OFFSET = timedelta(days=3)
+DEFAULT_LOWER_THRESHOLD = 30
+DEFAULT_UPPER_THRESHOLD = 40
+# the default period ends at the current time rounded down to this many minutes (a divisor of an hour), so every session
+# opened within them and the warm-up start with the same view, which is computed once and shared (see prefetch.py)
+DEFAULT_PERIOD_RESOLUTION = timedelta(minutes=15)
+
+# plot dimensions in pixels for two column layout in wide mode.
+# Designed for full-hd screens (1920x1080) as responsiveness was not a requirement and hard to get right with Plotly.
+PLOT_HEIGHT = 400
+PLOT_WIDTH = 800
+
+DEFAULT_YLIM = [20, 90]  # °C - same system and environment, so the limits should be universal to have a reference
+
+# to avoid an overwhelming number of inputs and configurations, this is fixed for the application. However, in the real
+# world this might be a value that's interesting to configure depending on the volume of the buffer, the type of wood
+# used, the output of the furnace, etc.
+SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS = timedelta(hours=1)
+
+
+def is_in_winter_mode(timestamp: datetime, season: Season = DEFAULT_SEASON) -> bool:
+    """Returns an estimation whether the heating unit was in winter mode at that time (see Season)."""
+    if season.winter_from > season.summer_from:  # winter mode over new year
+        return timestamp.month < season.summer_from or timestamp.month >= season.winter_from
+
+    return season.winter_from <= timestamp.month < season.summer_from
+
+
+def default_period(now: datetime) -> Tuple[datetime, datetime]:
+    """Returns the period the date and time inputs of the dashboard (see main.py) start with at a time."""
+    now = now.astimezone(PROJECT_TIMEZONE)
+    minutes = DEFAULT_PERIOD_RESOLUTION // timedelta(minutes=1)
+    period_to = now.replace(minute=now.minute - now.minute % minutes, second=0, microsecond=0)
+    return period_to - DEFAULT_DATE_OFFSET, period_to
+
+
+def from_inputs(day: date, time_of_day: time) -> datetime:
+    """
+    Returns the time a date and a time input of the dashboard stand for. They're naive, so they're read in the local
+    timezone of the server (which astimezone assumes for naive times).
+    """
+    return datetime.combine(day, time_of_day).astimezone(PROJECT_TIMEZONE)
 
 
 def rgb(r: int, g: int, b: int):
@@ -0,0 +1,182 @@
+"""
+Shares stores between processes (e.g. several Streamlit servers behind a load balancer) through memory-mapped files.
+One process publishes the arrays of its stores as a version in a directory, every other process attaches to it
+without copying anything: the arrays are mapped read-only from the files, so the operating system keeps a single copy
+of them in its page cache for all the processes.
+
+A directory holds the published versions as subdirectories and a CURRENT file with the name of the newest one. New
+versions (e.g. after new rows were ingested) are written next to the old ones and CURRENT is only switched to them
+once they're complete. Processes which still use an old version can keep reading it even after it was deleted.
+"""
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import pytz
+
+from store import BitColumn, MeanColumn, ScaledColumn, TimeSeriesStore
+
+try:
+    import fcntl
+except ImportError:  # Windows, versions are still switched atomically but several processes might build one
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "lock"
+
+# the files of the locks taken with try_lock, closing them would release the locks
+_held_locks = []
+
+# how a column is stored, see _save_column
+ARRAY = "array"
+SCALED = "scaled"
+BITS = "bits"
+MEAN = "mean"
+
+
+class SharedStores(NamedTuple):
+    """The stores of a published version (by name) with their arrays mapped from its files."""
+    version: str
+    stores: Dict[str, TimeSeriesStore]
+
+
+def current_version(directory: str) -> Optional[str]:
+    """Returns the newest version published in a directory or None if there is none."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(directory: str, version: str, stores: Dict[str, TimeSeriesStore]):
+    """
+    Writes the stores as a new version (a name that can be used as a directory name) and makes it the current one.
+    Every other version is deleted. Must be called holding the lock of the directory (see locked).
+    """
+    temporary = os.path.join(directory, f".{version}.{os.getpid()}")
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    manifest = {name: _save_store(temporary, name, store) for name, store in stores.items()}
+    with open(os.path.join(temporary, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file)
+
+    path = os.path.join(directory, version)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary, path)
+    with open(os.path.join(directory, f".{CURRENT_FILE}.{os.getpid()}"), "w") as file:
+        file.write(version)
+    os.replace(file.name, os.path.join(directory, CURRENT_FILE))
+
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.name != version:
+            # files which are still mapped by other processes stay readable for them until they're unmapped
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def attach(directory: str) -> Optional[SharedStores]:
+    """
+    Maps the stores of the current version of a directory without copying them or returns None if there is none.
+    The arrays are read-only, appending to the stores copies them into the process (see TimeSeriesStore.append).
+    Must be called holding the lock of the directory (see locked), it can be a shared one.
+    """
+    version = current_version(directory)
+    if version is None:
+        return None
+
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+
+    stores = {name: _load_store(path, name, description) for name, description in manifest.items()}
+    return SharedStores(version, stores)
+
+
+@contextmanager
+def locked(directory: str, exclusive=True):
+    """
+    Context manager which holds the lock of a directory (blocking until it's free), exclusive for publishing and
+    shared for attaching. Creates the directory if it doesn't exist.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def try_lock(directory: str, name: str) -> bool:
+    """
+    Tries to take an exclusive lock (e.g. for ingesting new rows) which is held until the process exits, so only one
+    process at a time gets it. Returns whether it did (always without fcntl).
+    """
+    os.makedirs(directory, exist_ok=True)
+    file = open(os.path.join(directory, f"{name}.lock"), "a")
+    if fcntl is None:
+        return True
+
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        return False
+
+    _held_locks.append(file)
+    return True
+
+
+def _save_store(directory: str, name: str, store: TimeSeriesStore) -> dict:
+    np.save(os.path.join(directory, f"{name}.times.npy"), store.times)
+    return {
+        "tz": str(store.tz),
+        "index_name": store.index_name,
+        "columns": {col: _save_column(directory, f"{name}.{col}", values) for col, values in store.columns.items()},
+    }
+
+
+def _save_column(directory: str, name: str, values) -> dict:
+    if isinstance(values, MeanColumn):  # not stored, computed from the other columns again
+        return {"kind": MEAN, "first": values.first, "second": values.second, "decimals": values.decimals}
+
+    if isinstance(values, ScaledColumn):
+        np.save(os.path.join(directory, f"{name}.npy"), values.integers)
+        return {"kind": SCALED, "decimals": values.decimals}
+
+    if isinstance(values, BitColumn):
+        np.save(os.path.join(directory, f"{name}.npy"), values.packed)
+        return {"kind": BITS, "length": values.length}
+
+    np.save(os.path.join(directory, f"{name}.npy"), np.asarray(values))
+    return {"kind": ARRAY}
+
+
+def _load_store(directory: str, name: str, description: dict) -> TimeSeriesStore:
+    times = _map(directory, f"{name}.times")
+    store = TimeSeriesStore(times, {}, pytz.timezone(description["tz"]), description["index_name"])
+    columns = {}
+    for col, column in description["columns"].items():
+        kind = column["kind"]
+        if kind == MEAN:
+            columns[col] = MeanColumn(store, column["first"], column["second"], column["decimals"])
+        elif kind == SCALED:
+            columns[col] = ScaledColumn(_map(directory, f"{name}.{col}"), column["decimals"])
+        elif kind == BITS:
+            columns[col] = BitColumn(_map(directory, f"{name}.{col}"), column["length"])
+        else:
+            columns[col] = _map(directory, f"{name}.{col}")
+
+    store.columns = columns
+    return store
+
+
+def _map(directory: str, name: str) -> np.ndarray:
+    # a plain array viewing the mapped memory, memmap subclasses would be propagated to everything computed from it
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r").view(np.ndarray)
@@ -0,0 +1,382 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from pandas.api.types import is_bool_dtype, is_float_dtype
+
+from shared import PROJECT_TIMEZONE
+
+
+class EncodedColumn(NDArrayOperatorsMixin, ABC):
+    """
+    A column which is stored in a compact encoding but behaves like the decoded (1-dimensional) array. Indexing it with
+    a slice, a position or an array of positions only decodes the selected values. Everything else numpy does with it
+    decodes the whole column (temporarily), so it can be used in place of an array anywhere. Taking rows out of a
+    store (see TimeSeriesStore.take) decodes them.
+    """
+    dtype: np.dtype
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @property
+    @abstractmethod
+    def nbytes(self) -> int:
+        """The number of bytes the encoded values take."""
+
+    @property
+    def shape(self):
+        return len(self),
+
+    @property
+    def ndim(self):
+        return 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return np.asarray(self)[key]
+
+            return self._decode_range(start, max(start, stop))
+
+        if isinstance(key, (int, np.integer)):
+            return self._decode_positions(np.array([key + len(self) if key < 0 else key]))[0]
+
+        positions = np.asarray(key)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+
+        return self._decode_positions(np.where(positions < 0, positions + len(self), positions))
+
+    def __array__(self, dtype=None):
+        values = self._decode_range(0, len(self))
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(value) if isinstance(value, EncodedColumn) else value for value in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def astype(self, dtype, copy=True) -> np.ndarray:
+        return np.asarray(self).astype(dtype, copy=copy)
+
+    @abstractmethod
+    def appended(self, values: np.ndarray, position: int) -> Union["EncodedColumn", np.ndarray]:
+        """
+        Returns a new column with the values appended after (or replacing the values from) position. Might be a plain
+        array if they can't be encoded the same way.
+        """
+
+    @abstractmethod
+    def _decode_range(self, start: int, stop: int) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def _decode_positions(self, positions: np.ndarray) -> np.ndarray:
+        pass
+
+
+class ScaledColumn(EncodedColumn):
+    """
+    A float32 column stored as int16 in steps of 10^-decimals (e.g. 0.1 °C), which halves its size. Only used if the
+    values are exactly the float32 values of such steps (see encode). Missing values are stored as the smallest int16.
+    """
+    MISSING = np.iinfo(np.int16).min
+
+    def __init__(self, integers: np.ndarray, decimals: int):
+        self.integers = integers
+        self.decimals = decimals
+        self.dtype = np.dtype(np.float32)
+
+    @classmethod
+    def encode(cls, values: np.ndarray, decimals: int) -> Optional["ScaledColumn"]:
+        """Returns the encoded float values or None if they can't be decoded to exactly the same float32 values."""
+        values = np.asarray(values, np.float32)
+        missing = np.isnan(values)
+        scaled = np.round(np.where(missing, 0, values).astype(np.float64) * 10 ** decimals)
+        if len(scaled) and np.abs(scaled).max() >= -cls.MISSING:
+            return None
+
+        column = cls(np.where(missing, cls.MISSING, scaled).astype(np.int16), decimals)
+        return column if np.array_equal(column[:], values, equal_nan=True) else None
+
+    def __len__(self):
+        return len(self.integers)
+
+    @property
+    def nbytes(self) -> int:
+        return self.integers.nbytes
+
+    def appended(self, values: np.ndarray, position: int) -> Union["ScaledColumn", np.ndarray]:
+        encoded = ScaledColumn.encode(values, self.decimals)
+        if encoded is None:
+            return np.concatenate([self[:position], np.asarray(values, self.dtype)])
+
+        return ScaledColumn(np.concatenate([self.integers[:position], encoded.integers]), self.decimals)
+
+    def decode(self, integers: np.ndarray) -> np.ndarray:
+        """Returns the float32 values of (some of) the integers."""
+        # the same as parsing the recorded decimal values (to the nearest float64) and converting them to float32
+        values = (integers / 10 ** self.decimals).astype(np.float32)
+        values[integers == self.MISSING] = np.nan
+        return values
+
+    def _decode_range(self, start: int, stop: int) -> np.ndarray:
+        return self.decode(self.integers[start:stop])
+
+    def _decode_positions(self, positions: np.ndarray) -> np.ndarray:
+        return self.decode(self.integers[positions])
+
+
+class BitColumn(EncodedColumn):
+    """A bool column packed into bits (8 rows per byte)."""
+
+    def __init__(self, packed: np.ndarray, length: int):
+        self.packed = packed
+        self.length = length
+        self.dtype = np.dtype(bool)
+
+    @classmethod
+    def encode(cls, values: np.ndarray) -> "BitColumn":
+        return cls(np.packbits(np.asarray(values, bool)), len(values))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self) -> int:
+        return self.packed.nbytes
+
+    def appended(self, values: np.ndarray, position: int) -> "BitColumn":
+        return BitColumn.encode(np.concatenate([self[:position], np.asarray(values, bool)]))
+
+    def _decode_range(self, start: int, stop: int) -> np.ndarray:
+        first_byte = start // 8
+        bits = np.unpackbits(self.packed[first_byte:-(-stop // 8)])
+        offset = start - 8 * first_byte
+        return bits[offset:offset + stop - start].view(bool)
+
+    def _decode_positions(self, positions: np.ndarray) -> np.ndarray:
+        return (self.packed[positions // 8] >> (7 - positions % 8) & 1).astype(bool)
+
+
+class MeanColumn(EncodedColumn):
+    """
+    A column which isn't stored but computed from two other columns of a store (their mean) whenever it's read.
+    Both columns must only have values in steps of 10^-decimals. The mean is computed from those steps (as integers),
+    so it's exactly the float64 mean of the recorded values converted to float32, not the mean of the float32 values.
+    """
+
+    def __init__(self, store: "TimeSeriesStore", first: str, second: str, decimals: int):
+        self.store = store
+        self.first = first
+        self.second = second
+        self.decimals = decimals
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.store.columns[self.first])
+
+    @property
+    def nbytes(self) -> int:
+        return 0
+
+    def appended(self, values: np.ndarray, position: int) -> "MeanColumn":
+        return self  # the columns it's computed from are appended to
+
+    def _decode_range(self, start: int, stop: int) -> np.ndarray:
+        return self._mean(slice(start, stop))
+
+    def _decode_positions(self, positions: np.ndarray) -> np.ndarray:
+        return self._mean(positions)
+
+    def _mean(self, key) -> np.ndarray:
+        steps = self._steps(self.first, key) + self._steps(self.second, key)
+        return (steps / (2 * 10 ** self.decimals)).astype(np.float32)
+
+    def _steps(self, column: str, key) -> np.ndarray:
+        values = self.store.columns[column]
+        if isinstance(values, ScaledColumn) and values.decimals == self.decimals:
+            integers = values.integers[key]
+            return np.where(integers == ScaledColumn.MISSING, np.nan, integers)
+
+        return np.round(values[key].astype(np.float64) * 10 ** self.decimals)
+
+
+class TimeSeriesStore:
+    """
+    A compact column store for time-indexed data. Holds a contiguous, sorted int64 array of nanoseconds since epoch
+    (UTC) and one contiguous array per column. Periods are looked up using binary search and slices are views into
+    the same arrays, so slicing is independent of the size of the store and never copies data.
+    Times are only localized (to tz) when converting to pandas objects.
+
+    Columns can also be stored encoded (see EncodedColumn and from_frame), they're only decoded when rows are taken.
+    Rows can be appended in place (see append) while other threads read from the store.
+    """
+
+    def __init__(self, times: np.ndarray, columns: Dict[str, np.ndarray], tz=PROJECT_TIMEZONE, index_name=None):
+        self.times = np.ascontiguousarray(times, dtype=np.int64)
+        self.columns = {col: values if isinstance(values, EncodedColumn) else np.ascontiguousarray(values)
+                        for col, values in columns.items()}
+        self.tz = tz
+        self.index_name = index_name
+        # preallocated arrays the times and columns are views of once something was appended
+        self._buffers: Optional[Tuple[np.ndarray, Dict[str, np.ndarray]]] = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, float_dtype=np.float32, tz=PROJECT_TIMEZONE,
+                   compact_decimals: Optional[int] = None) -> "TimeSeriesStore":
+        """
+        Creates a store from a dataframe with a sorted, timezone-aware DatetimeIndex.
+
+        :param df: The dataframe to convert.
+        :param float_dtype: The dtype to store float columns with or None to keep them as they are (no copy).
+        :param tz: The timezone to localize the times to when converting back to pandas objects.
+        :param compact_decimals: If set, float columns which only have values with that many decimals are stored as
+                                 ScaledColumns and bool columns as BitColumns. Other columns are stored as usual.
+        """
+        columns = {col: df[col].to_numpy(dtype=float_dtype if float_dtype and is_float_dtype(df[col]) else None)
+                   for col in df.columns}
+        if compact_decimals is not None:
+            for col, values in columns.items():
+                if is_bool_dtype(values.dtype):
+                    columns[col] = BitColumn.encode(values)
+                elif is_float_dtype(values.dtype):
+                    columns[col] = ScaledColumn.encode(values, compact_decimals) or values
+
+        return cls(df.index.asi8, columns, tz, df.index.name)
+
+    def __len__(self):
+        return len(self.times)
+
+    def bounds(self, period_from: Optional[datetime] = None, period_to: Optional[datetime] = None) -> Tuple[int, int]:
+        """Returns the start and stop position of the rows in the period (both ends inclusive, like label slicing)."""
+        start = 0 if period_from is None else np.searchsorted(self.times, _epoch_ns(period_from), side="left")
+        stop = len(self.times) if period_to is None else np.searchsorted(self.times, _epoch_ns(period_to), side="right")
+        return int(start), int(max(start, stop))
+
+    def slice(self, period_from: Optional[datetime] = None, period_to: Optional[datetime] = None,
+              columns: Optional[Iterable[str]] = None) -> "TimeSeriesStore":
+        """
+        Returns the rows in a period (both ends inclusive) as a store of views into this store.
+
+        :param period_from: Timestamp for the start of the period or None to start at the beginning.
+        :param period_to: Timestamp for the end of the period or None to go until the end.
+        :param columns: The columns to include or None for all of them.
+        """
+        return self.take(*self.bounds(period_from, period_to), columns=columns)
+
+    def take(self, start: int, stop: int, columns: Optional[Iterable[str]] = None) -> "TimeSeriesStore":
+        """Returns the rows from position start (inclusive) to stop (exclusive) as a store of views into this store."""
+        columns = self.columns.keys() if columns is None else columns
+        return TimeSeriesStore(self.times[start:stop], {col: self.columns[col][start:stop] for col in columns},
+                               self.tz, self.index_name)
+
+    def append(self, other: "TimeSeriesStore", position: Optional[int] = None):
+        """
+        Appends the rows of another store with the same columns, which must follow in time, in place.
+        The capacity grows geometrically, so appending is amortized O(appended rows).
+
+        Not thread-safe with other writers but readers can keep using the store (and views of it) while appending.
+        Only the times are used to find rows and the columns are never shorter than them, so readers always see every
+        row they find. Views taken before only change if rows they contain are replaced.
+
+        :param other: The store with the rows to append.
+        :param position: Replace the rows from this position onwards instead of appending after the last one.
+        """
+        position = len(self) if position is None else position
+        length = position + len(other)
+        # encoded columns are copied with the new rows instead, they might not be encoded anymore afterwards
+        encoded = {col: values.appended(other.columns[col], position) for col, values in self.columns.items()
+                   if isinstance(values, EncodedColumn)}
+        plain = {col: values for col, values in self.columns.items() if col not in encoded}
+        if self._buffers is None or len(self._buffers[0]) < length or self._buffers[1].keys() != plain.keys():
+            capacity = max(length, 2 * len(self))
+            times = np.empty(capacity, dtype=np.int64)
+            times[:position] = self.times[:position]
+            columns = {}
+            for col, values in plain.items():
+                columns[col] = np.empty(capacity, dtype=values.dtype)
+                columns[col][:position] = values[:position]
+
+            self._buffers = times, columns
+
+        times, columns = self._buffers
+        times[position:length] = other.times
+        for col, values in columns.items():
+            values[position:length] = other.columns[col]
+
+        appended = {col: encoded[col] if col in encoded else columns[col][:length] for col in self.columns}
+        if length < len(self):
+            self.times = times[:length]
+            self.columns = appended
+        else:
+            self.columns = appended
+            self.times = times[:length]
+
+    def adopt(self, other: "TimeSeriesStore"):
+        """
+        Switches to the arrays of another store which starts with all the rows of this one (e.g. a newer version of
+        it with rows appended), like append does, so readers can keep using the store. Nothing is copied.
+        """
+        self._buffers = None
+        # columns computed from the other store are computed from this one instead, it's appended to from now on
+        self.columns = {col: MeanColumn(self, values.first, values.second, values.decimals)
+                        if isinstance(values, MeanColumn) and values.store is other else values
+                        for col, values in other.columns.items()}
+        self.times = other.times
+
+    def shifted(self, offset: np.timedelta64) -> "TimeSeriesStore":
+        """Returns a store with the same columns (views) but all times moved by an offset."""
+        return TimeSeriesStore(self.times + _nanoseconds(offset), self.columns, self.tz, self.index_name)
+
+    def matrix(self, columns: Iterable[str], dtype=None) -> np.ndarray:
+        """Returns the columns as a contiguous (rows x columns) matrix. This copies the data."""
+        return np.column_stack([self.columns[col] for col in columns]).astype(dtype, copy=False)
+
+    def time_at(self, position: int) -> pd.Timestamp:
+        """Returns the (localized) time of the row at a position."""
+        return pd.Timestamp(self.times[position], tz="UTC").tz_convert(self.tz)
+
+    def row(self, position: int, columns: Optional[Iterable[str]] = None) -> pd.Series:
+        """Returns the row at a position as a series named by its time (like df.iloc[position])."""
+        columns = self.columns.keys() if columns is None else columns
+        return pd.Series({col: self.columns[col][position] for col in columns}, name=self.time_at(position))
+
+    def first_time_below(self, column: str, threshold: float) -> Optional[pd.Timestamp]:
+        """Returns the first time the values of a column are below a threshold or None if they never are."""
+        below = self.columns[column] < threshold
+        position = below.argmax() if len(below) else None  # argmax stops at the first True
+        if position is None or not below[position]:
+            return None
+
+        return self.time_at(position)
+
+    def index(self) -> pd.DatetimeIndex:
+        """Returns the times as a localized DatetimeIndex."""
+        return pd.DatetimeIndex(self.times.view("datetime64[ns]"), tz="UTC", name=self.index_name).tz_convert(self.tz)
+
+    def to_frame(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Returns the (selected) columns as a dataframe with a localized DatetimeIndex. This copies the data."""
+        columns = self.columns.keys() if columns is None else columns
+        return pd.DataFrame({col: np.asarray(self.columns[col]) for col in columns}, index=self.index())
+
+
+def concat(*stores: TimeSeriesStore) -> TimeSeriesStore:
+    """Concatenates stores with the same columns, which must follow each other in time, into a new store."""
+    first = stores[0]
+    columns = {col: np.concatenate([store.columns[col] for store in stores]) for col in first.columns}
+    return TimeSeriesStore(np.concatenate([store.times for store in stores]), columns, first.tz, first.index_name)
+
+
+def _nanoseconds(delta: np.timedelta64) -> int:
+    return int(pd.Timedelta(delta).value)
+
+
+def _epoch_ns(timestamp: datetime) -> int:
+    """Returns nanoseconds since epoch (UTC) of a timezone-aware timestamp. Naive ones are assumed to be in UTC."""
+    return pd.Timestamp(timestamp).value
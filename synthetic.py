@@ -0,0 +1,242 @@
+"""
+Generates synthetic heating data in the format of the cleaned dataset (see transform-data.py) together with matching
+summer and winter prediction templates. Used to benchmark the dashboard with any amount of data (see benchmark.py) or
+to try it out without the real data, e.g. `python synthetic.py 20 data/synthetic` writes 20 years of it.
+"""
+import importlib
+import os
+import sys
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from shared import is_in_winter_mode
+
+# the columnar files are written by the same code as the real ones (the module name isn't a valid identifier)
+write_columnar_data = importlib.import_module("transform-data").write_columnar_data
+
+SYNTHETIC_DATA_DIR = "data/synthetic"
+# same file names as in data/ so the directory can be used in place of it
+CSV_NAME = "heating-data_cleaned.csv"
+SUMMER_PREDICTION_CSV_NAME = "summer_prediction.csv"
+WINTER_PREDICTION_CSV_NAME = "winter_prediction.csv"
+
+# the monitor records a row about every minute
+SAMPLING_INTERVAL = np.timedelta64(1, "m")
+
+# the buffers and the boiler (drinking water) cool down exponentially towards these temperatures in °C
+BUFFER_AMBIENT = 18
+DRINKING_WATER_AMBIENT = 15
+# the boiler is heated up to at most this temperature
+DRINKING_WATER_MAX = 62
+# the boiler is heated by the buffer, it's about this much colder than the top of the buffer at the end of heating up
+DRINKING_WATER_OFFSET = 3
+
+# more hot water (and heating) is used in the morning and evening. The decay is that much (relatively) faster at
+# the peaks and slower in between.
+DAILY_USAGE_VARIATION = .5
+DAILY_USAGE_PEAK_HOURS = (6, 18)  # UTC
+
+# a cool-down ends after this at the latest, the furnace is fired up no matter the temperatures
+MAX_COOL_DOWN = np.timedelta64(10, "D")
+
+# the monitor misses some data now and then, this many periods a year of exponentially distributed length
+GAPS_PER_YEAR = 12
+MEAN_GAP = np.timedelta64(2, "h")
+MAX_GAP = np.timedelta64(3, "D")
+
+# temperatures are recorded in steps of 0.1 °C with a bit of sensor noise
+NOISE = .05  # °C (standard deviation)
+DECIMALS = 1
+
+# the templates are one long natural cool-down each (see data._template_continuation)
+SUMMER_TEMPLATE_PERIOD = np.timedelta64(10, "D")
+WINTER_TEMPLATE_PERIOD = np.timedelta64(5, "D")
+
+
+class Season(NamedTuple):
+    """
+    The ranges (low, high) the parameters of every heating cycle (heating up and the cool-down until the next one) in a
+    season are drawn from uniformly. Decays are per minute.
+    """
+    heating_minutes: Tuple[float, float]
+    # buffer_max at the end of heating up
+    peak: Tuple[float, float]
+    # how much colder the bottom of the buffer (buffer_min) is than its top at the end of heating up
+    buffer_spread: Tuple[float, float]
+    buffer_decay: Tuple[float, float]
+    # relative to buffer_decay, the bottom of the buffer is drained by the return flow first
+    buffer_min_decay_factor: float
+    drinking_water_decay: Tuple[float, float]
+    # the column that's watched to decide when to fire up and at which temperature it's done
+    observed: str
+    fire_up_at: Tuple[float, float]
+
+
+# in winter the heating circuits drain the buffers fully and quickly, the top and bottom of the buffer are far apart.
+# In summer only the boiler drains them slowly and it has to be heated up way before the buffers are cold.
+# (see usage-analysis.md)
+WINTER = Season(heating_minutes=(150, 300), peak=(78, 88), buffer_spread=(25, 40), buffer_decay=(7e-4, 1.5e-3),
+                buffer_min_decay_factor=1.3, drinking_water_decay=(5e-4, 1e-3),
+                observed="buffer_max", fire_up_at=(28, 40))
+SUMMER = Season(heating_minutes=(90, 180), peak=(70, 80), buffer_spread=(3, 10), buffer_decay=(1e-4, 2e-4),
+                buffer_min_decay_factor=1.1, drinking_water_decay=(2e-4, 4e-4),
+                observed="drinking_water", fire_up_at=(28, 40))
+
+
+def generate_heating_data(start: pd.Timestamp, end: pd.Timestamp, seed=0) -> pd.DataFrame:
+    """
+    Generates minute-level heating data between start and end: cycles of heating up followed by an exponential cool-down
+    (faster in the morning and evening) until the watched temperature of the season drops low enough to fire up again.
+    Contains some gaps like the real data.
+
+    :param start: The time of the first row (UTC if naive).
+    :param end: The time after which there are no more rows (UTC if naive).
+    :param seed: The seed of the random numbers, the same seed always generates the same data.
+    :return: A dataframe with the columns of the cleaned dataset (received_time, drinking_water, buffer_max,
+             buffer_min, heating_up).
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(_utc(start), _utc(end), freq=pd.Timedelta(SAMPLING_INTERVAL))
+    n = len(times)
+    columns = {col: np.empty(n) for col in ("drinking_water", "buffer_max", "buffer_min")}
+    heating_up = np.zeros(n, dtype=bool)
+
+    horizon = int(MAX_COOL_DOWN / SAMPLING_INTERVAL)
+    minutes_per_day = int(np.timedelta64(1, "D") / SAMPLING_INTERVAL)
+    minute_of_day = (times[0].hour * 60 + times[0].minute + np.arange(n + horizon)) % minutes_per_day
+    usage = 1 + DAILY_USAGE_VARIATION * np.cos(2 * np.pi * (minute_of_day / minutes_per_day - DAILY_USAGE_PEAK_HOURS[0]
+                                                            / 24) * len(DAILY_USAGE_PEAK_HOURS))
+
+    def draw(bounds: Tuple[float, float]) -> float:
+        return rng.uniform(*bounds)
+
+    state = {"drinking_water": 35., "buffer_max": 40., "buffer_min": 30.}
+    position = 0
+    while position < n:
+        season = WINTER if is_in_winter_mode(times[position]) else SUMMER
+        # heating up: every temperature rises linearly to its peak
+        peak = draw(season.peak)
+        peaks = {"buffer_max": peak, "buffer_min": peak - draw(season.buffer_spread),
+                 "drinking_water": min(peak - DRINKING_WATER_OFFSET, DRINKING_WATER_MAX)}
+        rows = slice(position, min(position + int(draw(season.heating_minutes)), n))
+        ramp = np.arange(1, rows.stop - rows.start + 1) / (rows.stop - rows.start)
+        for col, values in columns.items():
+            peaks[col] = max(peaks[col], state[col])
+            values[rows] = state[col] + (peaks[col] - state[col]) * ramp
+
+        heating_up[rows] = True
+        position = rows.stop
+        if position == n:
+            break
+
+        # cool-down until the watched temperature drops to the one it's fired up at
+        buffer_decay = draw(season.buffer_decay)
+        decays = {"buffer_max": buffer_decay, "buffer_min": buffer_decay * season.buffer_min_decay_factor,
+                  "drinking_water": draw(season.drinking_water_decay)}
+        exposure = np.cumsum(usage[position:position + horizon])
+        cool_down = {col: _cool_down(peaks[col], _ambient(col), decays[col] * exposure) for col in columns}
+        # every cool-down is strictly decreasing, so the fire up is a binary search away
+        duration = max(np.searchsorted(-cool_down[season.observed], -draw(season.fire_up_at)), 1)
+        rows = slice(position, min(position + duration, n))
+        for col, values in columns.items():
+            values[rows] = cool_down[col][:rows.stop - rows.start]
+            state[col] = values[rows.stop - 1]
+
+        position = rows.stop
+
+    columns["buffer_min"] = np.minimum(columns["buffer_min"], columns["buffer_max"])
+    frame = pd.DataFrame({col: (values + rng.normal(0, NOISE, n)).round(DECIMALS) for col, values in columns.items()})
+    frame.insert(0, "received_time", times)
+    frame["heating_up"] = heating_up
+    return frame[~_gaps(n, rng)].reset_index(drop=True)
+
+
+def generate_prediction_template(in_winter_mode: bool, start: Optional[pd.Timestamp] = None, seed=0) -> pd.DataFrame:
+    """
+    Generates a prediction template: the longest and slowest natural cool-down of the season from its highest peak (see
+    data._template_continuation).
+
+    :param in_winter_mode: Whether to generate the winter or summer template.
+    :param start: The time of the first row (UTC if naive), defaults to the 1st of January or July of 2022.
+    :param seed: The seed of the (noise) random numbers.
+    :return: A dataframe with the columns of the prediction templates (received_time, buffer_min, buffer_max,
+             drinking_water).
+    """
+    season, period = (WINTER, WINTER_TEMPLATE_PERIOD) if in_winter_mode else (SUMMER, SUMMER_TEMPLATE_PERIOD)
+    start = _utc(start or pd.Timestamp("2022-01-01" if in_winter_mode else "2022-07-01"))
+    times = pd.date_range(start, start + pd.Timedelta(period), freq=pd.Timedelta(SAMPLING_INTERVAL))
+    exposure = np.arange(len(times), dtype=np.float64)
+    peak = season.peak[1]
+    rng = np.random.default_rng(seed)
+
+    def values(col: str, peak: float, decay: float):
+        return (_cool_down(peak, _ambient(col), decay * exposure) + rng.normal(0, NOISE, len(times))).round(DECIMALS)
+
+    return pd.DataFrame({
+        "received_time": times,
+        "buffer_min": values("buffer_min", peak - season.buffer_spread[0],
+                             season.buffer_decay[0] * season.buffer_min_decay_factor),
+        "buffer_max": values("buffer_max", peak, season.buffer_decay[0]),
+        "drinking_water": values("drinking_water", min(peak - DRINKING_WATER_OFFSET, DRINKING_WATER_MAX),
+                                 season.drinking_water_decay[0]),
+    })
+
+
+def write_synthetic_dataset(directory: str, years: float, end: Optional[pd.Timestamp] = None, seed=0, csv=False):
+    """
+    Writes a synthetic dataset and both prediction templates to a directory with the same file names as in data/.
+    Only the columnar files are written by default, the csv files of many years take long to write and to parse.
+
+    :param directory: The directory to write to, it's created if needed.
+    :param years: How many years of data to generate.
+    :param end: The end of the data (UTC if naive), defaults to today. The dashboard shifts it a year into the future.
+    :param seed: The seed of the random numbers.
+    :param csv: Whether to write the csv files as well.
+    """
+    os.makedirs(directory, exist_ok=True)
+    end = _utc(end or pd.Timestamp.now(tz="UTC").normalize())
+    datasets = {
+        CSV_NAME: generate_heating_data(end - pd.Timedelta(days=365.25 * years), end, seed),
+        SUMMER_PREDICTION_CSV_NAME: generate_prediction_template(False, seed=seed),
+        WINTER_PREDICTION_CSV_NAME: generate_prediction_template(True, seed=seed),
+    }
+    for name, df in datasets.items():
+        path = os.path.join(directory, name)
+        if csv:
+            df.to_csv(path, index=False)
+
+        write_columnar_data(df, os.path.splitext(path)[0] + ".feather")
+
+
+def _cool_down(start: float, ambient: float, exposure: np.ndarray) -> np.ndarray:
+    return ambient + (start - ambient) * np.exp(-exposure)
+
+
+def _ambient(column: str) -> float:
+    return DRINKING_WATER_AMBIENT if column == "drinking_water" else BUFFER_AMBIENT
+
+
+def _gaps(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Returns a mask of the rows which are missing."""
+    years = n * SAMPLING_INTERVAL / np.timedelta64(365, "D")
+    count = rng.poisson(GAPS_PER_YEAR * years)
+    starts = rng.integers(0, n, count)
+    lengths = np.minimum(rng.exponential(MEAN_GAP / SAMPLING_INTERVAL, count), MAX_GAP / SAMPLING_INTERVAL)
+    # +1 where a gap starts and -1 where it ends, every row inside at least one gap has a positive sum
+    edges = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, np.minimum(starts + lengths.astype(np.int64) + 1, n), -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def _utc(time: pd.Timestamp) -> pd.Timestamp:
+    time = pd.Timestamp(time)
+    return time.tz_localize("UTC") if time.tz is None else time.tz_convert("UTC")
+
+
+if __name__ == "__main__":
+    # python synthetic.py <years> [directory] [--csv]
+    args = [arg for arg in sys.argv[1:] if arg != "--csv"]
+    write_synthetic_dataset(args[1] if len(args) > 1 else SYNTHETIC_DATA_DIR, float(args[0]), csv="--csv" in sys.argv)
@@ -0,0 +1,92 @@
+"""
+Runs the independent stages of a rerun concurrently, e.g. the hit times and the charts of a period (see
+prefetch.compute_view), which only share read-only inputs. The stages form a small graph: every task is called with
+the results of the tasks it depends on once they're done. NumPy and pandas release the GIL in most of their loops, so
+the tasks overlap even though they're threads.
+
+The results only depend on the inputs, not on the order the tasks happen to finish in. SERIAL_TASKS runs every task
+one after the other in the calling thread instead, e.g. for debugging or profiling a single stage.
+"""
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import profiling
+
+SERIAL_TASKS = False
+# shared by all runs of the server, a run with more ready tasks than free workers runs them itself (see run_tasks)
+TASK_WORKERS = 4
+
+
+class Task(NamedTuple):
+    """A function called with the results of the tasks it depends on (by name, in that order)."""
+    func: Callable[..., Any]
+    depends_on: Tuple[str, ...] = ()
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # created on first use, most scripts importing this (e.g. backtest.py) never run anything concurrently
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(TASK_WORKERS, thread_name_prefix="task")
+
+        return _executor
+
+
+def run_tasks(tasks: Dict[str, Task], serial: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Runs a graph of tasks, each one as soon as the ones it depends on are done, and returns their results by name (in
+    the order of tasks). If a task fails, the ones not started yet are dropped and its exception is raised.
+
+    The calling thread runs the ready tasks no worker has picked up yet instead of waiting for a worker, so runs (and
+    tasks running graphs of their own) never wait on each other for the workers.
+
+    :param tasks: The tasks by name, a task may only depend on the ones before it.
+    :param serial: Whether to run the tasks one after the other in the calling thread, defaults to SERIAL_TASKS.
+    """
+    # which also rules out cycles
+    earlier = set()
+    for name, task in tasks.items():
+        later = [dependency for dependency in task.depends_on if dependency not in earlier]
+        if later:
+            raise ValueError(f"Task {name} depends on {later} which don't come before it")
+        earlier.add(name)
+
+    results: Dict[str, Any] = {}
+    if SERIAL_TASKS if serial is None else serial:
+        for name, task in tasks.items():
+            results[name] = task.func(*(results[dependency] for dependency in task.depends_on))
+
+        return results
+
+    waiting = dict(tasks)
+    running: Dict[str, Future] = {}
+    try:
+        while waiting or running:
+            for name, task in list(waiting.items()):
+                if all(dependency in results for dependency in task.depends_on):
+                    del waiting[name]
+                    running[name] = _get_executor().submit(profiling.in_this_run(task.func),
+                                                           *(results[dependency] for dependency in task.depends_on))
+
+            # a task no worker has started yet is run right here, cancelling it can't race with a worker
+            name = next((name for name, future in running.items() if future.cancel()), None)
+            if name is not None:
+                task = tasks[name]
+                del running[name]
+                results[name] = task.func(*(results[dependency] for dependency in task.depends_on))
+                continue
+
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name in [name for name, future in running.items() if future in done]:
+                results[name] = running.pop(name).result()
+    finally:
+        for future in running.values():
+            future.cancel()
+
+    return {name: results[name] for name in tasks}
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import alerts
+import data
+import synthetic
+from alerts import AlertEvaluator, replay
+from shared import DEFAULT_DATE_OFFSET, Thresholds
+
+# a few months of synthetic data, enough for a history of cool-downs to predict from
+SYNTHETIC_YEARS = .25
+SYNTHETIC_DATA_END = pd.Timestamp("2023-03-01")
+# the replayed period before the last full prediction window and the time between its ticks
+REPLAY_PERIOD = pd.Timedelta(days=7)
+REPLAY_STEP = "10min"
+# integer thresholds are looked up in the crossing index, others are scanned
+THRESHOLDS = [Thresholds(40, 30), Thresholds(41.55, 30.05)]
+
+
+def _clear_caches():
+    data.load_units.clear()
+    data.load_data.clear()
+    for cached in (data.splice_prediction, data._best_template_match, data._largest_triangles):
+        cached.cache_clear()
+
+
+class AlertReplayTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        synthetic.write_synthetic_dataset(cls.directory.name, SYNTHETIC_YEARS, SYNTHETIC_DATA_END)
+        cls.paths = mock.patch.multiple(
+            data,
+            CSV_PATH=os.path.join(cls.directory.name, synthetic.CSV_NAME),
+            SUMMER_PREDICTION_CSV_PATH=os.path.join(cls.directory.name, synthetic.SUMMER_PREDICTION_CSV_NAME),
+            WINTER_PREDICTION_CSV_PATH=os.path.join(cls.directory.name, synthetic.WINTER_PREDICTION_CSV_NAME),
+            UNITS_PATH=os.path.join(cls.directory.name, "units.json"),
+            LIVE_CSV_PATH=os.path.join(cls.directory.name, "heating-data_live.csv"),
+            SHARE_DATASET=False,
+        )
+        cls.paths.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.paths.stop()
+        _clear_caches()
+        cls.directory.cleanup()
+
+    def tearDown(self):
+        _clear_caches()
+
+    def _replayed_period(self):
+        end = data.load_data().time_at(-1) - data.PREDICTED_PERIOD
+        return end - REPLAY_PERIOD, end
+
+    def test_same_as_projected_hit_times(self):
+        period_from, period_to = self._replayed_period()
+        heating_up = data.load_data().to_frame()[data.HEATING_UP]
+        for thresholds in THRESHOLDS:
+            for predict_from_history in (True, False):
+                with self.subTest(thresholds=thresholds, predict_from_history=predict_from_history), \
+                        mock.patch.object(data, "PREDICT_FROM_HISTORY", predict_from_history):
+                    replayed = []
+                    evaluator = replay(period_from, period_to, REPLAY_STEP, [replayed.append], thresholds)
+
+                    # the alerts of the hit times of the default view at every tick, computed from scratch
+                    expected = []
+                    reference, stepped = AlertEvaluator(thresholds=thresholds), AlertEvaluator(thresholds=thresholds)
+                    for now in pd.date_range(period_from, period_to, freq=REPLAY_STEP):
+                        now = now.to_pydatetime()
+                        hit_times = stepped.hit_times(now)
+                        if hit_times is None:
+                            # nothing is recommended while the unit is being fired up
+                            self.assertTrue(heating_up[:now].iloc[-1])
+                        else:
+                            _, past, predicted = data.get_period(now - DEFAULT_DATE_OFFSET, now)
+                            self.assertEqual(hit_times, data.projected_hit_times(past, predicted, thresholds))
+                        expected += reference._alert(now, hit_times)
+
+                    self.assertEqual(replayed, expected)
+                    self.assertTrue(any(alert.kind == alerts.FIRE_UP for alert in replayed))
+                    stats = evaluator.stats()
+                    # the continuations were only matched when a heating up entered the window, not on every tick
+                    self.assertLess(stats.continuations, stats.ticks / 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
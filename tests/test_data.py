@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import data
+import synthetic
+from shared import Thresholds
+
+# a few months of synthetic data, enough for a history of cool-downs to predict from
+SYNTHETIC_YEARS = .25
+SYNTHETIC_DATA_END = pd.Timestamp("2023-03-01")
+PERIOD_ENDS = 12
+# the lengths of the periods, the longer ones are downsampled with MEDIAN
+PERIOD_LENGTHS = [pd.Timedelta(days=days) for days in (1, 3, 7, 40)]
+MAX_POINTS = 500
+# integer thresholds are looked up in the crossing index, others are scanned
+THRESHOLDS = [Thresholds(40, 30), Thresholds(41.55, 30.05)]
+# units with their own synthetic dataset (by seed), they evict each other with a tiny UNIT_MEMORY_LIMIT
+EVICTED_UNITS = {"garage": 1, "house": 2}
+# offsets of the edges of the periods compared with resampling from a bin boundary: on it and inside the bin
+EDGE_OFFSETS = [pd.Timedelta(0), pd.Timedelta(minutes=7, seconds=13)]
+
+
+def _clear_caches():
+    """Clears everything loaded for the units and the predictions computed from it."""
+    data.load_units.clear()
+    data.load_data.clear()  # everything loaded for every unit
+    for cached in (data.splice_prediction, data._best_template_match, data._largest_triangles):
+        cached.cache_clear()
+
+
+class SyntheticDatasetTest(unittest.TestCase):
+    """Loads the synthetic dataset (see synthetic.py) as the default unit."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        synthetic.write_synthetic_dataset(cls.directory.name, SYNTHETIC_YEARS, SYNTHETIC_DATA_END)
+        cls.paths = mock.patch.multiple(
+            data,
+            CSV_PATH=os.path.join(cls.directory.name, synthetic.CSV_NAME),
+            SUMMER_PREDICTION_CSV_PATH=os.path.join(cls.directory.name, synthetic.SUMMER_PREDICTION_CSV_NAME),
+            WINTER_PREDICTION_CSV_PATH=os.path.join(cls.directory.name, synthetic.WINTER_PREDICTION_CSV_NAME),
+            # only the default unit without a live feed
+            UNITS_PATH=os.path.join(cls.directory.name, "units.json"),
+            LIVE_CSV_PATH=os.path.join(cls.directory.name, "heating-data_live.csv"),
+            SHARE_DATASET=False,
+        )
+        cls.paths.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.paths.stop()
+        _clear_caches()
+        cls.directory.cleanup()
+
+    def tearDown(self):
+        _clear_caches()
+
+
+class CompactDatasetTest(SyntheticDatasetTest):
+    def _views(self, compact: bool, method: str) -> list:
+        """Returns the period and the hit times of every period the test looks at."""
+        _clear_caches()
+        with mock.patch.multiple(data, COMPACT_DATASET=compact, DOWNSAMPLING_METHOD=method):
+            dataset = data.load_data()
+            first, last = dataset.time_at(0), dataset.time_at(-1)
+            ends = pd.date_range(first + max(PERIOD_LENGTHS), last - data.PREDICTED_PERIOD, periods=PERIOD_ENDS)
+            views = []
+            for period_to in ends:
+                for length in PERIOD_LENGTHS:
+                    current, past, predicted = data.get_period(period_to - length, period_to, MAX_POINTS)
+                    hit_times = [data.projected_hit_times(past, predicted, thresholds) for thresholds in THRESHOLDS]
+                    views.append((current, past, predicted, hit_times))
+
+            return views
+
+    def test_compact_dataset(self):
+        _clear_caches()
+        with mock.patch.object(data, "COMPACT_DATASET", True):
+            dataset = data.load_data()
+        self.assertTrue(any(isinstance(values, data.EncodedColumn) for values in dataset.columns.values()))
+
+    def test_same_views(self):
+        for method in (data.LTTB, data.MEDIAN):
+            compact_views, views = self._views(True, method), self._views(False, method)
+            self.assertEqual(len(compact_views), len(views))
+            for (compact_current, compact_past, compact_predicted, compact_hit_times), \
+                    (current, past, predicted, hit_times) in zip(compact_views, views):
+                with self.subTest(method=method, period_to=current.name):
+                    pd.testing.assert_series_equal(compact_current, current)
+                    pd.testing.assert_frame_equal(compact_past, past)
+                    pd.testing.assert_frame_equal(compact_predicted, predicted)
+                    self.assertEqual(compact_hit_times, hit_times)
+
+
+class DownsampleTest(SyntheticDatasetTest):
+    def _periods(self, dataset: data.TimeSeriesStore, interval: str):
+        """Yields periods with their edges on and between the bin boundaries, some with (partly) no data."""
+        step = pd.to_timedelta(interval)
+        last_day = dataset.time_at(-1).normalize() - pd.Timedelta(days=3)
+        for condition, _ in data.DOWNSAMPLING:
+            for length in (pd.Timedelta(condition), pd.Timedelta(condition) + step * 5 / 2):
+                for from_offset in EDGE_OFFSETS:
+                    for to_offset in (*EDGE_OFFSETS, step / 2):
+                        yield last_day - length + from_offset, last_day + to_offset
+
+        first = dataset.time_at(0)
+        yield first - pd.Timedelta(days=2), first + pd.Timedelta(days=5, minutes=7)  # starting before the dataset
+        yield last_day + pd.Timedelta(minutes=3), last_day + step / 2  # no complete bin
+
+    def test_same_as_resampling(self):
+        dataset = data.load_data()
+        for _, interval in data.DOWNSAMPLING:
+            for period_from, period_to in self._periods(dataset, interval):
+                with self.subTest(interval=interval, period_from=period_from, period_to=period_to):
+                    start, stop = dataset.bounds(period_from, period_to)
+                    past = dataset.take(start, stop, data.TEMPERATURE_COLUMNS)
+                    downsampled = data._downsample(past, period_from, period_to, interval, data.DEFAULT_UNIT)
+                    expected = past.to_frame().resample(interval).median().dropna()
+                    pd.testing.assert_frame_equal(data.frame_from_parts(downsampled), expected, check_freq=False)
+
+
+class UnitEvictionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        units = {}
+        for unit, seed in EVICTED_UNITS.items():
+            directory = os.path.join(cls.directory.name, unit)
+            synthetic.write_synthetic_dataset(directory, SYNTHETIC_YEARS, SYNTHETIC_DATA_END, seed)
+            units[unit] = {"csv_path": os.path.join(directory, synthetic.CSV_NAME),
+                           "summer_prediction_csv_path": os.path.join(directory, synthetic.SUMMER_PREDICTION_CSV_NAME),
+                           "winter_prediction_csv_path": os.path.join(directory, synthetic.WINTER_PREDICTION_CSV_NAME)}
+
+        units_path = os.path.join(cls.directory.name, "units.json")
+        with open(units_path, "w", encoding="utf-8") as file:
+            json.dump(units, file)
+
+        cls.paths = mock.patch.multiple(data, UNITS_PATH=units_path, SHARE_DATASET=False)
+        cls.paths.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.paths.stop()
+        _clear_caches()
+        cls.directory.cleanup()
+
+    def tearDown(self):
+        _clear_caches()
+
+    def _view(self, unit: str):
+        """Returns the dataset of a unit, the data of a period and its hit times."""
+        dataset = data.load_data(unit)
+        period_to = dataset.time_at(len(dataset) // 2)
+        current, past, predicted = data.get_period(period_to - PERIOD_LENGTHS[1], period_to, MAX_POINTS, unit)
+        hit_times = [data.projected_hit_times(past, predicted, thresholds) for thresholds in THRESHOLDS]
+        return dataset.to_frame(), current, past, predicted, hit_times
+
+    def assertViewsEqual(self, view, expected):
+        frame, current, past, predicted, hit_times = view
+        expected_frame, expected_current, expected_past, expected_predicted, expected_hit_times = expected
+        pd.testing.assert_frame_equal(frame, expected_frame)
+        pd.testing.assert_series_equal(current, expected_current)
+        pd.testing.assert_frame_equal(past, expected_past)
+        pd.testing.assert_frame_equal(predicted, expected_predicted)
+        self.assertEqual(hit_times, expected_hit_times)
+
+    def test_evicted_unit_reloaded(self):
+        _clear_caches()
+        expected = {unit: self._view(unit) for unit in EVICTED_UNITS}
+        self.assertEqual(set(data.loaded_units()), set(EVICTED_UNITS))
+        evictions = data._UNIT_CACHE.evictions
+
+        _clear_caches()
+        with mock.patch.object(data._UNIT_CACHE, "memory_limit", 1):
+            for unit in [*EVICTED_UNITS, *EVICTED_UNITS]:
+                with self.subTest(unit=unit):
+                    self.assertViewsEqual(self._view(unit), expected[unit])
+                    # only the unit which was looked at last stays loaded
+                    self.assertEqual(list(data.loaded_units()), [unit])
+
+        self.assertEqual(data._UNIT_CACHE.evictions - evictions, 2 * len(EVICTED_UNITS) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
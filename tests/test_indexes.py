@@ -0,0 +1,167 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from aggregates import AggregateIndex
+from crossings import IndexedRows, ThresholdCrossingIndex, first_time_below
+from cycles import HeatingCycleIndex
+from data import BUFFER_AVG, BUFFER_MAX, HEATING_UP, INDEXED_THRESHOLDS, PREDICTED_COLUMNS, \
+    STATISTICS_MAX_ROW_DURATION, TEMPERATURE_COLUMNS, projected_hit_time_sweep, projected_hit_times
+from shared import PROJECT_TIMEZONE, Thresholds
+from store import TimeSeriesStore
+from synthetic import generate_heating_data
+
+# a few weeks of synthetic data with gaps, in winter and summer mode
+SYNTHETIC_DATA_START = pd.Timestamp("2023-03-20")
+SYNTHETIC_DATA_END = pd.Timestamp("2023-05-01")
+# number of random ranges of rows every index is queried with
+RANGES = 100
+# the indexes are built on the first rows and then extended in steps of this many rows, like with a live feed. Some
+# steps end in the middle of a heating up or a run below a threshold.
+EXTEND_ROWS = 997
+# the thresholds of the sweep, integer and fractional ones, some crossed right at the start of a prediction
+UPPER_THRESHOLDS = [35, 40, 41.55, 60, 85]
+LOWER_THRESHOLDS = [20, 30, 30.05, 44.5]
+# rows of the predicted data after each range (three days)
+PREDICTED_ROWS = 3 * 24 * 60
+
+
+def _synthetic_store() -> TimeSeriesStore:
+    """The synthetic data as the dataset stores it (float32 temperatures in the project timezone)."""
+    frame = generate_heating_data(SYNTHETIC_DATA_START, SYNTHETIC_DATA_END)
+    frame = frame.set_index(pd.DatetimeIndex(frame.pop("received_time")).tz_convert(PROJECT_TIMEZONE))
+    frame[BUFFER_AVG] = (frame["buffer_max"] + frame["buffer_min"]) / 2
+    return TimeSeriesStore.from_frame(frame)
+
+
+def _random_ranges(rng: np.random.Generator, length: int):
+    """Yields random (start, stop) positions, some of them empty or reaching past the rows."""
+    for _ in range(RANGES):
+        start, stop = sorted(rng.integers(0, length + 10, 2))
+        yield int(start), int(stop)
+
+
+def _extended(store: TimeSeriesStore, index_type, *args):
+    """Builds an index on the first rows of the store and extends it with the others."""
+    index = index_type(store.take(0, EXTEND_ROWS), *args)
+    for stop in range(2 * EXTEND_ROWS, len(store) + EXTEND_ROWS, EXTEND_ROWS):
+        index.extend(store.take(0, min(stop, len(store))))
+
+    return index
+
+
+class IndexTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.store = _synthetic_store()
+        cls.frame = cls.store.to_frame()
+
+
+class ThresholdCrossingIndexTest(IndexTestCase):
+    def test_first_below(self):
+        rng = np.random.default_rng(0)
+        for index in (ThresholdCrossingIndex(self.store, PREDICTED_COLUMNS, INDEXED_THRESHOLDS),
+                      _extended(self.store, ThresholdCrossingIndex, PREDICTED_COLUMNS, INDEXED_THRESHOLDS)):
+            for start, stop in _random_ranges(rng, len(self.store)):
+                rows = self.frame.iloc[start:stop]
+                for col in PREDICTED_COLUMNS:
+                    for threshold in rng.choice(INDEXED_THRESHOLDS, 3):
+                        with self.subTest(start=start, stop=stop, column=col, threshold=threshold):
+                            position = index.first_below(col, threshold, start, stop)
+                            time = None if position is None else self.store.time_at(position)
+                            self.assertEqual(time, rows.query(f"{col} < {threshold}").first_valid_index())
+
+    def test_first_below_many(self):
+        index = ThresholdCrossingIndex(self.store, PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+        starts = np.random.default_rng(0).integers(0, len(self.store), RANGES)
+        for col in PREDICTED_COLUMNS:
+            for threshold in INDEXED_THRESHOLDS:
+                with self.subTest(column=col, threshold=threshold):
+                    expected = [index.first_below(col, threshold, start, len(self.store)) for start in starts]
+                    np.testing.assert_array_equal(index.first_below_many(col, threshold, starts),
+                                                  [len(self.store) if p is None else p for p in expected])
+
+    def test_first_time_below(self):
+        rng = np.random.default_rng(0)
+        index = ThresholdCrossingIndex(self.store, PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+        for start, stop in _random_ranges(rng, len(self.store)):
+            start, stop = min(start, len(self.store)), min(stop, len(self.store))
+            middle = (start + stop) // 2
+            # an indexed part followed by rows which are scanned
+            parts = [IndexedRows(self.store.take(start, middle), index, start),
+                     IndexedRows(self.store.take(middle, stop))]
+            rows = self.frame.iloc[start:stop]
+            for col in PREDICTED_COLUMNS:
+                # integer thresholds are looked up in the index, the others are scanned
+                for threshold in (int(rng.choice(INDEXED_THRESHOLDS)), round(rng.uniform(20, 80), 2)):
+                    with self.subTest(start=start, stop=stop, column=col, threshold=threshold):
+                        self.assertEqual(first_time_below(parts, col, threshold),
+                                         rows.query(f"{col} < {threshold}").first_valid_index())
+
+
+class ThresholdSweepTest(IndexTestCase):
+    def test_same_as_projected_hit_times(self):
+        rng = np.random.default_rng(0)
+        for start, stop in _random_ranges(rng, len(self.store) - PREDICTED_ROWS):
+            if start == stop:
+                continue
+
+            past, predicted = self.frame.iloc[start:stop], self.frame.iloc[stop:stop + PREDICTED_ROWS]
+            sweep = projected_hit_time_sweep(past, predicted, UPPER_THRESHOLDS, LOWER_THRESHOLDS)
+            for i, upper in enumerate(UPPER_THRESHOLDS):
+                for j, lower in enumerate(LOWER_THRESHOLDS):
+                    with self.subTest(start=start, stop=stop, upper=upper, lower=lower):
+                        self.assertEqual(sweep[i, j], projected_hit_times(past, predicted, Thresholds(upper, lower)))
+
+
+class HeatingCycleIndexTest(IndexTestCase):
+    def test_same_as_pandas(self):
+        heating_up = self.frame[HEATING_UP]
+        starts = heating_up & ~heating_up.shift(fill_value=False)
+        rng = np.random.default_rng(0)
+        for index in (HeatingCycleIndex(self.store, HEATING_UP, BUFFER_MAX),
+                      _extended(self.store, HeatingCycleIndex, HEATING_UP, BUFFER_MAX)):
+            for start, stop in _random_ranges(rng, len(self.store)):
+                with self.subTest(start=start, stop=stop):
+                    self.assertEqual(index.count(start, stop), int(starts.iloc[start:stop].sum()))
+                    position = index.first_heating_up(start, stop)
+                    self.assertEqual(None if position is None else self.store.time_at(position),
+                                     self.frame.iloc[start:stop].query(HEATING_UP).first_valid_index())
+
+            # the peak of every run of rows heating up
+            peaks = self.frame.loc[heating_up, BUFFER_MAX].groupby(starts.cumsum()[heating_up]).max()
+            self.assertTrue(index.cycles().index.equals(self.frame.index[starts.to_numpy()]))
+            np.testing.assert_array_equal(index.cycles()["peak"], peaks)
+
+
+class AggregateIndexTest(IndexTestCase):
+    def test_same_as_pandas(self):
+        crossings = ThresholdCrossingIndex(self.store, PREDICTED_COLUMNS, INDEXED_THRESHOLDS)
+        # every row lasts until the next one, at most STATISTICS_MAX_ROW_DURATION (the last one not at all)
+        durations = pd.Series(np.diff(self.frame.index.asi8, append=self.frame.index.asi8[-1]), self.frame.index) \
+            .clip(upper=pd.Timedelta(STATISTICS_MAX_ROW_DURATION).value)
+        rng = np.random.default_rng(0)
+        for index in (AggregateIndex(self.store, TEMPERATURE_COLUMNS, STATISTICS_MAX_ROW_DURATION),
+                      _extended(self.store, AggregateIndex, TEMPERATURE_COLUMNS, STATISTICS_MAX_ROW_DURATION)):
+            for start, stop in _random_ranges(rng, len(self.store)):
+                rows = self.frame.iloc[start:stop]
+                # the index sums up in float64, pandas in the float32 of the columns
+                expected = rows[TEMPERATURE_COLUMNS].astype(np.float64).agg(["min", "mean", "max"])
+                for col in TEMPERATURE_COLUMNS:
+                    with self.subTest(start=start, stop=stop, column=col):
+                        extremes = [index.minimum(col, start, stop), index.maximum(col, start, stop)]
+                        np.testing.assert_array_equal(extremes, expected.loc[["min", "max"], col])
+                        np.testing.assert_allclose(index.mean(col, start, stop), expected.loc["mean", col], rtol=1e-9)
+
+                self.assertEqual(index.duration(start, stop), durations.iloc[start:stop].sum())
+                for col in PREDICTED_COLUMNS:
+                    # integer thresholds are looked up in the crossing index, the others are scanned
+                    for threshold in (int(rng.choice(INDEXED_THRESHOLDS)), round(rng.uniform(20, 80), 2)):
+                        with self.subTest(start=start, stop=stop, column=col, threshold=threshold):
+                            self.assertEqual(index.time_below(col, threshold, start, stop, crossings),
+                                             durations.iloc[start:stop][rows[col] < threshold].sum())
+
+
+if __name__ == "__main__":
+    unittest.main()
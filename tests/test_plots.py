@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from data import TEMPERATURE_COLUMNS, BUFFER_MAX, BUFFER_MIN, BUFFER_AVG
+from plots import FAN_INCREASE_PER_MINUTE, FAN_RESAMPLE_INTERVAL_MIN, prediction_fans
+from shared import PROJECT_TIMEZONE
+from synthetic import generate_prediction_template
+
+
+def _pandas_prediction_fan(predicted: pd.DataFrame, column: str) -> pd.DataFrame:
+    """The bounds of the fan as _add_prediction_fan computed them with pandas before prediction_fans."""
+    values = predicted[column].resample(f'{FAN_RESAMPLE_INTERVAL_MIN}min').median().dropna()
+
+    fan_deltas = FAN_INCREASE_PER_MINUTE[:len(values)] * FAN_RESAMPLE_INTERVAL_MIN
+    bounds = pd.DataFrame({'upper': values + fan_deltas, 'lower': values - fan_deltas}, index=values.index)
+
+    rows_in_one_hour = int(np.timedelta64(1, 'h') / np.timedelta64(FAN_RESAMPLE_INTERVAL_MIN, 'm'))
+    bounds['upper'] = bounds['upper'].rolling(rows_in_one_hour, min_periods=1).max()
+    bounds['lower'] = bounds['lower'].rolling(rows_in_one_hour, min_periods=1).min()
+    bounds = bounds.rolling(rows_in_one_hour, min_periods=2).mean()
+    bounds['upper'] = bounds['upper'].clip(lower=values)
+    bounds['lower'] = bounds['lower'].clip(upper=values)
+
+    first_temp, first_index = predicted[column].iloc[0], predicted.index[0]
+    return pd.concat([pd.DataFrame({'upper': [first_temp], 'lower': [first_temp]}, index=[first_index]),
+                      bounds[first_index + np.timedelta64(1, "s"):]])
+
+
+def _predicted_frame(in_winter_mode: bool, start: str, days: float, seed=0) -> pd.DataFrame:
+    """A prediction like the ones of get_period (float32 temperatures in the project timezone) from a template."""
+    template = generate_prediction_template(in_winter_mode, pd.Timestamp(start, tz=PROJECT_TIMEZONE), seed)
+    template = template.set_index(pd.DatetimeIndex(template.pop("received_time")).tz_convert(PROJECT_TIMEZONE))
+    template[BUFFER_AVG] = (template[BUFFER_MAX] + template[BUFFER_MIN]) / 2
+    return template.loc[:template.index[0] + pd.Timedelta(days=days), TEMPERATURE_COLUMNS].astype(np.float32)
+
+
+def _predicted_frames():
+    rng = np.random.default_rng(0)
+    regular = _predicted_frame(True, "2023-02-10 12:00:12", 3)
+    yield "regular", regular
+
+    # starting at an odd second in the middle of a bin and crossing the switch to daylight saving time
+    yield "odd start", _predicted_frame(True, "2023-03-24 07:13:27", 3, seed=1)
+    yield "summer", _predicted_frame(False, "2023-07-02 23:59:59", 3, seed=2)
+    yield "short", regular.iloc[:25]
+
+    with_nans = regular.copy()
+    with_nans.iloc[100:200, 0] = np.nan  # longer than a bin
+    with_nans.iloc[5:2000:3, 1] = np.nan
+    with_nans.iloc[rng.random(len(regular)) < .2, 2] = np.nan
+    yield "missing values", with_nans
+
+    first_missing = regular.copy()
+    first_missing.iloc[:30, 3] = np.nan
+    yield "missing first values", first_missing
+
+    yield "gaps", regular.drop(regular.index[300:900]).drop(regular.index[2000:2007])
+    yield "irregular", regular[rng.random(len(regular)) < .3]
+
+    gaps_and_nans = with_nans.drop(with_nans.index[1500:2500])
+    yield "gaps and missing values", gaps_and_nans
+
+
+class PredictionFansTest(unittest.TestCase):
+    def test_same_as_pandas(self):
+        for name, predicted in _predicted_frames():
+            fans = prediction_fans(predicted)
+            for column in TEMPERATURE_COLUMNS:
+                with self.subTest(name, column=column):
+                    expected = _pandas_prediction_fan(predicted, column)
+                    fan = fans[column]
+                    self.assertTrue(fan.index.equals(expected.index))
+                    for bound in ("upper", "lower"):
+                        np.testing.assert_allclose(fan[bound].to_numpy(np.float64),
+                                                   expected[bound].to_numpy(np.float64), rtol=0, atol=1e-9)
+
+
+if __name__ == "__main__":
+    unittest.main()
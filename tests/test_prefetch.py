@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import prefetch
+from prefetch import ViewCache, likely_next_periods
+from shared import DEFAULT_DATE_OFFSET, PROJECT_TIMEZONE, Thresholds
+
+THRESHOLDS = Thresholds(40, 30)
+# the periods are datetimes like the ones main.py builds from its inputs
+NOW = PROJECT_TIMEZONE.localize(datetime(2023, 2, 20, 12))
+# how long to wait for the views computed in the background at most
+WAIT_TIMEOUT = 10  # seconds
+
+
+def _period(days_before_now: int):
+    period_to = NOW - timedelta(days=days_before_now)
+    return period_to - DEFAULT_DATE_OFFSET, period_to
+
+
+class ViewCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dataset = [0] * 100
+        self.computed = []
+        self.computed_lock = threading.Lock()
+        # the views are the arguments they were computed with, the dataset only needs its length
+        patches = [mock.patch.object(prefetch, "compute_view", side_effect=self._compute_view),
+                   mock.patch.object(prefetch, "load_data", side_effect=lambda unit: self.dataset)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _compute_view(self, period_from, period_to, thresholds, unit):
+        with self.computed_lock:
+            self.computed.append((period_from, period_to))
+        return period_from, period_to, thresholds, unit
+
+    def test_least_recently_used_evicted(self):
+        cache = ViewCache(3, 1)
+        first, second, third, fourth = (_period(days) for days in (1, 2, 3, 4))
+        for period in (first, second, third, first):
+            self.assertEqual(cache.view(*period, THRESHOLDS)[:2], period)
+
+        self.assertEqual(self.computed, [first, second, third])
+        # evicts the second, the first was used since
+        cache.view(*fourth, THRESHOLDS)
+        cache.view(*first, THRESHOLDS)
+        cache.view(*third, THRESHOLDS)
+        self.assertEqual(len(self.computed), 4)
+        cache.view(*second, THRESHOLDS)
+        self.assertEqual(self.computed[-1], second)
+
+        stats = cache.stats()
+        self.assertEqual((stats.requests, stats.hits, stats.misses, stats.waits), (8, 3, 5, 0))
+
+    def test_new_rows_invalidate(self):
+        cache = ViewCache(3, 1)
+        period = _period(1)
+        cache.view(*period, THRESHOLDS)
+        cache.view(*period, THRESHOLDS)
+        self.dataset = self.dataset + [0]
+        cache.view(*period, THRESHOLDS)
+        self.assertEqual(self.computed, [period, period])
+        # thresholds and units are part of the key too
+        cache.view(*period, Thresholds(41, 30))
+        cache.view(*period, THRESHOLDS, unit="other")
+        self.assertEqual(len(self.computed), 4)
+
+    def _wait_for_views(self, count: int):
+        """Waits until the background workers computed that many views in total."""
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while len(self.computed) < count and time.monotonic() < deadline:
+            time.sleep(.01)
+
+    def test_prefetched_views(self):
+        period = _period(5)
+        next_periods = likely_next_periods(*period, NOW)
+        cache = ViewCache(len(next_periods), 1)
+        cache.view(*period, THRESHOLDS)
+        cache.prefetch(*period, THRESHOLDS, NOW)
+        self._wait_for_views(1 + len(next_periods))
+        for next_period in next_periods:
+            self.assertEqual(cache.view(*next_period, THRESHOLDS)[:2], next_period)
+
+        stats = cache.stats()
+        self.assertEqual(len(self.computed), 1 + len(next_periods))
+        self.assertEqual((stats.hits + stats.waits, stats.misses, stats.prefetched, stats.unused),
+                         (len(next_periods), 1, len(next_periods), 0))
+
+        # the views prefetched for another period replace them, the oldest is evicted before any run needed it
+        cache.prefetch(*_period(20), THRESHOLDS, NOW)
+        self._wait_for_views(1 + 2 * len(next_periods))
+        cache.view(*_period(40), THRESHOLDS)
+        self.assertEqual(cache.stats().unused, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
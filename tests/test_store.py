@@ -0,0 +1,109 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from shared import PROJECT_TIMEZONE
+from store import BitColumn, MeanColumn, ScaledColumn, TimeSeriesStore
+
+LENGTH = 1000
+
+
+def _recorded_temperatures(rng: np.random.Generator, missing=.05) -> np.ndarray:
+    """Float32 temperatures in steps of 0.1 °C like the recorded ones, some of them missing."""
+    values = np.round(rng.normal(40, 10, LENGTH), 1).astype(np.float32)
+    values[rng.random(LENGTH) < missing] = np.nan
+    return values
+
+
+class EncodedColumnTest(unittest.TestCase):
+    def assertDecodesTo(self, column, values: np.ndarray):
+        """Asserts that every way of reading the column returns exactly the values (and their dtype)."""
+        rng = np.random.default_rng(1)
+        decoded = np.asarray(column)
+        self.assertEqual(decoded.dtype, values.dtype)
+        np.testing.assert_array_equal(decoded, values)
+        for _ in range(200):
+            start, stop = sorted(rng.integers(-20, LENGTH + 20, 2))
+            np.testing.assert_array_equal(column[start:stop], values[start:stop])
+            step = int(rng.integers(2, 5))
+            np.testing.assert_array_equal(column[start:stop:step], values[start:stop:step])
+            positions = rng.integers(-LENGTH, LENGTH, 10)
+            np.testing.assert_array_equal(column[positions], values[positions])
+            np.testing.assert_array_equal(column[int(positions[0])], values[int(positions[0])])
+
+        mask = rng.random(LENGTH) < .5
+        np.testing.assert_array_equal(column[mask], values[mask])
+
+    def test_scaled_column(self):
+        values = _recorded_temperatures(np.random.default_rng(0))
+        column = ScaledColumn.encode(values, 1)
+        self.assertIsNotNone(column)
+        self.assertEqual(column.nbytes, LENGTH * 2)
+        self.assertDecodesTo(column, values)
+
+    def test_scaled_column_only_exact_values(self):
+        self.assertIsNone(ScaledColumn.encode(np.array([1.23], np.float32), 1))
+        # out of the range of int16
+        self.assertIsNone(ScaledColumn.encode(np.array([4000.1], np.float32), 1))
+
+    def test_scaled_column_appended(self):
+        values = _recorded_temperatures(np.random.default_rng(0))
+        column = ScaledColumn.encode(values, 1)
+        new = values[:300]
+        for position in (LENGTH, 500, 0):
+            with self.subTest(position=position):
+                appended = column.appended(new, position)
+                self.assertIsInstance(appended, ScaledColumn)
+                np.testing.assert_array_equal(appended[:], np.concatenate([values[:position], new]))
+
+        # values which can't be encoded are appended as a plain array
+        appended = column.appended(np.array([1.25], np.float32), LENGTH)
+        self.assertIsInstance(appended, np.ndarray)
+        np.testing.assert_array_equal(appended, np.append(values, np.float32(1.25)))
+
+    def test_bit_column(self):
+        values = np.random.default_rng(0).random(LENGTH) < .3
+        column = BitColumn.encode(values)
+        self.assertEqual(column.nbytes, LENGTH // 8)
+        self.assertDecodesTo(column, values)
+
+        for position in (LENGTH, 503, 0):
+            with self.subTest(position=position):
+                appended = column.appended(values[:301], position)
+                np.testing.assert_array_equal(appended[:], np.concatenate([values[:position], values[:301]]))
+
+    def test_mean_column(self):
+        rng = np.random.default_rng(0)
+        first, second = _recorded_temperatures(rng), _recorded_temperatures(rng)
+        # the mean of the recorded values (float64) converted to float32, like buffer_avg in the cleaned dataset
+        expected = ((first.astype(np.float64).round(1) + second.astype(np.float64).round(1)) / 2).astype(np.float32)
+        for compact in (True, False):
+            with self.subTest(compact=compact):
+                store = TimeSeriesStore(np.arange(LENGTH), {"first": first, "second": second})
+                if compact:
+                    store.columns = {col: ScaledColumn.encode(values, 1) for col, values in store.columns.items()}
+
+                column = MeanColumn(store, "first", "second", 1)
+                self.assertEqual(column.nbytes, 0)
+                self.assertDecodesTo(column, expected)
+
+    def test_store_from_frame(self):
+        rng = np.random.default_rng(0)
+        index = pd.date_range("2023-02-10", periods=LENGTH, freq="1min", tz=PROJECT_TIMEZONE, name="received_time")
+        frame = pd.DataFrame({"recorded": _recorded_temperatures(rng), "other": rng.normal(size=LENGTH),
+                              "flag": rng.random(LENGTH) < .3}, index=index)
+        frame["recorded"] = frame["recorded"].astype(np.float32)
+        store = TimeSeriesStore.from_frame(frame, compact_decimals=1)
+        self.assertIsInstance(store.columns["recorded"], ScaledColumn)
+        self.assertIsInstance(store.columns["flag"], BitColumn)
+        # can't be stored in steps of 0.1 exactly
+        self.assertIsInstance(store.columns["other"], np.ndarray)
+
+        expected = TimeSeriesStore.from_frame(frame).to_frame()
+        pd.testing.assert_frame_equal(store.to_frame(), expected)
+        pd.testing.assert_frame_equal(store.take(100, 700).to_frame(), expected.iloc[100:700])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import tasks
+from tasks import Task, run_tasks
+
+# how long to wait for a worker at most
+WAIT_TIMEOUT = 10  # seconds
+
+
+def _graph(calls: list):
+    """A small graph like the one of prefetch.compute_view, every task records the thread it ran in."""
+
+    def task(name: str, value):
+        def func(*dependencies):
+            calls.append((name, threading.current_thread()))
+            return value + sum(dependencies)
+
+        return func
+
+    return {"period": Task(task("period", 1)),
+            "hit_times": Task(task("hit_times", 10), depends_on=("period",)),
+            "fans": Task(task("fans", 100), depends_on=("period",)),
+            "figure_0": Task(task("figure_0", 1000), depends_on=("period", "fans")),
+            "figure_1": Task(task("figure_1", 10000), depends_on=("fans", "period"))}
+
+
+class RunTasksTest(unittest.TestCase):
+    def setUp(self):
+        # one worker, which the tests can keep busy
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="test-task")
+        self.release = threading.Event()
+        self.addCleanup(self.executor.shutdown, wait=False)
+        self.addCleanup(self.release.set)
+        patch = mock.patch.object(tasks, "_executor", self.executor)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _block_worker(self):
+        """Keeps the only worker busy until self.release is set."""
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self.release.wait(WAIT_TIMEOUT)
+
+        self.executor.submit(block)
+        self.assertTrue(started.wait(WAIT_TIMEOUT))
+
+    def test_same_as_serial(self):
+        calls = []
+        expected = run_tasks(_graph(calls), serial=True)
+        self.assertEqual(expected, {"period": 1, "hit_times": 11, "fans": 101, "figure_0": 1102, "figure_1": 10102})
+        for _ in range(20):
+            results = run_tasks(_graph(calls), serial=False)
+            self.assertEqual(list(results.items()), list(expected.items()))
+
+    def test_dependencies_must_come_first(self):
+        with self.assertRaises(ValueError):
+            run_tasks({"figure": Task(lambda fans: fans, depends_on=("fans",)), "fans": Task(lambda: 1)})
+        with self.assertRaises(ValueError):
+            run_tasks({"loop": Task(lambda loop: loop, depends_on=("loop",))})
+
+    def test_caller_runs_tasks_while_workers_busy(self):
+        self._block_worker()
+        calls = []
+        self.assertEqual(run_tasks(_graph(calls), serial=False)["figure_1"], 10102)
+        self.assertEqual({thread for _, thread in calls}, {threading.current_thread()})
+
+    def test_nested_graphs(self):
+        self._block_worker()
+        calls, results = [], {}
+        # a task running a graph of its own doesn't wait for a worker either (which would never come here)
+        graph = {"outer": Task(lambda: run_tasks(_graph(calls), serial=False)),
+                 "after": Task(lambda outer: outer["figure_0"], depends_on=("outer",))}
+        run = threading.Thread(target=lambda: results.update(run_tasks(graph, serial=False)), daemon=True)
+        run.start()
+        run.join(WAIT_TIMEOUT)
+        self.assertFalse(run.is_alive())
+        self.assertEqual(results["after"], 1102)
+        self.assertEqual(len(calls), len(_graph([])))
+
+    def test_failure_cancels_the_other_tasks(self):
+        self._block_worker()
+        calls = []
+
+        def fail():
+            calls.append("fail")
+            raise RuntimeError("failed")
+
+        graph = {"fail": Task(fail), "queued": Task(lambda: calls.append("queued")),
+                 "dependent": Task(lambda failed: calls.append("dependent"), depends_on=("fail",))}
+        with self.assertRaisesRegex(RuntimeError, "failed"):
+            run_tasks(graph, serial=False)
+
+        # the queued task was cancelled before the worker got to it, the dependent one was never submitted
+        self.release.set()
+        self.executor.submit(lambda: None).result(WAIT_TIMEOUT)
+        self.assertEqual(calls, ["fail"])
+
+
+if __name__ == "__main__":
+    unittest.main()
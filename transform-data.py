@@ -1,6 +1,11 @@
 import sys
 import os
+from typing import Iterable, Iterator, Optional
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
 
 relevant_columns = [
     "received_time",
@@ -18,20 +23,137 @@ column_mapping = {
     "puffer_unten": "buffer_min"
 }
 
+# fixed types so every chunk of the raw export is parsed the same, no matter which values it happens to contain
+column_dtypes = {
+    "boiler_1": "float64",
+    "puffer_oben": "float64",
+    "puffer_unten": "float64",
+    "betriebsphase_kessel": "float64"
+}
+
+# must match the extension data.py looks for next to the csv files
+COLUMNAR_EXTENSION = ".feather"
+
+# number of rows of the raw export that are transformed and written at once. Bounds the memory used, no matter how
+# big the export (or how many unused columns it has).
+CHUNK_SIZE = 100_000
+
+
+def load_chunks(path: str, chunk_size=CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Reads and transforms the raw export in chunks of chunk_size rows."""
+    for chunk in pd.read_csv(path, usecols=relevant_columns, dtype=column_dtypes, chunksize=chunk_size):
+        chunk = chunk.rename(columns=column_mapping)
+        chunk['heating_up'] = chunk.pop('betriebsphase_kessel').isin([1, 2, 8])
+        yield chunk
+
+
+def newer_chunks(chunks: Iterable[pd.DataFrame], last_time: pd.Timestamp) -> Iterator[pd.DataFrame]:
+    """Only keeps the rows that were received after last_time."""
+    for chunk in chunks:
+        chunk = chunk[pd.to_datetime(chunk['received_time'], utc=True) > last_time]
+        if len(chunk):
+            yield chunk
+
+
+def write_data(chunks: Iterable[pd.DataFrame], path: str, append=False):
+    """
+    Writes (or appends) the chunks to the cleaned csv and its columnar file (see write_columnar_data) one at a time.
+    When appending, the columnar file is only updated if it was up-to-date with the csv before.
+    """
+    append = append and os.path.exists(path)
+    columnar = columnar_path(path)
+    update_columnar = not append or (os.path.exists(columnar) and os.path.getmtime(columnar) >= os.path.getmtime(path))
+    header = not append
+    temp_columnar = columnar + ".tmp"
+    writer = None
+    try:
+        with open(path, 'a' if append else 'w', encoding='utf-8', newline='') as csv_file:
+            for chunk in chunks:
+                chunk.to_csv(csv_file, index=False, header=header)
+                header = False
+                if not update_columnar:
+                    continue
+
+                table = _columnar_table(chunk)
+                if writer is None:
+                    if append:
+                        # Arrow IPC files can't be appended to, so the existing batches are copied into a new file
+                        with pa.memory_map(columnar) as source:
+                            reader = pa.ipc.open_file(source)
+                            schema = reader.schema
+                            writer = pa.ipc.new_file(temp_columnar, schema)
+                            for i in range(reader.num_record_batches):
+                                writer.write_batch(reader.get_batch(i))
+                    else:
+                        schema = table.schema
+                        writer = pa.ipc.new_file(temp_columnar, schema)
 
-def load_data(path: str):
-    df = pd.read_csv(path, usecols=relevant_columns)
-    df = df.rename(columns=column_mapping)
-    df['heating_up'] = df.pop('betriebsphase_kessel').isin([1, 2, 8])
-    return df
+                writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
 
+    if writer is not None:
+        os.replace(temp_columnar, columnar)
 
-def write_data(df: pd.DataFrame, path: str):
-    return df.to_csv(path, encoding='utf-8', index=False)
+
+def write_columnar_data(df: pd.DataFrame, path: str):
+    """
+    Writes an already cleaned dataset as a typed, time-sorted Feather (Arrow IPC) file which data.py prefers over the
+    csv. The time is stored as int64 nanoseconds since epoch (UTC) and buffer_avg is precomputed, so loading it
+    doesn't need any parsing at all.
+    """
+    # uncompressed so it can be memory mapped when reading
+    feather.write_feather(_columnar_table(df), path, compression='uncompressed')
+
+
+def _columnar_table(df: pd.DataFrame) -> pa.Table:
+    df = df.copy()
+    times = pd.to_datetime(df.pop('received_time'), utc=True)
+    df.insert(0, 'received_time', times.to_numpy(dtype='datetime64[ns]').view('int64'))
+    df['buffer_avg'] = (df['buffer_max'] + df['buffer_min']) / 2
+    # when streaming, only the rows within a chunk are sorted; data.py sorts the rest when loading if needed
+    df = df.sort_values('received_time', kind='stable', ignore_index=True)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def last_time(cleaned_path: str) -> Optional[pd.Timestamp]:
+    """
+    Returns the latest time in a cleaned dataset or None if it's empty. Only the time column is read, from the
+    (memory mapped) columnar file if it's up-to-date, otherwise from the csv in chunks.
+    """
+    columnar = columnar_path(cleaned_path)
+    if os.path.exists(columnar) and os.path.getmtime(columnar) >= os.path.getmtime(cleaned_path):
+        latest = pc.max(feather.read_table(columnar, columns=['received_time'], memory_map=True)['received_time'])
+        return None if latest.as_py() is None else pd.Timestamp(latest.as_py(), tz='UTC')
+
+    latest = None
+    for chunk in pd.read_csv(cleaned_path, usecols=['received_time'], chunksize=CHUNK_SIZE):
+        chunk_latest = pd.to_datetime(chunk['received_time'], utc=True).max()
+        latest = chunk_latest if latest is None or chunk_latest > latest else latest
+
+    return latest
+
+
+def columnar_path(path: str):
+    return os.path.splitext(path)[0] + COLUMNAR_EXTENSION
 
 
 if __name__ == "__main__":
-    path = sys.argv[1]
-    df = load_data(path)
-    name, ext = os.path.splitext(path)
-    write_data(df, name + "_cleaned" + ext)
+    if sys.argv[1] == "--columnar":
+        # convert already cleaned csv files (e.g. the prediction templates) without transforming them
+        for cleaned_path in sys.argv[2:]:
+            write_columnar_data(pd.read_csv(cleaned_path), columnar_path(cleaned_path))
+    else:
+        # with --append, only the rows newer than the ones already in the cleaned file are transformed and added
+        append = sys.argv[1] == "--append"
+        path = sys.argv[2] if append else sys.argv[1]
+        name, ext = os.path.splitext(path)
+        cleaned_path = name + "_cleaned" + ext
+        chunks = load_chunks(path)
+        if append and os.path.exists(cleaned_path):
+            latest = last_time(cleaned_path)
+            if latest is not None:
+                chunks = newer_chunks(chunks, latest)
+
+        write_data(chunks, cleaned_path, append)
@@ -0,0 +1,143 @@
+"""
+The heating units the dashboard can show. Every unit has its own dataset (a shard of the data of all units), its own
+prediction templates and season (see shared.Season). They're listed in UNITS_PATH as a json object from the name of
+a unit to its settings (the fields of Unit), e.g.
+
+    {"garage": {"season": [9, 6]}, "house": {"summer_prediction_csv_path": "data/units/house/summer_prediction.csv"}}
+
+Paths which aren't given are the data files of data.py in UNIT_DATA_DIR of the unit (the templates are the ones of
+data.py, they're only shapes), the season is DEFAULT_SEASON. Without UNITS_PATH there's only DEFAULT_UNIT with the
+data files of data.py.
+
+Nothing is loaded for a unit until it's looked at. What's loaded is kept in a UnitCache, which evicts the least
+recently used units once they take more memory than allowed, so a server can show many more units than it can hold.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set
+
+from profiling import nbytes
+from shared import Season, DEFAULT_SEASON
+
+UNITS_PATH = "data/units.json"
+UNIT_DATA_DIR = "data/units/{name}"
+DEFAULT_UNIT = "default"
+
+
+class Unit(NamedTuple):
+    """A heating unit and its data files."""
+    name: str
+    csv_path: str
+    summer_prediction_csv_path: str
+    winter_prediction_csv_path: str
+    season: Season = DEFAULT_SEASON
+    live_csv_path: Optional[str] = None  # a live feed of the dataset (see live.py)
+
+
+def read_units(path: str, default: Unit) -> Dict[str, Unit]:
+    """
+    Reads the units listed in a json file (see the module documentation) or returns only the default if there is none.
+
+    :param path: The json file.
+    :param default: The unit with the data files of data.py, its templates are the default for the others.
+    """
+    if not os.path.exists(path):
+        return {default.name: default}
+
+    with open(path, encoding="utf-8") as file:
+        settings: Dict[str, dict] = json.load(file)
+
+    units = {}
+    for name, unit_settings in settings.items():
+        directory = UNIT_DATA_DIR.format(name=name)
+        unit = Unit(name, os.path.join(directory, os.path.basename(default.csv_path)),
+                    default.summer_prediction_csv_path, default.winter_prediction_csv_path)
+        unit = unit._replace(**unit_settings)
+        units[name] = unit._replace(season=Season(*unit.season))
+
+    return units
+
+
+class LoadedUnit:
+    """What's loaded for a unit so far (by name, see UnitCache.part) and how many bytes it takes."""
+
+    def __init__(self, unit: Unit):
+        self.unit = unit
+        self.parts: Dict[str, Any] = {}
+        self.nbytes = 0
+        # parts are loaded one at a time, a part may need other parts of the unit
+        self.lock = threading.RLock()
+
+
+class UnitCache:
+    """
+    Keeps what's loaded for the most recently used units. Once they take more than memory_limit bytes, the least
+    recently used ones are evicted (except pinned ones and the one being loaded). Thread-safe.
+    """
+
+    def __init__(self, memory_limit: int, on_evict: Optional[Callable[[Unit], Any]] = None):
+        """
+        :param memory_limit: How many bytes the arrays of the loaded units may take (see profiling.nbytes).
+        :param on_evict: Called with every evicted unit, e.g. to clear caches which refer to its data.
+        """
+        self.memory_limit = memory_limit
+        self.on_evict = on_evict
+        self.evictions = 0
+        self._loaded: "OrderedDict[str, LoadedUnit]" = OrderedDict()
+        self._pinned: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def part(self, unit: Unit, name: str, load: Callable[[], Any]) -> Any:
+        """Returns a part of a unit (e.g. its dataset) which is loaded with load if it isn't loaded yet."""
+        with self._lock:
+            loaded = self._loaded.get(unit.name)
+            if loaded is None or loaded.unit != unit:
+                loaded = self._loaded[unit.name] = LoadedUnit(unit)
+            self._loaded.move_to_end(unit.name)
+            if name in loaded.parts:
+                return loaded.parts[name]
+
+        with loaded.lock:
+            if name not in loaded.parts:
+                loaded.parts[name] = load()
+                # the parts share arrays (e.g. indexes of the dataset), which only count once
+                loaded.nbytes = nbytes(loaded.parts)
+                self._evict(keep=unit.name)
+
+            return loaded.parts[name]
+
+    def pin(self, name: str):
+        """Never evicts the unit, e.g. while a live feed is appended to its dataset."""
+        with self._lock:
+            self._pinned.add(name)
+
+    def loaded(self) -> Dict[str, int]:
+        """Returns the bytes every loaded unit takes, the most recently used last."""
+        with self._lock:
+            return {name: loaded.nbytes for name, loaded in self._loaded.items()}
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+
+    def _evict(self, keep: str):
+        with self._lock:
+            evicted = []
+            total = sum(loaded.nbytes for loaded in self._loaded.values())
+            for name in list(self._loaded):
+                if total <= self.memory_limit:
+                    break
+                if name == keep or name in self._pinned:
+                    continue
+
+                loaded = self._loaded.pop(name)
+                total -= loaded.nbytes
+                evicted.append(loaded.unit)
+
+            self.evictions += len(evicted)
+
+        for unit in evicted:
+            if self.on_evict is not None:
+                self.on_evict(unit)
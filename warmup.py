@@ -0,0 +1,115 @@
+"""
+Warms up the dashboard when the server starts instead of during the first run of main.py (see serve.py): imports the
+modules it needs, loads the dataset and everything precomputed from it and computes the default view once (the last
+DEFAULT_DATE_OFFSET with the default thresholds, see shared.default_period). That also runs the code paths which are
+slow only the first time (e.g. plotly loading its validators). Everything lands in the same caches the dashboard uses,
+the view in the cache of the prefetched views (see prefetch.py), so a first visitor within DEFAULT_PERIOD_RESOLUTION
+only computes the statistics of the period.
+"""
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+import profiling
+from profiling import StageTiming
+from shared import Thresholds, PROJECT_TIMEZONE, DEFAULT_DATE_OFFSET, DEFAULT_LOWER_THRESHOLD, \
+    DEFAULT_UPPER_THRESHOLD, SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS, default_period, from_inputs
+from units import DEFAULT_UNIT
+
+logger = logging.getLogger(__name__)
+
+# set while no warm-up is running. Streamlit's caches don't lock while computing, a run waits for the warm-up instead of
+# loading the same data a second time next to it.
+_idle = threading.Event()
+_idle.set()
+
+
+def warm_up(now: Optional[datetime] = None) -> List[StageTiming]:
+    """
+    Warms up everything the first run of the dashboard needs (in the calling thread) for the unit it shows by default
+    and returns the timings of its stages (see profiling.summarize).
+
+    :param now: The end of the default view, defaults to now.
+    """
+    profiling.start_run(True)
+    try:
+        with profiling.stage("imports"):
+            # deferred until here, so a server started with serve.py is listening before they're imported
+            import data
+            import plots  # noqa: F401 (plotly and humanize)
+            import prefetch  # noqa: F401
+
+        with profiling.stage("load"):
+            unit = next(iter(data.load_units()))
+            data.preload_units([unit])
+
+        with profiling.stage("default_view"):
+            default_view(now, unit)
+    finally:
+        timings = profiling.finish_run()
+
+    return timings
+
+
+def default_view(now: Optional[datetime] = None, unit: str = DEFAULT_UNIT):
+    """
+    Computes the default view of a unit in the dashboard (everything main.py shows, up to serializing the charts) with
+    the same period as the first run of main.py at that time.
+    """
+    from plotly.utils import PlotlyJSONEncoder
+
+    from data import get_period_statistics, load_data, load_units, load_cycle_index, BUFFER_MAX, DRINKING_WATER
+    from plots import construct_action_phrase, construct_cycle_phrase, construct_statistics_phrase
+    from prefetch import start_prefetching
+
+    # read through the inputs like main.py reads them
+    now = now or datetime.now(PROJECT_TIMEZONE)
+    period_from, period_to = (from_inputs(time.date(), time.time()) for time in default_period(now))
+    last_time = load_data(unit).time_at(-1)
+    if period_from > last_time:
+        # nothing recorded recently (e.g. no live feed), the same code paths are warmed up with the last recorded days
+        period_to = last_time.to_pydatetime()
+        period_from = period_to - DEFAULT_DATE_OFFSET
+    thresholds = Thresholds(DEFAULT_UPPER_THRESHOLD, DEFAULT_LOWER_THRESHOLD)
+    view = start_prefetching().view(period_from, period_to, thresholds, unit)
+    construct_action_phrase(view.hit_times, period_to, thresholds, SUGGESTED_FIRE_UP_TIME_BEFORE_THRESHOLD_CROSS,
+                            season=load_units()[unit].season)
+    construct_cycle_phrase(load_cycle_index(unit).cycles(period_from, period_to), period_from, period_to)
+    statistics = get_period_statistics(period_from, period_to, thresholds, unit)
+    for fig in view.figures:
+        json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder)  # what st.plotly_chart does with them
+
+    for column in (BUFFER_MAX, DRINKING_WATER):
+        construct_statistics_phrase(statistics, column)
+
+
+def start_warm_up() -> threading.Thread:
+    """Warms up in a background thread, which logs how long it took or why it failed."""
+
+    def run():
+        try:
+            summary = profiling.summarize(warm_up())
+        except Exception:
+            logger.exception("Failed to warm up the dashboard")
+            return
+        finally:
+            _idle.set()
+
+        ms = summary.loc[["imports", "load", "default_view"], "ms"].sum()
+        logger.info("Warmed up the dashboard in %.0f ms:\n%s", ms, summary.round(1).to_string())
+
+    _idle.clear()
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_warming_up() -> bool:
+    return not _idle.is_set()
+
+
+def wait_for_warm_up(timeout: Optional[float] = None) -> bool:
+    """Waits until the warm-up (if one is running) is done, returns False if it wasn't within timeout seconds."""
+    return _idle.wait(timeout)